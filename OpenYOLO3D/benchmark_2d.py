@@ -0,0 +1,42 @@
+import os
+import sys
+import argparse
+import glob
+import os.path as osp
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='./pretrained/config.yaml', type=str, help='OpenYOLO3D config file')
+    parser.add_argument('--path_to_images', default='./data/replica/office0/color', type=str, help='Folder of frames to detect on')
+    parser.add_argument('--batch_sizes', default='1,2,4,8', type=str, help='Comma separated batch sizes to measure')
+    parser.add_argument('--num_workers', default=4, type=int, help='Pipeline worker threads (0 = main thread)')
+    parser.add_argument('--max_frames', default=200, type=int, help='Number of frames per measurement')
+    parser.add_argument('--device', default='cuda', type=str, help='Device to benchmark [cuda, cpu]')
+    opt = parser.parse_args()
+    if opt.device == 'cpu':
+        # must happen before torch initialises CUDA
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+    from utils.utils_2d import Network_2D, load_yaml
+
+    config = load_yaml(opt.config)
+    config["network2d"]["num_workers"] = opt.num_workers
+    network_2d = Network_2D(config)
+    frames = sorted(glob.glob(osp.join(opt.path_to_images, "*.jpg")), key=lambda p: int(osp.basename(p).split(".")[0]))[:opt.max_frames]
+    if len(frames) == 0:
+        print(f"No frames found in {opt.path_to_images}")
+        sys.exit(1)
+
+    # warm up kernels and the prompt cache outside the measurements
+    network_2d.inference_detector(frames[:1])
+    results = []
+    for batch_size in [int(b) for b in opt.batch_sizes.split(",")]:
+        network_2d.batch_size = batch_size
+        network_2d.prefetch = 2*max(batch_size, opt.num_workers)
+        network_2d.get_bounding_boxes(frames)
+        results.append((batch_size, network_2d.frames_per_second))
+
+    print(f"\n2D detection throughput on {opt.device} ({len(frames)} frames, {opt.num_workers} pipeline workers)")
+    print(f"{'batch size':>10} | {'frames/sec':>10}")
+    for batch_size, fps in results:
+        print(f"{batch_size:>10} | {fps:>10.2f}")
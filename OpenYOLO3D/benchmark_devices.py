@@ -0,0 +1,86 @@
+import os
+import time
+import argparse
+import tempfile
+import os.path as osp
+
+
+def timed(fn, device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.time()
+    result = fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return result, time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='./pretrained/config_replica.yaml', type=str, help='OpenYOLO3D config file')
+    parser.add_argument('--scene', default='./data/replica/office0', type=str, help='Replica scene folder')
+    parser.add_argument('--path_to_3d_masks', default='./output/replica/replica_masks', type=str,
+                        help='Pre computed 3D masks; the scene cache provides the proposals when the scene has none there')
+    parser.add_argument('--devices', default='cuda,cpu', type=str, help='Comma separated devices to compare, unavailable ones are skipped')
+    parser.add_argument('--cpu_threads', default=0, type=int, help='CPU threads (0 = all cores)')
+    parser.add_argument('--max_frames', default=0, type=int, help='Frames used by the 2D detection stage (0 = all)')
+    opt = parser.parse_args()
+    if opt.cpu_threads:
+        # NumPy's BLAS reads these when it is first imported
+        for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+            os.environ[name] = str(opt.cpu_threads)
+
+    import torch
+    import yaml
+    from utils import OpenYolo3D, WORLD_2_CAM, load_yaml
+    # the default cast budget, before any CPU run lowers it
+    from utils.mask_nms import set_cast_budget, CAST_BUDGET
+
+    config = load_yaml(opt.config)
+    scene_name = osp.basename(osp.normpath(opt.scene))
+    path_to_3d_masks = opt.path_to_3d_masks if osp.exists(osp.join(opt.path_to_3d_masks, f"{scene_name}.pt")) else None
+    depth_scale = config["openyolo3d"]["depth_scale"]
+    devices = [d for d in opt.devices.split(",") if d != 'cuda' or torch.cuda.is_available()]
+
+    results, outputs = {}, {}
+    for name in devices:
+        config["openyolo3d"]["device"] = name
+        config["openyolo3d"]["cpu_threads"] = opt.cpu_threads
+        config["openyolo3d"]["scene_cache_dir"] = config["openyolo3d"].get("scene_cache_dir") or "pretrained/scene_cache"
+        set_cast_budget(CAST_BUDGET)
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+            yaml.safe_dump(config, f)
+        openyolo3d = OpenYolo3D(f.name)
+        os.remove(f.name)
+        device = openyolo3d.device
+
+        # proposals come from the masks folder or the scene cache, filled on the first run
+        scene = openyolo3d.load_scene(opt.scene, depth_scale, path_to_3d_masks=path_to_3d_masks)
+        if opt.max_frames:
+            scene["world2cam"].color_paths = scene["world2cam"].color_paths[:opt.max_frames]
+        # warms up the detector and the prompt cache outside the measurements
+        openyolo3d.detect_scene(scene)
+
+        world2cam = WORLD_2_CAM(opt.scene, depth_scale, config)
+        _, projection_time = timed(world2cam.get_mesh_projections, device)
+        _, detection_time = timed(lambda: openyolo3d.detect_scene(scene), device)
+        prediction, labeling_time = timed(lambda: openyolo3d.label_scene(scene), device)
+        masks, classes, scores = next(iter(prediction.values()))
+        results[name] = {"projections": projection_time, "2D detection": detection_time, "labeling": labeling_time}
+        outputs[name] = (len(classes), classes.cpu().bincount(minlength=openyolo3d.num_classes))
+        num_frames = len(world2cam.poses)
+        del openyolo3d, scene, world2cam
+        if device.type == 'cuda':
+            torch.cuda.empty_cache()
+
+    print(f"\nPer stage time on {scene_name} ({num_frames} frames, "
+          f"{'pre computed' if path_to_3d_masks else 'cached'} proposals, {torch.get_num_threads()} CPU threads)")
+    print(f"{'stage':>13} | " + " | ".join(f"{name:>8}" for name in devices) + (f" | {'cpu/cuda':>8}" if {'cpu', 'cuda'} <= set(devices) else ""))
+    for stage in ["projections", "2D detection", "labeling"]:
+        row = f"{stage:>13} | " + " | ".join(f"{results[name][stage]:>7.2f}s" for name in devices)
+        if {'cpu', 'cuda'} <= set(devices):
+            row += f" | {results['cpu'][stage]/max(results['cuda'][stage], 1e-9):>7.1f}x"
+        print(row)
+    for name in devices[1:]:
+        same = outputs[name][0] == outputs[devices[0]][0] and torch.equal(outputs[name][1], outputs[devices[0]][1])
+        print(f"Labels on {name} match {devices[0]}: {same}")
@@ -0,0 +1,86 @@
+import time
+import argparse
+import torch
+from utils.mask_nms import mask_nms, pack_masks
+
+
+def legacy_get_iou(masks):
+    # get_iou before the closed-form union, kept as the reference
+    masks = masks.float()
+    intersection = torch.einsum('ij,kj -> ik', masks, masks)
+    union = torch.cat([((masks[st:st+2, None, :]+masks[None, :, :]) >= 1).sum(-1) for st in range(0, masks.shape[0], 2)])
+    return torch.div(intersection, union)
+
+
+def legacy_apply_nms(masks, scores, nms_th):
+    masks = masks.permute(1,0)
+    scored_sorted, sorted_scores_indices = torch.sort(scores, descending=True)
+    inv_sorted_scores_indices = {sorted_id.item(): id for id, sorted_id in enumerate(sorted_scores_indices)}
+    iou = legacy_get_iou(masks[sorted_scores_indices])
+    available_indices = torch.arange(len(scored_sorted))
+    for indx in range(len(available_indices)):
+        remove_indices = torch.where(iou[indx,indx+1:] > nms_th)[0]
+        available_indices[indx+1:][remove_indices] = 0
+    remaining = available_indices.unique()
+    return torch.tensor([inv_sorted_scores_indices[id.item()] for id in remaining], dtype=torch.long)
+
+
+def synthetic_proposals(num_proposals, num_points, device, seed=0):
+    """
+    Mask3D-like proposals over a scene whose points are spatially ordered:
+    contiguous segments of 0.1-5% of the scene, a third of them jittered
+    duplicates of earlier ones so NMS has something to remove.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    lengths = (torch.rand(num_proposals, generator=generator) * 0.049 + 0.001) * num_points
+    starts = torch.rand(num_proposals, generator=generator) * (num_points - lengths)
+    duplicates = torch.rand(num_proposals, generator=generator) < 0.33
+    source = (torch.rand(num_proposals, generator=generator) * torch.arange(num_proposals)).long()
+    jitter = 1 + 0.1 * torch.randn(num_proposals, generator=generator)
+    starts = torch.where(duplicates, starts[source], starts).long()
+    ends = (starts + torch.where(duplicates, lengths[source] * jitter, lengths)).long().clamp(max=num_points)
+    points = torch.arange(num_points, device=device)
+    masks = (points[None] >= starts.to(device)[:, None]) & (points[None] < ends.to(device)[:, None])
+    scores = torch.rand(num_proposals, generator=generator).to(device)
+    return masks, scores
+
+
+def timed(fn, device):
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    start = time.time()
+    result = fn()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    return result, time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--proposals', default='150,300,600,1000', type=str, help='Comma separated proposal counts')
+    parser.add_argument('--points', default=2000000, type=int, help='Points in the synthetic scene')
+    parser.add_argument('--nms', default=0.6, type=float, help='IoU threshold')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+    parser.add_argument('--legacy', default=False, action=argparse.BooleanOptionalAction, help='Also time the previous implementation (O(N^2 P) memory)')
+    opt = parser.parse_args()
+
+    print(f"{'proposals':>9} | {'points':>9} | {'kept':>5} | {'dense s':>8} | {'packed s':>8} | {'sparse s':>8} | {'matrix s':>8} | {'legacy s':>8}")
+    for num_proposals in [int(n) for n in opt.proposals.split(",")]:
+        masks, scores = synthetic_proposals(num_proposals, opt.points, opt.device)
+        keep, dense_time = timed(lambda: mask_nms(masks, scores, opt.nms), opt.device)
+
+        packed = pack_masks(masks)
+        packed_keep, packed_time = timed(lambda: mask_nms(packed, scores, opt.nms, packed_points=opt.points), opt.device)
+        sparse = masks.to_sparse()
+        sparse_keep, sparse_time = timed(lambda: mask_nms(sparse, scores, opt.nms), opt.device)
+        _, matrix_time = timed(lambda: mask_nms(masks, scores, opt.nms, mode="matrix", score_th=0.05), opt.device)
+        assert torch.equal(keep, packed_keep) and torch.equal(keep, sparse_keep), "mask layouts disagree"
+
+        legacy_time = float('nan')
+        if opt.legacy:
+            # the old index mapping was only right for proposals already in score order
+            order = torch.sort(scores, descending=True)[1]
+            legacy_keep, legacy_time = timed(lambda: legacy_apply_nms(masks[order].permute(1,0), scores[order], opt.nms), opt.device)
+            assert torch.equal(keep, order.cpu()[legacy_keep]), "keep-set differs from the previous implementation"
+        print(f"{num_proposals:>9} | {opt.points:>9} | {len(keep):>5} | {dense_time:>8.3f} | {packed_time:>8.3f} | {sparse_time:>8.3f} | {matrix_time:>8.3f} | {legacy_time:>8.3f}")
+        del masks, packed, sparse
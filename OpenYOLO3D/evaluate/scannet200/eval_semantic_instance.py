@@ -27,6 +27,8 @@
 import os, sys
 from copy import deepcopy
 from uuid import uuid4
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import pdb
 import torch
 from evaluate.scannet200.scannet_constants import HEAD_CATS_SCANNET_200, COMMON_CATS_SCANNET_200, TAIL_CATS_SCANNET_200, VALID_CLASS_IDS_200, CLASS_LABELS_200,VALID_CLASS_IDS_200_INST
@@ -87,6 +89,89 @@ opt['distance_threshes'] = np.array([float('inf')])
 opt['distance_confs'] = np.array([-float('inf')])
 
 
+def label_matches(matches, label_name, min_region_size, distance_thresh, distance_conf):
+    """
+    The matches of one class over all scenes as flat arrays: one entry per GT
+    instance and per prediction, and one per intersecting (GT, prediction) pair
+    in the order the greedy assignment visits them (GT by GT, each GT's
+    predictions in ``matched_pred`` order). The overlap of every pair and the
+    ignored points of every prediction do not depend on the overlap threshold,
+    so they are computed here once.
+    """
+    pred_index = {}
+    pred_conf, pred_verts, pred_void = [], [], []
+    for si, m in enumerate(matches):
+        for pred in matches[m]['pred'][label_name]:
+            pred_index[pred['uuid']] = len(pred_conf)
+            pred_conf.append(float(pred['confidence']))
+            pred_verts.append(pred['vert_count'])
+            pred_void.append(pred['void_intersection'])
+    gt_scene, gt_verts, gt_kept, gt_ignored = [], [], [], []
+    pair_gt, pair_pred, pair_intersection = [], [], []
+    for si, m in enumerate(matches):
+        for gt in matches[m]['gt'][label_name]:
+            for pred in gt['matched_pred']:
+                pair_gt.append(len(gt_verts))
+                pair_pred.append(pred_index[pred['uuid']])
+                pair_intersection.append(pred['intersection'])
+            gt_scene.append(si)
+            gt_verts.append(gt['vert_count'])
+            # groups and small ground truth instances are not evaluated, predictions on them are ignored
+            too_small = gt['vert_count'] < min_region_size or gt['med_dist'] > distance_thresh or gt['dist_conf'] < distance_conf
+            gt_kept.append(gt['instance_id'] >= 1000 and not too_small)
+            gt_ignored.append(int(gt['instance_id'] < 1000) + int(too_small))
+
+    table = {}
+    table['pred_conf'] = np.asarray(pred_conf, dtype=float)
+    table['pred_verts'] = np.asarray(pred_verts, dtype=np.int64)
+    table['gt_scene'] = np.asarray(gt_scene, dtype=np.int64)
+    table['gt_kept'] = np.asarray(gt_kept, dtype=bool)
+    table['pair_gt'] = np.asarray(pair_gt, dtype=np.int64)
+    table['pair_pred'] = np.asarray(pair_pred, dtype=np.int64)
+    pair_intersection = np.asarray(pair_intersection, dtype=np.int64)
+    table['pair_overlap'] = pair_intersection / (
+        np.asarray(gt_verts, dtype=np.int64)[table['pair_gt']] + table['pred_verts'][table['pair_pred']] - pair_intersection)
+    num_ignore = np.asarray(pred_void, dtype=np.int64) + np.bincount(
+        table['pair_pred'], weights=pair_intersection * np.asarray(gt_ignored, dtype=np.int64)[table['pair_gt']],
+        minlength=len(pred_conf)).astype(np.int64)
+    table['pred_ignore'] = num_ignore / np.maximum(table['pred_verts'], 1)
+    return table
+
+
+def greedy_matches(table, overlap_th):
+    """
+    Greedy assignment of one class at one overlap threshold, returning the
+    (y_true, y_score) of the precision recall curve and which GT instances
+    are matched. A GT takes the first unvisited prediction overlapping it by
+    more than ``overlap_th``; any further one is a false positive with the
+    lower of the two scores.
+    """
+    hit = table['pair_overlap'] > overlap_th
+    greedy = hit & table['gt_kept'][table['pair_gt']]
+    gt_score = np.full(len(table['gt_kept']), -float("inf"))
+    gt_matched = np.zeros(len(table['gt_kept']), dtype=bool)
+    pred_visited = np.zeros(len(table['pred_conf']), dtype=bool)
+    duplicate_scores = []
+    for gti, pi in zip(table['pair_gt'][greedy].tolist(), table['pair_pred'][greedy].tolist()):
+        if pred_visited[pi]:
+            continue
+        confidence = table['pred_conf'][pi]
+        if gt_matched[gti]:
+            duplicate_scores.append(min(gt_score[gti], confidence))
+            gt_score[gti] = max(gt_score[gti], confidence)
+        else:
+            gt_matched[gti] = True
+            gt_score[gti] = confidence
+            pred_visited[pi] = True
+    # predictions overlapping no GT instance of their class are false positives unless mostly ignored
+    found_gt = np.zeros(len(table['pred_conf']), dtype=bool)
+    found_gt[table['pair_pred'][hit]] = True
+    false_positives = ~found_gt & (table['pred_ignore'] <= overlap_th)
+    y_true = np.concatenate([np.ones(gt_matched.sum()), np.zeros(len(duplicate_scores) + false_positives.sum())])
+    y_score = np.concatenate([gt_score[gt_matched], duplicate_scores, table['pred_conf'][false_positives]])
+    return y_true, y_score, gt_matched
+
+
 def evaluate_matches(matches):
     overlaps = opt['overlaps']
     min_region_sizes = [opt['min_region_sizes'][0]]
@@ -99,6 +184,7 @@ def evaluate_matches(matches):
     rc = np.zeros((len(dist_threshes), len(CLASS_LABELS), len(overlaps)), float) # recall
     matched_predictions_category_names = {} #set([])
     gt_category_names = {} #set([])
+    scene_names = list(matches.keys())
     
     WI = dict(zip([round(ov,2) for ov in overlaps],len(overlaps)*[0.0]))
     A_OSE = dict(zip([round(ov,2) for ov in overlaps],len(overlaps)*[0.0]))
@@ -116,119 +202,20 @@ def evaluate_matches(matches):
 
     for di, (min_region_size, distance_thresh, distance_conf) in enumerate(
             zip(min_region_sizes, dist_threshes, dist_confs)):
+        tables = [label_matches(matches, label_name, min_region_size, distance_thresh, distance_conf) for label_name in CLASS_LABELS]
+        for label_name, table in zip(CLASS_LABELS, tables):
+            for si in np.unique(table['gt_scene'][table['gt_kept']]):
+                gt_category_names[scene_names[si]].add(label_name)
         
         for oi, overlap_th in enumerate(overlaps):
-            pred_visited = {}
-            for m in matches:
-                for p in matches[m]['pred']:
-                    for label_name in CLASS_LABELS:
-                        for p in matches[m]['pred'][label_name]:
-                            if 'uuid' in p:
-                                pred_visited[p['uuid']] = False
-
-
             for li, label_name in enumerate(CLASS_LABELS):
-                y_true = np.empty(0)
-                y_score = np.empty(0)
-                hard_false_negatives = 0
-                has_gt = False
-                has_pred = False
-
-                for m in matches:
-                    
-                    #group all common and tail under unknown
-                    
-                    
-                    pred_instances = matches[m]['pred'][label_name]
-                    gt_instances = matches[m]['gt'][label_name]
-                    
-                        
-                    
-                    # filter groups in ground truth
-                    gt_instances = [gt for gt in gt_instances if
-                                    gt['instance_id'] >= 1000 and gt['vert_count'] >= min_region_size and gt[
-                                        'med_dist'] <= distance_thresh and gt['dist_conf'] >= distance_conf]
-                    if gt_instances:
-                        has_gt = True
-                    if pred_instances:
-                        has_pred = True
-
-                    cur_true = np.ones(len(gt_instances))
-                    cur_score = np.ones(len(gt_instances)) * (-float("inf"))
-                    cur_match = np.zeros(len(gt_instances), dtype=bool)
-                    # collect matches
-                    for (gti, gt) in enumerate(gt_instances):
-                        gt_category_names[m].add(ID_TO_LABEL[gt['label_id']])
-                        found_match = False
-                        num_pred = len(gt['matched_pred'])
-                        for pred in gt['matched_pred']:
-                                
-                            
-                            # greedy assignments
-                            if pred_visited[pred['uuid']]:
-                                continue
-                            overlap = float(pred['intersection']) / (
-                                        gt['vert_count'] + pred['vert_count'] - pred['intersection'])
-                            # print("overlap", overlap)
-                            if overlap > overlap_th:
-                                confidence = pred['confidence']
-                                # if already have a prediction for this gt,
-                                # the prediction with the lower score is automatically a false positive
-                                if cur_match[gti]:
-                                    max_score = max(cur_score[gti], confidence)
-                                    min_score = min(cur_score[gti], confidence)
-                                    cur_score[gti] = max_score
-                                    # append false positive
-                                    cur_true = np.append(cur_true, 0)
-                                    cur_score = np.append(cur_score, min_score)
-                                    cur_match = np.append(cur_match, True)
-                                # otherwise set score
-                                else:
-                                    found_match = True
-                                    cur_match[gti] = True
-                                    cur_score[gti] = confidence
-                                    pred_visited[pred['uuid']] = True
-                        if not found_match:
-                            hard_false_negatives += 1
-                        if found_match:
-                            #pdb.set_trace()
-                            matched_predictions_category_names[di][oi][m].add(ID_TO_LABEL[gt['label_id']])
-                    # remove non-matched ground truth instances
-                    cur_true = cur_true[cur_match == True]
-                    cur_score = cur_score[cur_match == True]
-
-                    # collect non-matched predictions as false positive
-                    for pred in pred_instances:
-                            
-                            
-                        found_gt = False
-                        for gt in pred['matched_gt']:
-                            
-                            overlap = float(gt['intersection']) / (
-                                        gt['vert_count'] + pred['vert_count'] - gt['intersection'])
-                            if overlap > overlap_th:
-                                found_gt = True
-                                break
-                        if not found_gt:
-                            num_ignore = pred['void_intersection']
-                            for gt in pred['matched_gt']:
-                                # group?
-                                if gt['instance_id'] < 1000:
-                                    num_ignore += gt['intersection']
-                                # small ground truth instances
-                                if gt['vert_count'] < min_region_size or gt['med_dist'] > distance_thresh or gt[
-                                    'dist_conf'] < distance_conf:
-                                    num_ignore += gt['intersection']
-                            proportion_ignore = float(num_ignore) / pred['vert_count']
-                            # if not ignored append false positive
-                            if proportion_ignore <= overlap_th:
-                                cur_true = np.append(cur_true, 0)
-                                confidence = pred["confidence"]
-                                cur_score = np.append(cur_score, confidence)
-
-                    # append to overall results
-                    y_true = np.append(y_true, cur_true)
-                    y_score = np.append(y_score, cur_score)
+                table = tables[li]
+                has_gt = bool(table['gt_kept'].any())
+                has_pred = len(table['pred_conf']) > 0
+                y_true, y_score, gt_matched = greedy_matches(table, overlap_th)
+                hard_false_negatives = int(np.count_nonzero(table['gt_kept'] & ~gt_matched))
+                for si in np.unique(table['gt_scene'][gt_matched]):
+                    matched_predictions_category_names[di][oi][scene_names[si]].add(label_name)
 
                 # compute average precision
                 if has_gt and has_pred:
@@ -507,11 +494,29 @@ def make_pred_info(pred: dict):
         # info["label_id"] = pred['pred_classes'][i]
         info["label_id"] = PRED_ID_TO_ID[pred['pred_classes'][i]]
         info["conf"] = pred['pred_scores'][i]
-        info["mask"] = pred['pred_masks'][:, i]
         pred_info[uuid4()] = info  # we later need to identify these objects
     return pred_info
 
 
+def intersection_table(pred_masks, gt_columns, num_columns):
+    """
+    (masks, num_columns) number of points of every mask in each GT column, one
+    bincount over the (mask, column) pairs of all inside points instead of a
+    full pass over the scene per (mask, GT instance). ``pred_masks`` are
+    (points, masks), dense (numpy or torch) or bit-packed (utils.packed_masks.PackedMasks).
+    """
+    if hasattr(pred_masks, "packed"):
+        num_masks = len(pred_masks)
+        # unpacked a block of masks at a time, never as one dense array
+        mask_ids, point_ids = (ids.numpy() for ids in pred_masks.cpu().nonzero())
+    else:
+        pred_masks = pred_masks.cpu().numpy() if isinstance(pred_masks, torch.Tensor) else np.asarray(pred_masks)
+        num_masks = pred_masks.shape[1]
+        point_ids, mask_ids = np.divmod(np.flatnonzero(pred_masks != 0), num_masks)
+    pairs = mask_ids * num_columns + gt_columns[point_ids]
+    return np.bincount(pairs, minlength=num_masks * num_columns).reshape(num_masks, num_columns)
+
+
 def assign_instances_for_scan(pred: dict, gt_file: str):
     pred_info = make_pred_info(pred)
     
@@ -533,24 +538,23 @@ def assign_instances_for_scan(pred: dict, gt_file: str):
     for label in CLASS_LABELS:
         pred2gt[label] = []
     num_pred_instances = 0
-    # mask of void labels in the groundtruth
-    bool_void = np.logical_not(np.in1d(gt_ids // 1000, VALID_CLASS_IDS))
+    assert (pred['pred_masks'].shape[0] == len(gt_ids))
+    # prediction x gt id intersections, the gt ids including void and unlabeled points
+    instance_ids, gt_columns = np.unique(gt_ids, return_inverse=True)
+    intersections = intersection_table(pred['pred_masks'], gt_columns.reshape(-1), len(instance_ids))
+    gt_column = dict(zip(instance_ids.tolist(), range(len(instance_ids))))
+    # columns of void labels in the groundtruth
+    void_intersections = intersections[:, np.logical_not(np.isin(instance_ids // 1000, VALID_CLASS_IDS))].sum(axis=1)
+    vert_counts = intersections.sum(axis=1)
     # go thru all prediction masks
-    for uuid in pred_info:
+    for mask_id, uuid in enumerate(pred_info):
         
         label_id = int(pred_info[uuid]['label_id'])
         conf = pred_info[uuid]['conf']
         if not label_id in ID_TO_LABEL:
             continue
         label_name = ID_TO_LABEL[label_id]
-        # read the mask
-        pred_mask = pred_info[uuid]['mask']
-        #print(pred_mask.shape , gt_ids.shape)
-        #print(len(pred_mask) , len(gt_ids))
-        assert (len(pred_mask) == len(gt_ids))
-        # convert to binary
-        pred_mask = np.not_equal(pred_mask, 0)
-        num = np.count_nonzero(pred_mask)
+        num = int(vert_counts[mask_id])
         if num < opt['min_region_sizes'][0]:
             continue  # skip if empty
             
@@ -561,13 +565,13 @@ def assign_instances_for_scan(pred: dict, gt_file: str):
         pred_instance['label_id'] = label_id
         pred_instance['vert_count'] = num
         pred_instance['confidence'] = conf
-        pred_instance['void_intersection'] = np.count_nonzero(np.logical_and(bool_void, pred_mask))
+        pred_instance['void_intersection'] = int(void_intersections[mask_id])
         
         # matched gt instances
         matched_gt = []
         # go thru all gt instances with matching label
         for (gt_num, gt_inst) in enumerate(gt2pred[label_name]):
-            intersection = np.count_nonzero(np.logical_and(gt_ids == gt_inst['instance_id'], pred_mask))
+            intersection = int(intersections[mask_id, gt_column[gt_inst['instance_id']]])
             # print("intersection", intersection)
             if intersection > 0:
                 gt_copy = gt_inst.copy()
@@ -584,6 +588,18 @@ def assign_instances_for_scan(pred: dict, gt_file: str):
     return gt2pred, pred2gt
 
 
+def assign_instances(preds: list, gt_files: list, num_workers=0):
+    """
+    ``assign_instances_for_scan`` of every scene, in order. With ``num_workers``
+    the scenes are matched in a pool of forked processes, which inherit the
+    label globals ``evaluate`` sets for the dataset.
+    """
+    if num_workers <= 0 or len(preds) < 2:
+        return (assign_instances_for_scan(pred, gt_file) for pred, gt_file in zip(preds, gt_files))
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("fork")) as pool:
+        return list(pool.map(assign_instances_for_scan, preds, gt_files))
+
+
 def print_results(avgs):
     global DATASET_NAME
     sep = ""
@@ -832,7 +848,7 @@ def write_result_file(avgs, filename):
             f.write(_SPLITTER.join([str(x) for x in [class_name, class_id, ap, ap50, ap25]]) + '\n')
 
 
-def evaluate(preds: dict, gt_path: str, output_file: str, dataset: str = "scannet", pretrained_on_scannet200=True):
+def evaluate(preds: dict, gt_path: str, output_file: str, dataset: str = "scannet", pretrained_on_scannet200=True, num_workers=0):
     #pdb.set_trace()
     global DATASET_NAME
     global CLASS_LABELS
@@ -941,6 +957,7 @@ def evaluate(preds: dict, gt_path: str, output_file: str, dataset: str = "scanne
     
     print('evaluating', len(preds), 'scans...')
     matches = {}
+    gt_files = []
     for i, (k, v) in enumerate(preds.items()):
         # gt_file_ = os.path.join(gt_path, k + ".txt")
         # gt_ids = torch.tensor(util_3d.load_ids(gt_file_))
@@ -981,11 +998,11 @@ def evaluate(preds: dict, gt_path: str, output_file: str, dataset: str = "scanne
         gt_file = os.path.join(gt_path, k + ".txt") #"_inst.txt"
         if not os.path.isfile(gt_file):
             util.print_error('Scan {} does not match any gt file'.format(k), user_fault=True)
+        gt_files.append(gt_file)
 
+    # assign gt to predictions, scene by scene or in a process pool
+    for i, (gt_file, (gt2pred, pred2gt)) in enumerate(zip(gt_files, assign_instances(list(preds.values()), gt_files, num_workers))):
         matches_key = os.path.abspath(gt_file)
-        # assign gt to predictions
-        gt2pred, pred2gt = assign_instances_for_scan(v, gt_file)
-
         matches[matches_key] = {}
         matches[matches_key]['gt'] = gt2pred
         matches[matches_key]['pred'] = pred2gt
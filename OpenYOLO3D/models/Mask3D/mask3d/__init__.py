@@ -185,7 +185,7 @@ def prepare_data(pointcloud_file, datatype, device):
         if len(point2segment) > 0:
             input_dict["labels"] = point2segment
             coordinates, _, point2segment = ME.utils.sparse_collate(**input_dict)
-            point2segment = point2segment.cuda()
+            point2segment = point2segment.to(device)
         else:
             coordinates, _ = ME.utils.sparse_collate(**input_dict)
             point2segment = None
@@ -208,7 +208,13 @@ def map_output_to_pointcloud(outputs,
                              inverse_map,
                              point2segment, 
                              point2segment_full):
-    
+    result_pred_mask, score = map_output_to_voxels(outputs, point2segment)
+    result_pred_mask = result_pred_mask.float()
+    result_pred_mask = get_full_res_mask(result_pred_mask, inverse_map, point2segment_full[0]) if point2segment_full is not None else result_pred_mask[inverse_map]
+    return (result_pred_mask, score)
+
+def map_output_to_voxels(outputs, point2segment):
+    """(voxels, queries) bool masks and scores, before expanding them to every input point"""
     # parse predictions
     logits = outputs["pred_logits"]
     logits = torch.functional.F.softmax(logits, dim=-1)[..., :-1]
@@ -232,8 +238,7 @@ def map_output_to_pointcloud(outputs,
         result_pred_mask.sum(0) + 1e-6
     )
     score = scores_per_query * mask_scores_per_image
-    result_pred_mask = get_full_res_mask(result_pred_mask, inverse_map, point2segment_full[0]) if point2segment_full is not None else result_pred_mask[inverse_map]
-    return (result_pred_mask, score)
+    return (result_pred_mask.bool(), score)
 
 def get_full_res_mask(mask, inverse_map, point2segment_full):
     mask = mask.detach().cpu()[inverse_map]  # full res
@@ -12,6 +12,7 @@ from benchmark.evaluate_semantic_instance import evaluate
 from collections import defaultdict
 from sklearn.cluster import DBSCAN
 from utils.votenet_utils.eval_det import eval_det
+from utils.batched_dbscan import batched_dbscan, split_by_cluster
 from datasets.scannet200.scannet200_splits import (
     HEAD_CATS_SCANNET_200,
     TAIL_CATS_SCANNET_200,
@@ -676,44 +677,72 @@ class InstanceSegmentation(pl.LightningModule):
                     ]
                     offset_coords_idx += curr_coords_idx
 
-                    for curr_query in range(masks.shape[1]):
-                        curr_masks = masks[:, curr_query] > 0
-
-                        if curr_coords[curr_masks].shape[0] > 0:
-                            clusters = (
-                                DBSCAN(
-                                    eps=self.config.general.dbscan_eps,
-                                    min_samples=self.config.general.dbscan_min_points,
-                                    n_jobs=-1,
-                                )
-                                .fit(curr_coords[curr_masks])
-                                .labels_
-                            )
-
-                            new_mask = torch.zeros(curr_masks.shape, dtype=int)
-                            new_mask[curr_masks] = (
-                                torch.from_numpy(clusters) + 1
+                    if (
+                        self.config.general.get("dbscan_backend", "batched")
+                        == "batched"
+                    ):
+                        # all queries clustered at once on the model's device
+                        clusters = batched_dbscan(
+                            torch.as_tensor(curr_coords).to(self.device).double(),
+                            masks > 0,
+                            self.config.general.dbscan_eps,
+                            self.config.general.dbscan_min_points,
+                        )
+                        cluster_masks, cluster_queries = split_by_cluster(
+                            masks, *clusters
+                        )
+                        cluster_logits = prediction[self.decoder_id][
+                            "pred_logits"
+                        ][bid][
+                            cluster_queries.to(
+                                prediction[self.decoder_id]["pred_logits"].device
                             )
-
-                            for cluster_id in np.unique(clusters):
-                                original_pred_masks = masks[:, curr_query]
-                                if cluster_id != -1:
-                                    new_preds["pred_masks"].append(
-                                        original_pred_masks
-                                        * (new_mask == cluster_id + 1)
-                                    )
-                                    new_preds["pred_logits"].append(
-                                        prediction[self.decoder_id][
-                                            "pred_logits"
-                                        ][bid, curr_query]
+                        ]
+                        scores, masks, classes, heatmap = self.get_mask_and_scores(
+                            cluster_logits.cpu(),
+                            cluster_masks,
+                            len(cluster_logits),
+                            self.model.num_classes - 1,
+                        )
+                    else:
+                        for curr_query in range(masks.shape[1]):
+                            curr_masks = masks[:, curr_query] > 0
+
+                            if curr_coords[curr_masks].shape[0] > 0:
+                                clusters = (
+                                    DBSCAN(
+                                        eps=self.config.general.dbscan_eps,
+                                        min_samples=self.config.general.dbscan_min_points,
+                                        n_jobs=-1,
                                     )
+                                    .fit(curr_coords[curr_masks])
+                                    .labels_
+                                )
 
-                    scores, masks, classes, heatmap = self.get_mask_and_scores(
-                        torch.stack(new_preds["pred_logits"]).cpu(),
-                        torch.stack(new_preds["pred_masks"]).T,
-                        len(new_preds["pred_logits"]),
-                        self.model.num_classes - 1,
-                    )
+                                new_mask = torch.zeros(curr_masks.shape, dtype=int)
+                                new_mask[curr_masks] = (
+                                    torch.from_numpy(clusters) + 1
+                                )
+
+                                for cluster_id in np.unique(clusters):
+                                    original_pred_masks = masks[:, curr_query]
+                                    if cluster_id != -1:
+                                        new_preds["pred_masks"].append(
+                                            original_pred_masks
+                                            * (new_mask == cluster_id + 1)
+                                        )
+                                        new_preds["pred_logits"].append(
+                                            prediction[self.decoder_id][
+                                                "pred_logits"
+                                            ][bid, curr_query]
+                                        )
+
+                        scores, masks, classes, heatmap = self.get_mask_and_scores(
+                            torch.stack(new_preds["pred_logits"]).cpu(),
+                            torch.stack(new_preds["pred_masks"]).T,
+                            len(new_preds["pred_logits"]),
+                            self.model.num_classes - 1,
+                        )
                 else:
                     scores, masks, classes, heatmap = self.get_mask_and_scores(
                         prediction[self.decoder_id]["pred_logits"][bid]
@@ -0,0 +1,216 @@
+import itertools
+import math
+
+import torch
+
+# sampled members per cell tried before the exhaustive test of two cells
+NUM_REPRESENTATIVES = 4
+
+
+def _cell_offsets(both_ways=False):
+    # cells of side eps / sqrt(3): points up to two cells apart along every
+    # axis can be within eps. Linking cells needs one of each +-offset pair.
+    # Face, edge and corner neighbours come first as they hold the most
+    # neighbours
+    offsets = [
+        offset
+        for offset in itertools.product(range(-2, 3), repeat=3)
+        if offset > (0, 0, 0) or (both_ways and offset != (0, 0, 0))
+    ]
+    return sorted(offsets, key=lambda o: (sum(abs(v) > 1 for v in o), sum(v != 0 for v in o)))
+
+
+def _member_pairs(group_a, group_b, starts, counts, pair_budget):
+    """Yields (first, second) sorted-member indices of every member pair of the group pairs, about ``pair_budget`` pairs at a time"""
+    sizes = counts[group_a] * counts[group_b]
+    ends = torch.cumsum(sizes, 0)
+    begin = 0
+    while begin < len(group_a):
+        # whole group pairs up to the budget, at least one
+        limit = (ends[begin - 1] if begin > 0 else 0) + pair_budget
+        end = max(begin + 1, int(torch.searchsorted(ends, limit, right=True)))
+        chunk_sizes = sizes[begin:end]
+        pair = torch.repeat_interleave(
+            torch.arange(begin, end, device=sizes.device), chunk_sizes
+        )
+        local = torch.arange(len(pair), device=sizes.device) - (
+            torch.cumsum(chunk_sizes, 0) - chunk_sizes
+        ).repeat_interleave(chunk_sizes)
+        other = counts[group_b][pair]
+        yield pair, starts[group_a][pair] + local // other, starts[group_b][pair] + local % other
+        begin = end
+
+
+def _compress(parent):
+    while True:
+        grandparent = parent[parent]
+        if torch.equal(grandparent, parent):
+            return parent
+        parent = grandparent
+
+
+def _union(parent, first, second):
+    """Links the components of ``first`` and ``second`` group pairs, the smaller root becomes the root"""
+    while len(first) > 0:
+        root_first, root_second = parent[first], parent[second]
+        differ = root_first != root_second
+        if not differ.any():
+            break
+        first, second = first[differ], second[differ]
+        low = torch.minimum(root_first[differ], root_second[differ])
+        high = torch.maximum(root_first[differ], root_second[differ])
+        parent.scatter_reduce_(0, high, low, reduce="amin")
+        parent = _compress(parent)
+    return parent
+
+
+def batched_dbscan(coords, masks, eps, min_samples=1, pair_budget=1 << 22):
+    """
+    DBSCAN of the points of every mask at once: the same clusters as
+    ``sklearn.cluster.DBSCAN(eps, min_samples).fit(coords[masks[:, q]])``
+    for each column q of the (N, Q) ``masks``, on the device of ``coords``.
+
+    Points of all masks are hashed once into cells of side eps / sqrt(3), so
+    the points of a (mask, cell) are all within eps of each other. Core points
+    are counted cell by cell, cells holding core points are linked with a
+    union-find over neighbouring cells, and border points join the first
+    cluster sklearn would reach them from. Distances are exact, so clusters
+    only differ from sklearn's for point pairs whose distance rounds
+    differently around eps.
+
+    Returns the (query ids, point ids) of the mask points in column then point
+    order, as ``torch.nonzero(masks.T)``, and their cluster id in the column
+    numbered like sklearn does, -1 for noise.
+    """
+    device = coords.device
+    masks = masks.to(device).bool()
+    query_ids, point_ids = torch.nonzero(masks.T, as_tuple=True)
+    labels = torch.full_like(point_ids, -1)
+    if len(point_ids) == 0:
+        return query_ids, point_ids, labels
+    eps_squared = eps * eps
+
+    # shared cell hash of the scene, padded so neighbour offsets never wrap
+    side = eps / math.sqrt(3) * (1 - 1e-6)
+    cells = torch.floor((coords - coords.min(0).values) / side).long() + 2
+    dims = cells.max(0).values + 3
+    cell_keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    num_cells = int(dims.prod())
+
+    # members sorted by (query, cell, point), grouped per (query, cell)
+    member_keys = query_ids * num_cells + cell_keys[point_ids]
+    order = torch.argsort(member_keys, stable=True)
+    member_keys, member_points = member_keys[order], point_ids[order]
+    member_queries = query_ids[order]
+    xyz = coords[member_points]
+    group_keys, group, counts = torch.unique_consecutive(
+        member_keys, return_inverse=True, return_counts=True
+    )
+    starts = torch.cumsum(counts, 0) - counts
+    num_groups = len(group_keys)
+
+    def neighbour(groups, offset):
+        delta = (offset[0] * dims[1] + offset[1]) * dims[2] + offset[2]
+        target = group_keys[groups] + delta
+        index = torch.searchsorted(group_keys, target).clamp(max=num_groups - 1)
+        found = group_keys[index] == target
+        return groups[found], index[found]
+
+    offsets, both_ways = _cell_offsets(), _cell_offsets(both_ways=True)
+
+    # core points: every member of a cell with min_samples points, the others
+    # count their neighbours until they have enough
+    neighbours = counts[group].clone()
+    if min_samples > 1:
+        sparse_members = torch.where(counts[group] < min_samples)[0]
+        for offset in both_ways:
+            sparse_members = sparse_members[neighbours[sparse_members] < min_samples]
+            if len(sparse_members) == 0:
+                break
+            group_a, group_b = neighbour(torch.unique_consecutive(group[sparse_members]), offset)
+            for _, first, second in _member_pairs(group_a, group_b, starts, counts, pair_budget):
+                close = ((xyz[first] - xyz[second]) ** 2).sum(1) <= eps_squared
+                neighbours += torch.bincount(first[close], minlength=len(xyz))
+    core = neighbours >= min_samples
+    core_groups = torch.zeros(num_groups, dtype=torch.bool, device=device)
+    core_groups[group[core]] = True
+
+    # link neighbouring cells with core points closer than eps, nearest offsets first
+    parent = torch.arange(num_groups, device=device)
+    candidates = torch.where(core_groups)[0]
+    for offset in offsets:
+        group_a, group_b = neighbour(candidates, offset)
+        keep = core_groups[group_b] & (parent[group_a] != parent[group_b])
+        group_a, group_b = group_a[keep], group_b[keep]
+        if len(group_a) == 0:
+            continue
+        # a few members per cell settle most pairs, the rest are tested exhaustively
+        sampled = torch.clamp(counts, max=NUM_REPRESENTATIVES)
+        for pairs_a, pairs_b, sizes in [(group_a, group_b, sampled), (None, None, counts)]:
+            if pairs_a is None:
+                keep = parent[group_a] != parent[group_b]
+                pairs_a, pairs_b = group_a[keep], group_b[keep]
+            linked = torch.zeros(len(pairs_a), dtype=torch.bool, device=device)
+            for pair, first, second in _member_pairs(pairs_a, pairs_b, starts, sizes, pair_budget):
+                close = ((xyz[first] - xyz[second]) ** 2).sum(1) <= eps_squared
+                close &= core[first] & core[second]
+                linked[pair[close]] = True
+            parent = _union(parent, pairs_a[linked], pairs_b[linked])
+
+    # clusters of a query numbered by their first core point, as sklearn expands them
+    roots = parent[group[core]]
+    first_point = torch.full((num_groups,), len(coords), dtype=torch.long, device=device)
+    first_point.scatter_reduce_(0, roots, member_points[core], reduce="amin")
+    cluster_roots = torch.unique(roots)
+    root_queries = torch.zeros(num_groups, dtype=torch.long, device=device)
+    root_queries[roots] = member_queries[core]
+    rank = torch.argsort(root_queries[cluster_roots] * len(coords) + first_point[cluster_roots])
+    cluster_roots = cluster_roots[rank]
+    cluster_queries = root_queries[cluster_roots]
+    query_counts = torch.bincount(cluster_queries, minlength=masks.shape[1])
+    root_labels = torch.full((num_groups,), -1, dtype=torch.long, device=device)
+    root_labels[cluster_roots] = torch.arange(len(cluster_roots), device=device) - (
+        torch.cumsum(query_counts, 0) - query_counts
+    )[cluster_queries]
+    group_labels = torch.where(core_groups, root_labels[parent], -1)
+    member_labels = torch.where(core, group_labels[group], -1)
+
+    # border points join the lowest numbered cluster with a core point within
+    # eps, the one sklearn expands first; core points of their own cell always are
+    border = ~core
+    if border.any():
+        border_labels = torch.where(core_groups[group], group_labels[group], len(coords))
+        border_groups = torch.unique_consecutive(group[border])
+        for offset in both_ways:
+            group_a, group_b = neighbour(border_groups, offset)
+            keep = core_groups[group_b]
+            for _, first, second in _member_pairs(group_a[keep], group_b[keep], starts, counts, pair_budget):
+                close = (((xyz[first] - xyz[second]) ** 2).sum(1) <= eps_squared) & border[first] & core[second]
+                border_labels.scatter_reduce_(0, first[close], member_labels[second[close]], reduce="amin")
+        member_labels[border] = torch.where(border_labels < len(coords), border_labels, -1)[border]
+
+    labels[order] = member_labels
+    return query_ids, point_ids, labels
+
+
+def split_by_cluster(values, query_ids, point_ids, labels):
+    """
+    (N, K) columns of the (N, Q) ``values`` kept to the points of each cluster
+    of ``batched_dbscan`` and zero elsewhere, clusters ordered by column then
+    id, with the (K,) column each one comes from.
+    """
+    clustered = labels >= 0
+    query_ids, point_ids, labels = query_ids[clustered], point_ids[clustered], labels[clustered]
+    num_clusters = torch.zeros(values.shape[1], dtype=torch.long, device=labels.device)
+    num_clusters.scatter_reduce_(0, query_ids, labels + 1, reduce="amax")
+    first_column = torch.cumsum(num_clusters, 0) - num_clusters
+    cluster_values = torch.zeros(
+        (values.shape[0], int(num_clusters.sum())), dtype=values.dtype, device=values.device
+    )
+    columns = (first_column[query_ids] + labels).to(values.device)
+    point_ids, query_ids = point_ids.to(values.device), query_ids.to(values.device)
+    cluster_values[point_ids, columns] = values[point_ids, query_ids]
+    cluster_queries = torch.repeat_interleave(
+        torch.arange(values.shape[1], device=num_clusters.device), num_clusters
+    )
+    return cluster_values, cluster_queries
@@ -0,0 +1,46 @@
+import sys
+import argparse
+import os.path as osp
+import numpy as np
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='./pretrained/config_replica.yaml', type=str, help='OpenYOLO3D config file')
+    parser.add_argument('--path_2_scene_data', default='./data/replica/office0', type=str, help='Scene folder with poses/, depth/, color/ and intrinsics.txt')
+    parser.add_argument('--depth_scale', default=None, type=float, help='Depth scale (default: openyolo3d.depth_scale of the config)')
+    parser.add_argument('--frequency', default=None, type=int, help='Replay every n-th frame (default: openyolo3d.frequency of the config)')
+    parser.add_argument('--max_frames', default=-1, type=int, help='Stop after this many frames (-1 = all)')
+    parser.add_argument('--report_every', default=25, type=int, help='Print current instances every n frames')
+    parser.add_argument('--text', default=None, type=str, help='Comma separated prompts (default: network2d.text_prompts of the config)')
+    opt = parser.parse_args()
+
+    from utils import OpenYolo3D, WORLD_2_CAM, LiveSession
+    from utils.frame_store import FrameStore
+
+    openyolo3d = OpenYolo3D(opt.config)
+    config = openyolo3d.openyolo3d_config
+    if opt.frequency is not None:
+        config["openyolo3d"]["frequency"] = opt.frequency
+    depth_scale = opt.depth_scale if opt.depth_scale is not None else config["openyolo3d"]["depth_scale"]
+    # the scene folder only provides the frame list, intrinsics and poses; frames are then fed one by one
+    scene = WORLD_2_CAM(opt.path_2_scene_data, depth_scale, config)
+    num_frames = len(scene.poses) if opt.max_frames == -1 else min(opt.max_frames, len(scene.poses))
+    if num_frames == 0:
+        print(f"No frames found in {opt.path_2_scene_data}")
+        sys.exit(1)
+
+    intrinsic = scene.adjust_intrinsic(np.loadtxt(scene.intrinsics[0]), scene.image_resolution, scene.depth_resolution)
+    session = LiveSession(openyolo3d, intrinsic, depth_scale, text=opt.text.split(",") if opt.text else None)
+    color_frames = FrameStore(scene.color_paths[:num_frames], scene.color_frames.num_workers, scene.color_frames.prefetch)
+    print(f"[🚀 ACTION] Replaying {num_frames} frames of {osp.basename(osp.normpath(opt.path_2_scene_data))} ...")
+    for frame_id in range(num_frames):
+        latency = session.add_frame(color_frames.read([frame_id])[0], scene.depth_frames.read([frame_id])[0], np.loadtxt(scene.poses[frame_id]))
+        if (frame_id+1) % opt.report_every == 0 or frame_id+1 == num_frames:
+            instances = session.instances()
+            labeled = 0 if instances is None else int((instances[1] != session.num_classes-1).sum())
+            print(f"[🕒 INFO] Frame {frame_id+1}/{num_frames}: {latency*1000:.1f} ms, {session.num_points} points, {labeled} labeled instances")
+    color_frames.close()
+    scene.depth_frames.close()
+
+    print(f"[✅ INFO] Replay completed {session.stats()}")
+    print(f"[🕒 INFO] Frame loading: color {color_frames.stats()}, depth {scene.depth_frames.stats()}")
@@ -3,8 +3,10 @@ import torch
 from tqdm import tqdm
 import argparse
 from evaluate import SCENE_NAMES_REPLICA, SCENE_NAMES_SCANNET200, evaluate_scannet200, evaluate_replica
-from utils import OpenYolo3D
+from utils import OpenYolo3D, ScenePipeline
 import yaml
+import time
+import os
 import os.path as osp
 
 class InstSegEvaluator():
@@ -12,17 +14,17 @@ class InstSegEvaluator():
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.dataset_type = dataset_type
 
-    def evaluate_full(self, preds, scene_gt_dir, dataset, output_file='temp_output.txt', pretrained_on_scannet200=True):
+    def evaluate_full(self, preds, scene_gt_dir, dataset, output_file='temp_output.txt', pretrained_on_scannet200=True, num_workers=0):
         if dataset == "replica":
-            inst_AP = evaluate_replica(preds, scene_gt_dir, output_file=output_file, dataset=dataset)
+            inst_AP = evaluate_replica(preds, scene_gt_dir, output_file=output_file, dataset=dataset, num_workers=num_workers)
         elif dataset == "scannet200":
-            inst_AP = evaluate_scannet200(preds, scene_gt_dir, output_file=output_file, dataset=dataset, pretrained_on_scannet200 = pretrained_on_scannet200)
+            inst_AP = evaluate_scannet200(preds, scene_gt_dir, output_file=output_file, dataset=dataset, pretrained_on_scannet200 = pretrained_on_scannet200, num_workers=num_workers)
         else:
             print("DATASET NOT SUPPORTED!")
             exit()
         return inst_AP
 
-def test_pipeline_full(dataset_type, path_to_3d_masks, is_gt):
+def test_pipeline_full(dataset_type, path_to_3d_masks, is_gt, pipeline=True, eval_workers=4, openyolo3d=None, profile_dir=None):
     config = load_yaml(osp.join(f'./pretrained/config_{dataset_type}.yaml'))
     path_2_dataset = osp.join('./data', dataset_type)
     gt_dir = osp.join('./data', dataset_type, 'ground_truth')
@@ -36,28 +38,57 @@ def test_pipeline_full(dataset_type, path_to_3d_masks, is_gt):
         datatype="mesh"
         
     evaluator = InstSegEvaluator(dataset_type)
-    openyolo3d = OpenYolo3D(f"./pretrained/config_{dataset_type}.yaml")
-    predictions = {}
-    for scene_name in tqdm(scene_names):
+    if openyolo3d is None:
+        openyolo3d = OpenYolo3D(f"./pretrained/config_{dataset_type}.yaml")
+    
+    def load(scene_name):
         scene_id = scene_name.replace("scene", "")
         processed_file = osp.join(path_2_dataset, scene_name, f"{scene_id}.npy") if dataset_type == "scannet200" else None
-        prediction = openyolo3d.predict(path_2_scene_data = osp.join(path_2_dataset, scene_name), 
-                                        depth_scale = depth_scale,
-                                        datatype = datatype, 
-                                        processed_scene = processed_file,
-                                        path_to_3d_masks = path_to_3d_masks,
-                                        is_gt = is_gt)
-        predictions.update(prediction)
+        return openyolo3d.load_scene(osp.join(path_2_dataset, scene_name), depth_scale, datatype,
+                                     processed_scene = processed_file,
+                                     path_to_3d_masks = path_to_3d_masks)
+    
+    def label(scene):
+        scene_name, (masks, classes, scores) = next(iter(openyolo3d.label_scene(scene, is_gt).items()))
+        return scene_name, {
+            'pred_masks': masks.cpu(),
+            'pred_scores': torch.ones_like(scores).cpu().numpy(),
+            'pred_classes': classes.cpu().numpy()}
+    
+    stages = [("load", load), ("detect", openyolo3d.detect_scene), ("label", label)]
+    start = time.time()
+    if pipeline:
+        # scene N is detected while N+1 loads and N-1 is labeled
+        runner = ScenePipeline(stages, queue_size=config["openyolo3d"].get("pipeline_queue_size", 1))
+        preds = dict(runner.run(tqdm(scene_names)))
+        print(f"[🕒 INFO] Stage utilization {runner.stats()}")
+    else:
+        preds = {}
+        for scene_name in tqdm(scene_names):
+            scene = scene_name
+            for _, stage in stages:
+                scene = stage(scene)
+            preds[scene[0]] = scene[1]
+    print(f"[🕒 INFO] Predicted {len(preds)} scenes in {time.time()-start:.1f}s")
+    if profile_dir:
+        save_profile(openyolo3d.profiler, profile_dir, {"dataset": dataset_type, "pipeline": pipeline, "is_gt": is_gt,
+                                                       "frequency": config["openyolo3d"]["frequency"], "topk": config["openyolo3d"]["topk"],
+                                                       "topk_per_image": config["openyolo3d"]["topk_per_image"]})
     
-    preds = {}
     print("Evaluation ...")
-    for scene_name in tqdm(scene_names):
-        preds[scene_name] = {
-            'pred_masks': predictions[scene_name][0].cpu().numpy(),
-            'pred_scores': torch.ones_like(predictions[scene_name][2]).cpu().numpy(),
-            'pred_classes': predictions[scene_name][1].cpu().numpy()}
+    start = time.time()
+    inst_AP = evaluator.evaluate_full(preds, gt_dir, dataset=dataset_type, num_workers=eval_workers)
+    print(f"[🕒 INFO] Evaluation time {time.time()-start:.1f}s")
+    return inst_AP
 
-    inst_AP = evaluator.evaluate_full(preds, gt_dir, dataset=dataset_type)
+def save_profile(profiler, profile_dir, labels):
+    """Per-span JSON, Chrome trace and Prometheus metrics of the profiled scenes in ``profile_dir``"""
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler.save_json(osp.join(profile_dir, "spans.json"))
+    profiler.save_chrome_trace(osp.join(profile_dir, "trace.json"))
+    profiler.save_prometheus(osp.join(profile_dir, "metrics.prom"), labels)
+    print(f"[🕒 INFO] Profile {profiler.summary()}")
+    print(f"[✅ INFO] Profile written to {profile_dir}")
 
 def load_yaml(path):
     with open(path) as stream:
@@ -72,6 +103,9 @@ if __name__ == '__main__':
     parser.add_argument('--dataset_name', default='scannet200', type=str, help='Name of the dataset [replica, scannet200]')
     parser.add_argument('--path_to_3d_masks', default=None, type=str, help='Path to pre computed 3d masks')
     parser.add_argument('--is_gt', default=False, action=argparse.BooleanOptionalAction, help='If pre computed 3d masks are ground truth masks')
+    parser.add_argument('--pipeline', default=True, action=argparse.BooleanOptionalAction, help='Overlap loading, 2D detection and labeling of consecutive scenes')
+    parser.add_argument('--eval_workers', default=4, type=int, help='Processes matching predictions to ground truth (0 = in process)')
+    parser.add_argument('--profile_dir', default=None, type=str, help='Write per-span timings (spans.json), a Chrome trace (trace.json) and Prometheus metrics (metrics.prom) here')
     opt = parser.parse_args() 
-    test_pipeline_full(opt.dataset_name, opt.path_to_3d_masks, opt.is_gt)
+    test_pipeline_full(opt.dataset_name, opt.path_to_3d_masks, opt.is_gt, opt.pipeline, opt.eval_workers, profile_dir=opt.profile_dir)
        
\ No newline at end of file
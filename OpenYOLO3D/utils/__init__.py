@@ -1,53 +1,36 @@
 from utils.utils_3d import Network_3D
 from utils.utils_2d import Network_2D, load_yaml
+from utils.mask_nms import mask_iou, mask_nms, set_cast_budget
+from utils.projection import SparseProjections, project_visible_points
+from utils.label_maps import BoxLabelLookup, MaskPoints, box_iou_matrix, frame_votes, scores_from_votes
+from utils.scene_cache import SceneCache
+from utils.frame_store import FrameStore, image_size
+from utils.live_session import LiveSession
+from utils.scene_pipeline import ScenePipeline
+from utils.packed_masks import PackedMasks, TRANSFERS
+from utils.device import get_device, cache_bytes, configure_cpu
+from utils.profiler import Profiler
 import time
 import torch
 import os
 import os.path as osp
-import imageio
 import glob
 import open3d as o3d
 import numpy as np
 import math
+import hashlib
+import resource
 from models.Mask3D.mask3d import load_mesh_or_pc
 import colorsys
 from tqdm import tqdm
 
 def get_iou(masks):
-    masks = masks.float()
-    intersection = torch.einsum('ij,kj -> ik', masks, masks)
-    num_masks = masks.shape[0]
-    masks_batch_size = 2 # scannet 200: 20
-    if masks_batch_size < num_masks:
-        ratio = num_masks//masks_batch_size
-        remaining = num_masks-ratio*masks_batch_size
-        start_masks = list(range(0,ratio*masks_batch_size, masks_batch_size))
-        if remaining == 0:
-            end_masks = list(range(masks_batch_size,(ratio+1)*masks_batch_size,masks_batch_size))
-        else:
-            end_masks = list(range(masks_batch_size,(ratio+1)*masks_batch_size,masks_batch_size))
-            end_masks[-1] = num_masks
-    else:
-        start_masks = [0]
-        end_masks = [num_masks]
-    union = torch.cat([((masks[st:ed, None, :]+masks[None, :, :]) >= 1).sum(-1) for st,ed in zip(start_masks, end_masks)])
-    iou = torch.div(intersection,union)
-    
-    return iou
+    return mask_iou(masks)
 
-def apply_nms(masks, scores, nms_th):
-    masks = masks.permute(1,0)
-    scored_sorted, sorted_scores_indices = torch.sort(scores, descending=True)
-    inv_sorted_scores_indices = {sorted_id.item(): id for id, sorted_id in enumerate(sorted_scores_indices)}
-    maskes_sorted = masks[sorted_scores_indices]
-    iou = get_iou(maskes_sorted)
-    available_indices = torch.arange(len(scored_sorted))
-    for indx in range(len(available_indices)):
-        remove_indices = torch.where(iou[indx,indx+1:] > nms_th)[0]
-        available_indices[indx+1:][remove_indices] = 0
-    remaining = available_indices.unique()
-    keep_indices = torch.tensor([inv_sorted_scores_indices[id.item()] for id in remaining])
-    return keep_indices
+def apply_nms(masks, scores, nms_th, mode="greedy", score_th=0.0):
+    if isinstance(masks, PackedMasks):
+        return mask_nms(masks.packed, scores, nms_th, mode=mode, score_th=score_th, packed_points=masks.num_points)
+    return mask_nms(masks.permute(1,0), scores, nms_th, mode=mode, score_th=score_th)
 
 def generate_vibrant_colors(num_colors):
     colors = []
@@ -63,8 +46,14 @@ def generate_vibrant_colors(num_colors):
     return colors
 
 def get_visibility_mat(pred_masks_3d, inside_mask, topk = 15):
-    intersection = torch.einsum("ik, fk -> if", pred_masks_3d.float(), inside_mask.float())
-    total_point_number = pred_masks_3d[:, None, :].float().sum(dim = -1)
+    if isinstance(inside_mask, SparseProjections):
+        intersection = inside_mask.visible_counts(pred_masks_3d)
+    else:
+        intersection = torch.einsum("ik, fk -> if", pred_masks_3d.float(), inside_mask.float())
+    if isinstance(pred_masks_3d, PackedMasks):
+        total_point_number = pred_masks_3d.areas[:, None].float()
+    else:
+        total_point_number = pred_masks_3d[:, None, :].float().sum(dim = -1)
     visibility_matrix = intersection/total_point_number
     
     if topk > visibility_matrix.shape[-1]:
@@ -96,56 +85,156 @@ def compute_iou(box, boxes):
 class OpenYolo3D():
     def __init__(self, openyolo3d_config = ""):
         config = load_yaml(openyolo3d_config)
-        self.network_3d = Network_3D(config)
-        self.network_2d = Network_2D(config)
+        self.device = get_device(config["openyolo3d"].get("device", "auto"))
+        if self.device.type == "cpu":
+            configure_cpu(config["openyolo3d"].get("cpu_threads", 0))
+            # mask casts in blocks of an eighth of the last-level cache, as float32
+            set_cast_budget(cache_bytes()//8//4)
+        self.profiler = Profiler(self.device, enabled=config["openyolo3d"].get("profile", True),
+                                 sync_cuda=config["openyolo3d"].get("profile_sync_cuda", True))
+        self.network_3d = Network_3D(config, self.device)
+        self.network_2d = Network_2D(config, self.device, self.profiler)
         self.openyolo3d_config = config
+        # opt-in: projection entries grow with frames x visible points
+        cache_dir = config["openyolo3d"].get("scene_cache_dir", "")
+        self.scene_cache = SceneCache(os.path.join(os.getcwd(), cache_dir),
+                                      int(config["openyolo3d"].get("scene_cache_max_gb", 20)*2**30)) if cache_dir else None
     
     def predict(self, path_2_scene_data, depth_scale, text = None, datatype="point cloud", processed_scene = None, path_to_3d_masks = None, is_gt=False):
-        self.num_classes = len(text)+1 if text is not None else len(self.openyolo3d_config["network2d"]["text_prompts"])+1
-        self.datatype = datatype
-        self.world2cam = WORLD_2_CAM(path_2_scene_data, depth_scale, self.openyolo3d_config)
-        self.mesh_projections = self.world2cam.get_mesh_projections()
-        self.scaling_params = [self.world2cam.depth_resolution[0]/self.world2cam.image_resolution[0], self.world2cam.depth_resolution[1]/self.world2cam.image_resolution[1]]
-        
+        if self.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats()
+        transfers_start = dict(TRANSFERS)
+        with self.profiler.span("predict", scene=path_2_scene_data.split("/")[-1]):
+            scene = self.load_scene(path_2_scene_data, depth_scale, datatype, processed_scene, path_to_3d_masks)
+            scene = self.detect_scene(scene, text)
+            prediction = self.label_scene(scene, is_gt)
+        print(f"[🕒 INFO] Memory {self.memory_report(transfers_start)}")
+            
+        return prediction
+    
+    def load_scene(self, path_2_scene_data, depth_scale, datatype="point cloud", processed_scene = None, path_to_3d_masks = None):
+        """
+        First step of ``predict``: the cameras, the visible points per frame and
+        the 3D proposals of a scene, as a dict for ``detect_scene`` and
+        ``label_scene``. It does not touch the attributes labeling reads, so it
+        can run for one scene while another is detected or labeled.
+        """
         scene_name = path_2_scene_data.split("/")[-1]
-        print("[🚀 ACTION] 3D mask proposals computation ...")
-        start = time.time()
-        
-        if path_to_3d_masks is None:
-            self.preds_3d = self.network_3d.get_class_agnostic_masks(self.world2cam.mesh, datatype) if processed_scene is None else self.network_3d.get_class_agnostic_masks(processed_scene, datatype)
-            keep_score = self.preds_3d[1] >= self.openyolo3d_config["network3d"]["th"]
-            keep_nms = apply_nms(self.preds_3d[0][:, keep_score].cuda(), self.preds_3d[1][keep_score].cuda(), self.openyolo3d_config["network3d"]["nms"])
-            self.preds_3d = (self.preds_3d[0].cpu().permute(1,0)[keep_score][keep_nms].permute(1,0), self.preds_3d[1].cpu()[keep_score][keep_nms])
-        else:
-            self.preds_3d = torch.load(osp.join(path_to_3d_masks, f"{scene_name}.pt"))
+        with self.profiler.span("load", scene=scene_name):
+            world2cam = WORLD_2_CAM(path_2_scene_data, depth_scale, self.openyolo3d_config, self.profiler)
+            print("[🚀 ACTION] Projections computation ...")
+            start = time.time()
+            with self.profiler.span("projections", frames=len(world2cam.poses)) as span:
+                projections_key = self.scene_cache.key("projections", files=[world2cam.mesh, world2cam.intrinsics[0]] + world2cam.poses,
+                                                       stat_files=world2cam.depth_maps_paths, depth_scale=depth_scale,
+                                                       frequency=self.openyolo3d_config["openyolo3d"]["frequency"],
+                                                       vis_depth_threshold=self.openyolo3d_config["openyolo3d"]["vis_depth_threshold"],
+                                                       dtype=str(world2cam.dtype)) if self.scene_cache else None
+                mesh_projections = self.scene_cache.load_projections(projections_key) if self.scene_cache else None
+                span["cached"] = int(mesh_projections is not None)
+                if mesh_projections is None:
+                    mesh_projections = world2cam.get_mesh_projections()
+                    if self.scene_cache:
+                        self.scene_cache.store_projections(projections_key, mesh_projections)
+                span["points"] = mesh_projections.num_points
+                span["visible_points"] = len(mesh_projections.point_ids)
+            print(f"[🕒 INFO] Elapsed time {(time.time()-start)}")
+            if world2cam.depth_frames.frames_read:
+                print(f"[🕒 INFO] Depth frame loading {world2cam.depth_frames.stats()}")
             
-        print(f"[🕒 INFO] Elapsed time {(time.time()-start)}")
-        print(f"[✅ INFO] Proposals computed.")   
-
+            print("[🚀 ACTION] 3D mask proposals computation ...")
+            start = time.time()
+            
+            with self.profiler.span("proposals") as span:
+                if path_to_3d_masks is None:
+                    scene_file = world2cam.mesh if processed_scene is None else processed_scene
+                    # the checkpoint can be replaced at the same path, so its size and mtime are part of the key
+                    proposals_key = self.scene_cache.key("proposals", files=[scene_file], stat_files=[self.openyolo3d_config["network3d"]["pretrained_path"]],
+                                                         datatype=datatype, network3d=self.openyolo3d_config["network3d"]) if self.scene_cache else None
+                    preds_3d = self.scene_cache.load_proposals(proposals_key) if self.scene_cache else None
+                    span["cached"] = int(preds_3d is not None)
+                    if preds_3d is None:
+                        preds_3d = self.get_proposals(scene_file, datatype)
+                        if self.scene_cache:
+                            self.scene_cache.store_proposals(proposals_key, *preds_3d)
+                else:
+                    masks, scores = torch.load(osp.join(path_to_3d_masks, f"{scene_name}.pt"))
+                    preds_3d = (masks if isinstance(masks, PackedMasks) else PackedMasks.from_dense(masks.permute(1,0)), scores)
+                    span["cached"] = 1
+                span["proposals"] = len(preds_3d[0])
+                span["points"] = preds_3d[0].num_points
+                
+            print(f"[🕒 INFO] Elapsed time {(time.time()-start)}")
+            print(f"[✅ INFO] Proposals computed.")   
+            print(f"[🕒 INFO] Proposal masks {len(preds_3d[0])} x {preds_3d[0].num_points} points: {preds_3d[0].nbytes()/2**20:.1f} MB packed, "
+                  f"{4*len(preds_3d[0])*preds_3d[0].num_points/2**20:.1f} MB as dense float")
+            if self.scene_cache:
+                print(f"[🕒 INFO] Scene cache {self.scene_cache.stats()}")
+        return {"name": scene_name, "datatype": datatype, "world2cam": world2cam, "projections": mesh_projections, "preds_3d": preds_3d}
+    
+    def detect_scene(self, scene, text = None):
+        """Second step of ``predict``: 2D boxes on the color frames of a ``load_scene`` scene"""
         print("[🚀 ACTION] 2D Bounding Boxes computation ...")
         start = time.time()
-        self.preds_2d = self.network_2d.get_bounding_boxes(self.world2cam.color_paths, text)
-        # self.preds_2d = torch.load(osp.join(f"/share/data/drive_3/OpenYolo3D/bboxes_2d", f"{scene_name}.pt"))
+        with self.profiler.span("detect", scene=scene["name"], frames=len(scene["world2cam"].color_paths)) as span:
+            scene["num_classes"] = len(text)+1 if text is not None else len(self.openyolo3d_config["network2d"]["text_prompts"])+1
+            scene["preds_2d"] = self.network_2d.get_bounding_boxes(scene["world2cam"].color_paths, text)
+            # scene["preds_2d"] = torch.load(osp.join(f"/share/data/drive_3/OpenYolo3D/bboxes_2d", f"{scene['name']}.pt"))
+            span["boxes"] = sum(len(frame["bbox"]) for frame in scene["preds_2d"].values())
         print(f"[🕒 INFO] Elapsed time {(time.time()-start)}")
         print(f"[✅ INFO] Bounding boxes computed.")  
+        return scene
+    
+    def label_scene(self, scene, is_gt=False):
+        """Last step of ``predict``: makes ``scene`` the current one and labels its 3D masks"""
+        self.num_classes = scene["num_classes"]
+        self.datatype = scene["datatype"]
+        self.world2cam = scene["world2cam"]
+        self.scaling_params = [self.world2cam.depth_resolution[0]/self.world2cam.image_resolution[0], self.world2cam.depth_resolution[1]/self.world2cam.image_resolution[1]]
+        self.mesh_projections = scene["projections"]
+        self.preds_3d = scene["preds_3d"]
+        self.preds_2d = scene["preds_2d"]
         
         print("[🚀 ACTION] Predicting ...")
         start = time.time()
-        prediction = self.label_3d_masks_from_2d_bboxes(scene_name, is_gt)
+        with self.profiler.span("label", scene=scene["name"]) as span:
+            prediction = self.label_3d_masks_from_2d_bboxes(scene["name"], is_gt)
+            span["predictions"] = len(self.predicated_classes)
         print(f"[🕒 INFO] Elapsed time {(time.time()-start)}")
         print(f"[✅ INFO] Prediction completed")    
-            
         return prediction
     
+    def memory_report(self, transfers_start=None):
+        """Peak RSS and CUDA peak of the last profiled ``predict`` (of the process when not profiled) and packed mask host/device copies"""
+        transfers_start = transfers_start or {"bytes": 0, "seconds": 0.0}
+        span = self.profiler.last("predict")
+        report = {"peak_rss_mb": span["host_peak_mb"] if span and span["host_peak_mb"] is not None else round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, 1),
+                  "mask_copy_mb": round((TRANSFERS["bytes"]-transfers_start["bytes"])/2**20, 1),
+                  "mask_copy_s": round(TRANSFERS["seconds"]-transfers_start["seconds"], 4)}
+        if self.device.type == "cuda":
+            report["peak_cuda_mb"] = span["device_peak_mb"] if span else round(torch.cuda.max_memory_allocated()/2**20, 1)
+        return report
+    
+    def get_proposals(self, scene_file, datatype="point cloud"):
+        """Mask3D class agnostic ``PackedMasks`` and scores of a scene file after the score threshold and NMS"""
+        with self.profiler.span("mask3d") as span:
+            masks, scores = self.network_3d.get_class_agnostic_masks(scene_file, datatype)
+            span["proposals"] = len(masks)
+        keep_score = scores >= self.openyolo3d_config["network3d"]["th"]
+        masks, scores = masks[keep_score], scores[keep_score]
+        with self.profiler.span("nms", proposals=len(masks)) as span:
+            keep_nms = apply_nms(masks, scores, self.openyolo3d_config["network3d"]["nms"],
+                                 mode=self.openyolo3d_config["network3d"].get("nms_mode", "greedy"), score_th=self.openyolo3d_config["network3d"]["th"])
+            span["kept"] = len(keep_nms)
+        return (masks[keep_nms].cpu(), scores.cpu()[keep_nms])
+    
     def label_3d_masks_from_2d_bboxes(self, scene_name, is_gt=False):
-        projections_mesh_to_frame , keep_visible_points = self.mesh_projections
         predictions_2d_bboxes = self.preds_2d
         prediction_3d_masks, _ = self.preds_3d
         
-        predicted_masks, predicated_classes, predicated_scores = self.label_3d_masks_from_label_maps(prediction_3d_masks.bool(), 
+        predicted_masks, predicated_classes, predicated_scores = self.label_3d_masks_from_label_maps(prediction_3d_masks, 
                                                                                                         predictions_2d_bboxes, 
-                                                                                                        projections_mesh_to_frame,
-                                                                                                        keep_visible_points, 
+                                                                                                        self.mesh_projections,
                                                                                                         is_gt)
         
         self.predicted_masks = predicted_masks
@@ -158,88 +247,59 @@ class OpenYolo3D():
     def label_3d_masks_from_label_maps(self, 
                                         prediction_3d_masks, 
                                         predictions_2d_bboxes, 
-                                        projections_mesh_to_frame, 
-                                        keep_visible_points,
+                                        projections,
                                         is_gt):
-        
-        label_maps = self.construct_label_maps(predictions_2d_bboxes) #construct the label maps , start from the biggest bbox to small one
+        """
+        Labels every 3D mask from the 2D label maps of its most visible frames.
+        Votes are gathered one frame at a time for all masks seen in it: a
+        bincount over (mask, class) builds the class histograms and one
+        pairwise op gives the projected-box IoUs, with no per-mask loops.
+        """
+        start = time.time()
+        device = self.world2cam.device
+        if not isinstance(prediction_3d_masks, PackedMasks):
+            prediction_3d_masks = PackedMasks.from_dense(prediction_3d_masks.permute(1,0))
+        # labels are looked up from the boxes of each frame, no (frames x H x W) canvases
+        with self.profiler.span("label_maps", frames=len(predictions_2d_bboxes)):
+            label_lookup = BoxLabelLookup(predictions_2d_bboxes, self.scaling_params, self.world2cam.height, self.world2cam.width)
 
-        visibility_matrix = get_visibility_mat(prediction_3d_masks.cuda().permute(1,0), keep_visible_points.cuda(), topk = 25 if is_gt else self.openyolo3d_config["openyolo3d"]["topk"])
-        valid_frames = visibility_matrix.sum(dim=0) >= 1
+        with self.profiler.span("visibility", masks=len(prediction_3d_masks), frames=len(projections)):
+            prediction_3d_masks = prediction_3d_masks.to(device)
+            visibility_matrix = get_visibility_mat(prediction_3d_masks, projections, topk = 25 if is_gt else self.openyolo3d_config["openyolo3d"]["topk"])
+            valid_frames = (visibility_matrix.sum(dim=0) >= 1).cpu()
         
-        prediction_3d_masks = prediction_3d_masks.permute(1,0).cpu()
-        prediction_3d_masks_np = prediction_3d_masks.numpy()
-        projections_mesh_to_frame = projections_mesh_to_frame[valid_frames].cpu().numpy()
-        visibility_matrix = visibility_matrix[:, valid_frames].cpu().numpy()
-        keep_visible_points = keep_visible_points[valid_frames].cpu().numpy()
-        distributions = []
+        visibility_matrix = visibility_matrix[:, valid_frames.to(device)]
+        frame_ids = torch.where(valid_frames)[0]
+        bounding_boxes = list(predictions_2d_bboxes.values())
+        num_masks = len(prediction_3d_masks)
+        num_bins = self.num_classes+1  # bin 0 counts visible points without a label
         
-        class_labels = []
-        class_probs = []
-        class_dists = []
-        label_maps = label_maps[valid_frames].numpy()
-        bounding_boxes = predictions_2d_bboxes.values()
-        bounding_boxes_valid = [bbox for (bi, bbox) in enumerate(bounding_boxes) if valid_frames[bi]]
-        for mask_id, mask in enumerate(prediction_3d_masks_np):
-            prob_normalizer = 0
-
-            representitive_frame_ids = np.where(visibility_matrix[mask_id])[0]
-            labels_distribution = []
-            iou_vals = []
-            for representitive_frame_id in representitive_frame_ids:
-                visible_points_mask = (keep_visible_points[representitive_frame_id].squeeze()*mask).astype(bool)
-                prob_normalizer +=  visible_points_mask.sum()
-                instance_x_y_coords = projections_mesh_to_frame[representitive_frame_id][np.where(visible_points_mask)].astype(np.int64)
-                
-                boxes = bounding_boxes_valid[representitive_frame_id]["bbox"].long()
-                if len(boxes) > 0 and len(instance_x_y_coords) > 10:
-                    x_l, x_r, y_t, y_b = instance_x_y_coords[:, 0].min(), instance_x_y_coords[:, 0].max()+1, instance_x_y_coords[:, 1].min(), instance_x_y_coords[:, 1].max()+1
-                    box = torch.tensor([x_l/self.scaling_params[1], y_t/self.scaling_params[0], x_r/self.scaling_params[1], y_b/self.scaling_params[0]])
-                
-                    iou_values = compute_iou(box, boxes)
-                    iou_vals.append(iou_values.max().item())
-                selected_labels = label_maps[representitive_frame_id, instance_x_y_coords[:, 1], instance_x_y_coords[:, 0]]
-                labels_distribution.append(selected_labels)
-            
-            labels_distribution = np.concatenate(labels_distribution) if len(labels_distribution) > 0 else np.array([-1])
-            
-            # class_dists.append(labels_distribution)
-            distribution = torch.zeros(self.num_classes) if self.openyolo3d_config["openyolo3d"]["topk_per_image"] != -1 else None
-            if (labels_distribution != -1).sum() != 0:
-                
-                if distribution is not None:
-                    all_labels = torch.from_numpy(labels_distribution[labels_distribution != -1])
-                    all_labels_unique = all_labels.unique()
-                    for lb in all_labels_unique:
-                        distribution[lb] = (all_labels == lb).sum()
-                        
-                    distribution = distribution/distribution.max()
-                
-                class_label = torch.mode(torch.from_numpy(labels_distribution[labels_distribution != -1])).values.item()
-                class_prob = (labels_distribution == class_label).sum()/prob_normalizer
-            else:
-                if distribution is not None:
-                    distribution[-1] = 1.0
-                class_label = self.num_classes-1
-                class_prob = 0.0
-
-            iou_vals = torch.tensor(iou_vals)
-            
-            class_labels.append(class_label)
-            if (iou_vals != 0).sum():
-                iou_prob = iou_vals[iou_vals != 0].mean().item()
-            else:
-                iou_prob = 0.0
-            
-            class_probs.append(class_prob*iou_prob)
-            if distribution is not None:
-                distributions.append(distribution)
-                
-        pred_classes = torch.tensor(class_labels)
-        pred_scores = torch.tensor(class_probs)
-        if distribution is not None:
-            distributions = torch.stack(distributions) if len(distributions) > 0 else torch.tensor((0, self.num_classes))
+        with self.profiler.span("votes", masks=num_masks, frames=len(frame_ids)):
+            mask_points = MaskPoints(prediction_3d_masks, device)
+            histograms = torch.zeros(num_masks*num_bins, dtype=torch.long, device=device)
+            iou_sums = torch.zeros(num_masks, dtype=torch.float64, device=device)
+            iou_counts = torch.zeros(num_masks, dtype=torch.long, device=device)
+            for frame_index, frame_id in enumerate(frame_ids.tolist()):
+                mask_ids = torch.where(visibility_matrix[:, frame_index])[0]
+                mask_index, labels, iou, use = frame_votes(mask_points, mask_ids, projections.frame_lookup(frame_id, device), projections.frame(frame_id)[1],
+                                                           lambda coords: label_lookup.lookup(frame_id, coords), bounding_boxes[frame_id]["bbox"], self.scaling_params)
+                histograms += torch.bincount(mask_ids[mask_index]*num_bins + labels+1, minlength=num_masks*num_bins)
+                iou_sums.index_add_(0, mask_ids[use], iou[use])
+                iou_counts.index_add_(0, mask_ids[use], torch.ones_like(mask_ids[use]))
+        
+        with self.profiler.span("scores", masks=num_masks):
+            pred_classes, pred_scores, distributions = scores_from_votes(histograms.view(num_masks, num_bins).cpu(), iou_sums.cpu(), iou_counts.cpu(), self.num_classes, 
+                                                                         self.openyolo3d_config["openyolo3d"]["topk_per_image"] != -1)
+            prediction = self.select_topk_per_image(prediction_3d_masks.cpu(), pred_classes, pred_scores, distributions, is_gt)
         
+        self.labeling_time = time.time()-start
+        print(f"[🕒 INFO] Labeled {num_masks} masks from {len(frame_ids)} frames in {self.labeling_time:.3f}s")
+        return prediction
+    
+    def select_topk_per_image(self, prediction_3d_masks, pred_classes, pred_scores, distributions, is_gt):
+        """Masks (as ``PackedMasks``, from (N, points) dense or packed masks), classes and scores of the output"""
+        if not isinstance(prediction_3d_masks, PackedMasks):
+            prediction_3d_masks = PackedMasks.from_dense(prediction_3d_masks)
         if (self.openyolo3d_config["openyolo3d"]["topk_per_image"] != -1) and (not is_gt):
             # print("TOPK USED")
             n_instance = distributions.shape[0]
@@ -256,29 +316,10 @@ class OpenYolo3D():
             mask_idx = torch.div(idx, self.num_classes, rounding_mode="floor")
 
             pred_classes = labels[idx]
-            pred_scores = distributions[idx].cuda()
+            pred_scores = distributions[idx]
             prediction_3d_masks = prediction_3d_masks[mask_idx]
         
-        return prediction_3d_masks.permute(1,0), pred_classes, pred_scores
-    
-    def construct_label_maps(self, predictions_2d_bboxes, save_label_map=False):
-        label_maps = (torch.ones((len(predictions_2d_bboxes), self.world2cam.height, self.world2cam.width))*-1).type(torch.int16)
-        for frame_id, pred in enumerate(predictions_2d_bboxes.values()):
-            bboxes = pred["bbox"].long()
-            labels = pred["labels"].type(torch.int16)
-        
-            bboxes[:,0] = bboxes[:,0]*self.scaling_params[1]
-            bboxes[:,2] = bboxes[:,2]*self.scaling_params[1]
-            bboxes[:,1] = bboxes[:,1]*self.scaling_params[0]
-            bboxes[:,3] = bboxes[:,3]*self.scaling_params[0]
-            bboxes_weights = (bboxes[:,2]-bboxes[:,0])+(bboxes[:,3]-bboxes[:,1])
-            sorted_indices = bboxes_weights.sort(descending=True).indices
-            bboxes = bboxes[sorted_indices]
-            labels = labels[sorted_indices]
-            for id, bbox in enumerate(bboxes):
-                label_maps[frame_id, bbox[1]:bbox[3],bbox[0]:bbox[2]] = labels[id]
-                
-        return label_maps
+        return prediction_3d_masks, pred_classes, pred_scores
     
     def save_output_as_ply(self, save_path, th = 0.1):
         num_classes = len(self.predicated_classes.unique())
@@ -294,7 +335,7 @@ class OpenYolo3D():
                 class_id_mask = self.predicated_classes == class_id
                 scores_per_class = self.predicated_scores[class_id_mask]
                 class_id_max = torch.argmax(scores_per_class)
-                mask = self.predicted_masks.permute(1,0)[class_id_mask][class_id_max]
+                mask = self.predicted_masks.mask(torch.where(class_id_mask)[0][class_id_max].item()).numpy()
                 vertex_colors[mask] = np.array(vibrant_colors.pop())
                 
             mesh.vertex_colors = o3d.utility.Vector3dVector(vertex_colors)
@@ -311,7 +352,7 @@ class OpenYolo3D():
                 class_id_max = torch.argmax(scores_per_class)
                 if scores_per_class[class_id_max] < th:
                     continue
-                mask = self.predicted_masks.permute(1,0)[class_id_mask][class_id_max]
+                mask = self.predicted_masks.mask(torch.where(class_id_mask)[0][class_id_max].item()).numpy()
                 point_colors[mask] = np.array(vibrant_colors.pop())
 
             point_cloud.colors = o3d.utility.Vector3dVector(point_colors)
@@ -323,13 +364,22 @@ class OpenYolo3D():
 
 
 class WORLD_2_CAM():
-    def __init__(self, path_2_scene, depth_scale, openyolo3d_config = None):
+    def __init__(self, path_2_scene, depth_scale, openyolo3d_config = None, profiler = None):
         self.poses = {}
         self.intrinsics = {}
         self.meshes = {}
         self.depth_maps_paths = {}
         self.depth_color_paths = {}
         self.vis_depth_threshold =  openyolo3d_config["openyolo3d"]['vis_depth_threshold']
+        self.device = get_device(openyolo3d_config["openyolo3d"].get('device', 'auto'))
+        if self.device.type == "cpu":
+            # tiles of about half the last-level cache, float32 unless asked otherwise
+            tile_mb = openyolo3d_config["openyolo3d"].get('cpu_tile_mb', 0)
+            self.memory_budget = int(tile_mb*(1 << 20)) if tile_mb else cache_bytes()//2
+            self.dtype = getattr(torch, openyolo3d_config["openyolo3d"].get('cpu_projection_dtype', 'float32'))
+        else:
+            self.memory_budget = int(openyolo3d_config["openyolo3d"].get('projection_memory_mb', 1024)*(1 << 20))
+            self.dtype = torch.float64
         
         frequency = openyolo3d_config["openyolo3d"]['frequency']
         
@@ -349,13 +399,23 @@ class WORLD_2_CAM():
         self.color_paths = [osp.join(path_2_color, f"{i}.jpg") for i in list(range(num_frames))[::frequency]]
         
             
-        self.image_resolution = imageio.imread(list(self.color_paths)[0]).shape[:2]
-        self.depth_resolution = imageio.imread(list(self.depth_maps_paths)[0]).shape
+        num_workers = openyolo3d_config["openyolo3d"].get('frame_workers', 4)
+        prefetch = openyolo3d_config["openyolo3d"].get('frame_prefetch', 8)
+        pack_dir = openyolo3d_config["openyolo3d"].get('frame_pack_dir')
+        packed_path = None
+        if pack_dir:
+            scene_id = hashlib.sha1(osp.abspath(path_2_scene).encode("utf-8")).hexdigest()[:8]
+            packed_path = osp.join(os.getcwd(), pack_dir, f"{osp.basename(osp.normpath(path_2_scene))}_{scene_id}_depth_{frequency}.npy")
+        self.depth_frames = FrameStore(self.depth_maps_paths, num_workers, prefetch, packed_path)
+        self.color_frames = FrameStore(self.color_paths, num_workers, prefetch)
+            
+        self.image_resolution = image_size(self.color_paths[0])
+        self.depth_resolution = image_size(self.depth_maps_paths[0])
         self.height = self.depth_resolution[0]
         self.width = self.depth_resolution[1]
         
         self.depth_scale = depth_scale
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.profiler = Profiler(enabled=False) if profiler is None else profiler
         
     @staticmethod
     def load_ply(path_2_mesh):
@@ -366,13 +426,15 @@ class WORLD_2_CAM():
         coords = np.concatenate([points, np.ones((points.shape[0], 1))], axis = -1)
         return coords, colors
     
-    def load_depth_maps(self):
-        depth_maps = []
-        paths_to_depth_maps_scene_i = self.depth_maps_paths
-        for depth_map_path_i in paths_to_depth_maps_scene_i:
-            depth_path = os.path.join(depth_map_path_i)
-            depth_maps.append(torch.from_numpy(imageio.imread(depth_path) / self.depth_scale).to(self.device))
-        return torch.stack(depth_maps)
+    def load_depth_map(self, frame_id):
+        return self.load_depth_maps([frame_id])[0]
+    
+    def load_depth_maps(self, frame_ids=None):
+        # frames travel as uint16 and become float32 metres on the device
+        frame_ids = range(len(self.depth_maps_paths)) if frame_ids is None else frame_ids
+        with self.profiler.span("depth", frames=len(frame_ids)):
+            depth_maps = torch.from_numpy(self.depth_frames.read(frame_ids)).to(self.device)
+            return depth_maps.float() / self.depth_scale
     
     def adjust_intrinsic(self, intrinsic, original_resolution, new_resolution):
         if original_resolution == new_resolution:
@@ -389,81 +451,24 @@ class WORLD_2_CAM():
         return adapted_intrinsic
     
     def get_mesh_projections(self):
-        N_Large = 2000000*250
-        
-        points, colors = self.load_ply(self.mesh)
-        points, colors = torch.from_numpy(points).cuda(), torch.from_numpy(colors).cuda()
+        """
+        Visible mesh points per frame as ``SparseProjections``. Frames and points
+        are processed in tiles sized from ``projection_memory_mb``, so peak
+        memory follows the tile size rather than frames x points. On the CPU
+        the tiles follow ``cpu_tile_mb`` (half the last-level cache by default)
+        and the math runs in ``cpu_projection_dtype``.
+        """
+        points, _ = self.load_ply(self.mesh)
+        points = torch.from_numpy(points)
         
         intrinsic = self.adjust_intrinsic(np.loadtxt(self.intrinsics[0]), self.image_resolution, self.depth_resolution)
-        intrinsics = torch.from_numpy(np.stack([intrinsic for frame_id in range(len(self.poses))])).cuda()
-        extrinsics = torch.linalg.inv(torch.from_numpy(np.stack([np.loadtxt(pose) for pose in self.poses])).cuda())
-        
-        if extrinsics.shape[0]*points.shape[0] < N_Large:
-            word2cam_mat = torch.einsum('bij, jk -> bik',torch.einsum('bij,bjk -> bik', intrinsics,extrinsics), points.T).permute(0,2,1)
-        else:
-            B_size = 800000
-            Num_Points = points.shape[0]
-            Num_batches = Num_Points//B_size+1
-            word2cam_mat = []
-            for b_i in range(Num_batches):
-                dim_start = b_i*B_size
-                dim_last = (b_i+1)*B_size if b_i != Num_batches-1 else points.shape[0]
-                word2cam_mat_i = torch.einsum('bij, jk -> bik',torch.einsum('bij,bjk -> bik', intrinsics,extrinsics), points[dim_start:dim_last].T).permute(0,2,1)
-                word2cam_mat.append(word2cam_mat_i.cpu())
-            word2cam_mat = torch.cat(word2cam_mat, dim = 1)
-        del intrinsics
-        del extrinsics
-        del points
-        del colors
-        torch.cuda.empty_cache()
-        
-        point_depth = word2cam_mat[:, :, 2].cuda()
-        if word2cam_mat.shape[1]*word2cam_mat.shape[0] < N_Large:
-            size = (word2cam_mat.shape[0], word2cam_mat.shape[1])
-            mask = (word2cam_mat[:, :, 2] != 0).reshape(size[0]*size[1])
-            
-            projected_points = torch.stack([(word2cam_mat[:, :, 0].reshape(size[0]*size[1])[mask]/word2cam_mat[:, :, 2].reshape(size[0]*size[1])[mask]).reshape(size), 
-                        (word2cam_mat[:, :, 1].reshape(size[0]*size[1])[mask]/word2cam_mat[:, :, 2].reshape(size[0]*size[1])[mask]).reshape(size)]).permute(1,2,0).long()
-            inside_mask = ((projected_points[:,:,0] < self.width)*(projected_points[:,:,0] > 0)*(projected_points[:,:,1] < self.height)*(projected_points[:,:,1] >0) == 1 )
-        
-        else:
-            B_size = 200000
-            Num_Points = word2cam_mat.shape[1]
-            Num_batches = Num_Points//B_size+1
-            projected_points = []
-
-            for b_i in range(Num_batches):
-                dim_start = b_i*B_size
-                dim_last = (b_i+1)*B_size if b_i != Num_batches-1 else word2cam_mat.shape[1]
-                batch_z = word2cam_mat[:, dim_start:dim_last, 2].cuda()
-                batch_y = word2cam_mat[:, dim_start:dim_last, 1].cuda()
-                batch_x = word2cam_mat[:, dim_start:dim_last, 0].cuda()
-                
-                size = (word2cam_mat.shape[0], dim_last-dim_start)
-                mask = (batch_z != 0).reshape(size[0]*size[1])
-                projected_points_i = torch.stack([(torch.div(batch_x.reshape(size[0]*size[1])[mask],batch_z.reshape(size[0]*size[1])[mask])).reshape(size), 
-                            (torch.div(batch_y.reshape(size[0]*size[1])[mask],batch_z.reshape(size[0]*size[1])[mask])).reshape(size)]).permute(1,2,0).long()
-                projected_points.append(projected_points_i.cpu())
-                
-
-           
-            # merge parts
-            projected_points = torch.cat(projected_points, dim = 1)
-            inside_mask = ((projected_points[:,:,0] < self.width)*(projected_points[:,:,0] > 0)*(projected_points[:,:,1] < self.height)*(projected_points[:,:,1] >0) == 1 )
-            
-        
-        # Get visible points with depth, width, and height
-        depth_maps = self.load_depth_maps()
-        num_frames = depth_maps.shape[0]
-        # pixel_to_3d_point = []
-        for frame_id in range(num_frames):
-            points_in_frame_mask = inside_mask[frame_id].clone()
-            points_in_frame = (projected_points[frame_id][points_in_frame_mask])
-            depth_in_frame = point_depth[frame_id][points_in_frame_mask]
-            visibility_mask = (torch.abs(depth_maps[frame_id][points_in_frame[:,1].long(), points_in_frame[:,0].long()]
-                                        - depth_in_frame) <= \
-                                        self.vis_depth_threshold)
-            
-            inside_mask[frame_id][points_in_frame_mask] = visibility_mask.to(inside_mask.device)
+        intrinsics = torch.from_numpy(np.stack([intrinsic for frame_id in range(len(self.poses))]))
+        extrinsics = torch.linalg.inv(torch.from_numpy(np.stack([np.loadtxt(pose) for pose in self.poses])))
+        projection_matrices = torch.einsum('bij,bjk -> bik', intrinsics, extrinsics)
         
-        return projected_points.type(torch.int16).cpu(), inside_mask.cpu()
\ No newline at end of file
+        if self.depth_frames.packed_path is not None and self.depth_frames.packed is None:
+            self.depth_frames.pack()
+        projections = project_visible_points(points, projection_matrices, self.load_depth_maps, self.width, self.height,
+                                             self.vis_depth_threshold, self.device, self.memory_budget, self.dtype)
+        self.depth_frames.close()
+        return projections
\ No newline at end of file
@@ -0,0 +1,46 @@
+import glob
+import os
+import torch
+
+# last-level cache assumed when sysfs does not report one
+DEFAULT_CACHE_BYTES = 32 << 20
+
+
+def get_device(name="auto"):
+    """``torch.device`` for the ``openyolo3d.device`` setting: "auto" picks CUDA when available, CUDA falls back to the CPU"""
+    name = str(name or "auto")
+    if name == "auto":
+        return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    device = torch.device(name)
+    if device.type == "cuda" and not torch.cuda.is_available():
+        print(f"[WARNING] Device {name} requested but CUDA is not available, running on the CPU")
+        return torch.device("cpu")
+    return device
+
+
+def cache_bytes(level=None):
+    """Size of the CPU data cache at ``level`` (the largest one by default), from sysfs"""
+    sizes = {}
+    for index in glob.glob("/sys/devices/system/cpu/cpu0/cache/index*"):
+        try:
+            with open(os.path.join(index, "type")) as f:
+                if f.read().strip() == "Instruction":
+                    continue
+            with open(os.path.join(index, "level")) as f:
+                cache_level = int(f.read())
+            with open(os.path.join(index, "size")) as f:
+                size = f.read().strip()
+        except (OSError, ValueError):
+            continue
+        scale = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}.get(size[-1:], 1)
+        sizes[cache_level] = int(size.rstrip("KMG"))*scale
+    if not sizes:
+        return DEFAULT_CACHE_BYTES
+    return sizes.get(max(sizes) if level is None else level, DEFAULT_CACHE_BYTES)
+
+
+def configure_cpu(threads=0):
+    """Intra-op threads of the torch CPU kernels, all cores when ``threads`` is 0"""
+    threads = threads or len(os.sched_getaffinity(0))
+    torch.set_num_threads(threads)
+    return threads
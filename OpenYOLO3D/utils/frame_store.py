@@ -0,0 +1,106 @@
+import os
+import os.path as osp
+import time
+from concurrent.futures import ThreadPoolExecutor
+import imageio
+import numpy as np
+from PIL import Image
+
+
+def image_size(path):
+    """(height, width) of an image, read from its header without decoding the pixels"""
+    with Image.open(path) as image:
+        return image.size[1], image.size[0]
+
+
+class FrameStore():
+    """
+    The frames of one scene stream (depth PNGs or color JPGs) in their stored
+    dtype, e.g. uint16 depth. Frames decode in a thread pool, and every read
+    also queues the ``prefetch`` frames after it, so sequential reads overlap
+    decoding with whatever the caller does in between. ``pack`` decodes the
+    stream once into a single ``.npy`` file that is memory-mapped afterwards.
+    """
+
+    def __init__(self, paths, num_workers=4, prefetch=8, packed_path=None):
+        self.paths = list(paths)
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self.packed_path = packed_path
+        self.packed = None
+        self.pending = {}
+        self.pool = None
+        self.frames_read = 0
+        self.wait_time = 0.0
+        self.decode_time = 0.0
+        if packed_path is not None and self.is_packed(packed_path):
+            self.packed = np.load(packed_path, mmap_mode="r")
+
+    def __len__(self):
+        return len(self.paths)
+
+    def is_packed(self, path):
+        # a pack is stale once any source frame is newer than it
+        if not self.paths or not osp.exists(path):
+            return False
+        newest = max(os.stat(frame_path).st_mtime_ns for frame_path in self.paths)
+        return np.load(path, mmap_mode="r").shape[0] == len(self.paths) and os.stat(path).st_mtime_ns >= newest
+
+    def decode(self, frame_id):
+        start = time.time()
+        frame = np.asarray(imageio.imread(self.paths[frame_id]))
+        return frame, time.time() - start
+
+    def submit(self, frame_id):
+        if frame_id not in self.pending:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.num_workers)
+            self.pending[frame_id] = self.pool.submit(self.decode, frame_id)
+
+    def read(self, frame_ids):
+        """(len(frame_ids), H, W[, C]) array of the frames in their stored dtype"""
+        frame_ids = list(frame_ids)
+        start = time.time()
+        if self.packed is not None:
+            frames = np.ascontiguousarray(self.packed[frame_ids])
+        else:
+            if self.num_workers:
+                last = max(frame_ids)
+                for frame_id in frame_ids + list(range(last+1, min(last+1+self.prefetch, len(self)))):
+                    self.submit(frame_id)
+            decoded = [self.pending.pop(frame_id).result() if frame_id in self.pending else self.decode(frame_id) for frame_id in frame_ids]
+            self.decode_time += sum(elapsed for _, elapsed in decoded)
+            frames = np.stack([frame for frame, _ in decoded])
+        self.wait_time += time.time() - start
+        self.frames_read += len(frame_ids)
+        return frames
+
+    def pack(self, path=None):
+        """Decodes every frame into one ``.npy`` file at ``path`` and memory-maps it from then on"""
+        path = self.packed_path if path is None else path
+        chunk = max(1, self.prefetch)
+        first = self.read([0])
+        os.makedirs(osp.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        packed = np.lib.format.open_memmap(tmp, mode="w+", dtype=first.dtype, shape=(len(self),)+first.shape[1:])
+        packed[0] = first[0]
+        for start in range(1, len(self), chunk):
+            end = min(start+chunk, len(self))
+            packed[start:end] = self.read(range(start, end))
+        packed.flush()
+        del packed
+        os.replace(tmp, path)
+        self.packed_path = path
+        self.packed = np.load(path, mmap_mode="r")
+
+    def stats(self):
+        return {"frames": self.frames_read, "wait_s": round(self.wait_time, 3), "decode_s": round(self.decode_time, 3),
+                "packed": self.packed is not None}
+
+    def close(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
@@ -0,0 +1,146 @@
+import torch
+from utils.packed_masks import PackedMasks
+
+# upper bound on the (pixels x boxes) containment tests evaluated at once
+MAX_TESTS = 1 << 24
+
+
+class BoxLabelLookup():
+    """
+    Answers "label at (frame, x, y)" straight from each frame's 2D boxes,
+    without painting (frames x H x W) label canvases. Boxes are kept in
+    painting order (largest first), and a pixel takes the label of the last
+    box covering it, i.e. the smallest one; pixels outside every box are -1.
+    """
+
+    def __init__(self, predictions_2d_bboxes, scaling_params, height, width):
+        self.height = height
+        self.width = width
+        self.boxes = []
+        self.labels = []
+        for pred in predictions_2d_bboxes.values():
+            bboxes = pred["bbox"].long()
+            labels = pred["labels"].long()
+            bboxes[:,0] = bboxes[:,0]*scaling_params[1]
+            bboxes[:,2] = bboxes[:,2]*scaling_params[1]
+            bboxes[:,1] = bboxes[:,1]*scaling_params[0]
+            bboxes[:,3] = bboxes[:,3]*scaling_params[0]
+            bboxes_weights = (bboxes[:,2]-bboxes[:,0])+(bboxes[:,3]-bboxes[:,1])
+            sorted_indices = bboxes_weights.sort(descending=True).indices
+            # box edges clipped to the frame
+            bboxes[:, [0, 2]] = bboxes[:, [0, 2]].clamp(0, width)
+            bboxes[:, [1, 3]] = bboxes[:, [1, 3]].clamp(0, height)
+            self.boxes.append(bboxes[sorted_indices])
+            self.labels.append(labels[sorted_indices])
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def lookup(self, frame_id, coords):
+        """Labels (int64) at the (n, 2) integer pixel ``coords`` (x, y) of ``frame_id``"""
+        boxes = self.boxes[frame_id].to(coords.device)
+        labels = self.labels[frame_id].to(coords.device)
+        result = torch.full((len(coords),), -1, dtype=torch.long, device=coords.device)
+        if len(boxes) == 0 or len(coords) == 0:
+            return result
+        chunk = max(1, MAX_TESTS // len(boxes))
+        for start in range(0, len(coords), chunk):
+            x = coords[start:start+chunk, 0, None]
+            y = coords[start:start+chunk, 1, None]
+            inside = (x >= boxes[:, 0]) & (x < boxes[:, 2]) & (y >= boxes[:, 1]) & (y < boxes[:, 3])
+            # index of the last covering box: first hit scanning the boxes backwards
+            last = len(boxes) - 1 - inside.flip(1).int().argmax(dim=1)
+            result[start:start+chunk] = torch.where(inside.any(dim=1), labels[last], result[start:start+chunk])
+        return result
+
+
+def box_iou_matrix(boxes_a, boxes_b):
+    """(A, B) IoU between two sets of (x1, y1, x2, y2) boxes, ``compute_iou`` for every row of ``boxes_a``"""
+    x1_inter = torch.max(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1_inter = torch.max(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2_inter = torch.min(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2_inter = torch.min(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter_area = (x2_inter - x1_inter).clamp(0) * (y2_inter - y1_inter).clamp(0)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union_area = area_a[:, None] + area_b[None, :] - inter_area
+    return inter_area / union_area
+
+
+class MaskPoints():
+    """(N, points) boolean or packed masks as CSR point lists, so a frame only touches the points of the masks it sees"""
+
+    def __init__(self, masks, device):
+        if isinstance(masks, PackedMasks):
+            masks = masks.to(device)
+            self.points = masks.nonzero()[1]
+            self.sizes = masks.areas
+        else:
+            self.points = torch.where(masks.to(device))[1]
+            self.sizes = masks.sum(dim=1).to(device)
+        self.offsets = torch.cumsum(self.sizes, 0) - self.sizes
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def gather(self, mask_ids):
+        """(position in ``mask_ids``, point id) of every point of the masks ``mask_ids``"""
+        device = self.points.device
+        sizes = self.sizes[mask_ids]
+        mask_index = torch.repeat_interleave(torch.arange(len(mask_ids), device=device), sizes)
+        segment_starts = torch.repeat_interleave(self.offsets[mask_ids] - (torch.cumsum(sizes, 0) - sizes), sizes)
+        return mask_index, self.points[segment_starts + torch.arange(len(mask_index), device=device)]
+
+
+def frame_votes(mask_points, mask_ids, lookup_row, pixels, labels_at, boxes, scaling_params):
+    """
+    Votes of the masks ``mask_ids`` from one frame. ``lookup_row`` maps point
+    ids to rows of the frame's visible ``pixels`` (-1 if not visible) and
+    ``labels_at(coords)`` reads the 2D label at depth-map pixels. Returns the
+    position in ``mask_ids`` and label (-1 = none) of every visible mask
+    point, then each mask's best IoU between its projected extent and
+    ``boxes`` and whether that IoU counts (over 10 points, IoU not 0).
+    """
+    device = lookup_row.device
+    mask_index, point_ids = mask_points.gather(mask_ids)
+    rows = lookup_row[point_ids]
+    visible = rows >= 0
+    mask_index, rows = mask_index[visible], rows[visible]
+    iou = torch.zeros(len(mask_ids), dtype=torch.float64, device=device)
+    use = torch.zeros(len(mask_ids), dtype=torch.bool, device=device)
+    if len(rows) == 0:
+        return mask_index, rows, iou, use
+    coords = pixels.to(device)[rows].long()
+    labels = labels_at(coords)
+    if len(boxes) == 0:
+        return mask_index, labels, iou, use
+
+    points_per_mask = torch.bincount(mask_index, minlength=len(mask_ids))
+    x, y = coords[:, 0], coords[:, 1]
+    extent = torch.zeros((4, len(mask_ids)), dtype=torch.long, device=device)
+    for row, (values, reduce) in enumerate(((x, "amin"), (y, "amin"), (x, "amax"), (y, "amax"))):
+        extent[row].scatter_reduce_(0, mask_index, values, reduce, include_self=False)
+    scale = torch.tensor([scaling_params[1], scaling_params[0]]*2, dtype=torch.float64, device=device)
+    mask_boxes = (extent.T + torch.tensor([0, 0, 1, 1], device=device)) / scale
+    iou = box_iou_matrix(mask_boxes, boxes.long().to(device)).max(dim=1).values.float().double()
+    return mask_index, labels, iou, (points_per_mask > 10) & (iou != 0)
+
+
+def scores_from_votes(histograms, iou_sums, iou_counts, num_classes, with_distributions):
+    """
+    Class, score and (optionally) normalised class distribution per mask from
+    its (N, num_classes+1) vote histogram, bin 0 counting visible points
+    without a label, and its summed / counted box IoUs.
+    """
+    class_counts = histograms[:, 1:]
+    labeled = class_counts.sum(dim=1) > 0
+    # argmax takes the smallest of tied labels, as torch.mode does
+    class_labels = torch.where(labeled, class_counts.argmax(dim=1), torch.tensor(num_classes-1))
+    class_probs = torch.where(labeled, class_counts.gather(1, class_labels[:, None])[:, 0].double() / histograms.sum(dim=1).clamp(min=1), torch.tensor(0.0, dtype=torch.float64))
+    iou_probs = torch.where(iou_counts > 0, (iou_sums / iou_counts.clamp(min=1)).float().double(), torch.tensor(0.0, dtype=torch.float64))
+
+    distributions = None
+    if with_distributions:
+        distributions = class_counts.float() / class_counts.max(dim=1, keepdim=True).values.clamp(min=1)
+        distributions[~labeled, -1] = 1.0
+    return class_labels, class_probs * iou_probs, distributions
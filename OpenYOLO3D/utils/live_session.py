@@ -0,0 +1,235 @@
+import os.path as osp
+import tempfile
+import time
+import numpy as np
+import open3d as o3d
+import torch
+from utils.label_maps import BoxLabelLookup, MaskPoints, frame_votes, scores_from_votes
+
+# voxel coordinates are packed into one int64 key, 21 bits per axis
+KEY_BITS = 21
+KEY_OFFSET = 1 << (KEY_BITS - 1)
+
+
+def voxel_keys(points, voxel_size):
+    voxels = torch.floor(points / voxel_size).long() + KEY_OFFSET
+    return (voxels[:, 0] << (2*KEY_BITS)) | (voxels[:, 1] << KEY_BITS) | voxels[:, 2]
+
+
+class LiveSession():
+    """
+    Incremental OpenYOLO3D over RGB-D frames that arrive one at a time, e.g.
+    from a headset capture, instead of a finished scene directory.
+
+    Every frame is back-projected into a voxel point cloud, and the voxels
+    its depth pixels fall in are the points it sees. Its 2D boxes vote for
+    the current 3D masks as soon as it arrives. Mask3D reruns only when the
+    cloud has grown by ``refresh_growth`` since the last proposals, and the
+    stored frames then re-vote for the new masks. ``instances()`` labels the
+    masks from the votes of their ``topk`` most visible frames, as
+    ``OpenYolo3D.predict`` does, at any moment.
+
+    Points fused after a frame are not back-projected into it, so a frame
+    only sees what its own depth observed.
+    """
+
+    def __init__(self, openyolo3d, intrinsic, depth_scale, text=None, datatype="point cloud"):
+        config = openyolo3d.openyolo3d_config
+        live_config = config.get("live", {})
+        self.openyolo3d = openyolo3d
+        self.network_2d = openyolo3d.network_2d
+        self.intrinsic = torch.as_tensor(np.asarray(intrinsic), dtype=torch.float64)[:3, :3]
+        self.depth_scale = depth_scale
+        self.datatype = datatype
+        self.topk = config["openyolo3d"]["topk"]
+        self.topk_per_image = config["openyolo3d"]["topk_per_image"]
+        self.voxel_size = live_config.get("voxel_size", 0.02)
+        self.pixel_stride = live_config.get("pixel_stride", 2)
+        self.max_depth = live_config.get("max_depth", 6.0)
+        self.refresh_growth = live_config.get("refresh_growth", 0.25)
+        self.min_points = live_config.get("min_points", 20000)
+        self.device = openyolo3d.device
+
+        if text is not None:
+            self.network_2d.set_texts([[t] for t in text] + [[' ']])
+        self.num_classes = len(self.network_2d.texts)
+        self.num_bins = self.num_classes+1  # bin 0 counts visible points without a label
+        openyolo3d.num_classes = self.num_classes
+
+        # fused geometry: sorted voxel keys, the point id of each key, point chunks
+        self.keys = torch.zeros(0, dtype=torch.long, device=self.device)
+        self.key_ids = torch.zeros(0, dtype=torch.long, device=self.device)
+        self.points = []
+        self.colors = []
+        self.num_points = 0
+        # per frame: visible point ids and their depth pixels, 2D boxes, votes
+        self.frames = []
+        self.scaling_params = None
+        self.depth_resolution = None
+
+        self.masks = None
+        self.mask_points = None
+        self.proposal_scores = None
+        self.proposal_points = 0
+        self.latencies = []
+        self.refresh_times = []
+
+    def __len__(self):
+        return len(self.frames)
+
+    def add_frame(self, color, depth, pose):
+        """
+        Adds one frame: ``color`` (H, W, 3) RGB uint8, ``depth`` (h, w) raw
+        depth, ``pose`` (4, 4) camera to world. Returns the update latency in
+        seconds, including a proposal refresh when this frame triggered one.
+        """
+        start = time.time()
+        frame_id = len(self.frames)
+        color = np.asarray(color)
+        depth = torch.as_tensor(np.asarray(depth).astype(np.int32)).to(self.device)
+        if self.depth_resolution is None:
+            self.depth_resolution = tuple(depth.shape)
+            self.scaling_params = [depth.shape[0]/color.shape[0], depth.shape[1]/color.shape[1]]
+
+        point_ids, pixels = self.integrate(color, depth, torch.as_tensor(np.asarray(pose), dtype=torch.float64))
+        boxes = self.network_2d.detect_arrays([color], [frame_id])[str(frame_id)]
+        self.frames.append({"point_ids": point_ids, "pixels": pixels, "boxes": boxes, "votes": None})
+        if self.masks is not None:
+            self.frames[-1]["votes"] = self.vote(frame_id)
+
+        if self.num_points >= self.min_points and self.num_points >= (1+self.refresh_growth)*self.proposal_points:
+            self.refresh_proposals()
+        latency = time.time() - start
+        self.latencies.append(latency)
+        return latency
+
+    def integrate(self, color, depth, pose):
+        """Fuses a frame's depth into the cloud; returns the ids and depth pixels (x, y) of the points it sees"""
+        height, width = depth.shape
+        y, x = torch.meshgrid(torch.arange(0, height, self.pixel_stride, device=self.device),
+                              torch.arange(0, width, self.pixel_stride, device=self.device), indexing="ij")
+        z = depth[y, x].double() / self.depth_scale
+        # x, y > 0 as in the projection's inside test
+        valid = (z > 0) & (z < self.max_depth) & (x > 0) & (y > 0)
+        x, y, z = x[valid], y[valid], z[valid]
+        intrinsic = self.intrinsic.to(self.device)
+        camera = torch.stack([(x + 0.5 - intrinsic[0, 2]) * z / intrinsic[0, 0],
+                              (y + 0.5 - intrinsic[1, 2]) * z / intrinsic[1, 1],
+                              z, torch.ones_like(z)], dim=-1)
+        world = (camera @ pose.to(self.device).T)[:, :3]
+
+        keys, inverse = torch.unique(voxel_keys(world, self.voxel_size), return_inverse=True)
+        # one pixel per voxel: the first one that hit it
+        first = torch.full((len(keys),), len(inverse), dtype=torch.long, device=self.device)
+        first.scatter_reduce_(0, inverse, torch.arange(len(inverse), device=self.device), "amin")
+
+        position = torch.searchsorted(self.keys, keys)
+        found = self.keys[position.clamp(max=len(self.keys)-1)] == keys if len(self.keys) else torch.zeros_like(keys, dtype=torch.bool)
+        point_ids = torch.empty_like(keys)
+        point_ids[found] = self.key_ids[position[found]]
+        new = torch.where(~found)[0]
+        point_ids[new] = torch.arange(self.num_points, self.num_points+len(new), device=self.device)
+        if len(new):
+            # merge the (sorted) new keys into the sorted keys without a full sort
+            slots = position[new] + torch.arange(len(new), device=self.device)
+            old_slots = torch.ones(len(self.keys)+len(new), dtype=torch.bool, device=self.device)
+            old_slots[slots] = False
+            merged_keys = torch.empty(len(old_slots), dtype=torch.long, device=self.device)
+            merged_ids = torch.empty_like(merged_keys)
+            merged_keys[slots], merged_ids[slots] = keys[new], point_ids[new]
+            merged_keys[old_slots], merged_ids[old_slots] = self.keys, self.key_ids
+            self.keys, self.key_ids = merged_keys, merged_ids
+
+            pixel = first[new]
+            color_y = (y[pixel].float() / self.scaling_params[0]).long().clamp(max=color.shape[0]-1).cpu().numpy()
+            color_x = (x[pixel].float() / self.scaling_params[1]).long().clamp(max=color.shape[1]-1).cpu().numpy()
+            self.points.append(world[pixel].cpu())
+            self.colors.append(torch.from_numpy(color[color_y, color_x] / 255.0))
+            self.num_points += len(new)
+        pixels = torch.stack([x[first], y[first]], dim=-1).to(torch.int16)
+        return point_ids.int().cpu(), pixels.cpu()
+
+    def point_cloud(self):
+        """(points (N, 3), colors (N, 3) in [0, 1]) of the fused cloud as float64 numpy arrays"""
+        if not self.points:
+            return np.zeros((0, 3)), np.zeros((0, 3))
+        self.points, self.colors = [torch.cat(self.points)], [torch.cat(self.colors)]
+        return self.points[0].numpy(), self.colors[0].numpy()
+
+    def refresh_proposals(self):
+        """Reruns Mask3D on the current cloud and re-votes every stored frame for the new masks"""
+        start = time.time()
+        points, colors = self.point_cloud()
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(points)
+        pcd.colors = o3d.utility.Vector3dVector(colors)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            scene_file = osp.join(tmp_dir, "live.ply")
+            o3d.io.write_point_cloud(scene_file, pcd)
+            masks, scores = self.openyolo3d.get_proposals(scene_file, self.datatype)
+        self.masks = masks
+        self.proposal_scores = scores
+        self.proposal_points = masks.num_points
+        self.mask_points = MaskPoints(self.masks, self.device)
+        for frame_id in range(len(self.frames)):
+            self.frames[frame_id]["votes"] = self.vote(frame_id)
+        self.refresh_times.append(time.time() - start)
+        print(f"[🕒 INFO] Live proposals refreshed: {len(self.masks)} masks over {len(points)} points in {self.refresh_times[-1]:.3f}s")
+
+    def vote(self, frame_id):
+        """Visible point counts and votes of every mask seen in one frame"""
+        frame = self.frames[frame_id]
+        point_ids = frame["point_ids"].to(self.device).long()
+        # points fused after the last refresh are in no mask
+        in_masks = point_ids < self.proposal_points
+        point_ids = point_ids[in_masks]
+        lookup_row = torch.full((self.proposal_points,), -1, dtype=torch.long, device=self.device)
+        lookup_row[point_ids] = torch.where(in_masks)[0]
+
+        mask_index, mask_point_ids = self.mask_points.gather(torch.arange(len(self.mask_points), device=self.device))
+        visible_counts = torch.bincount(mask_index, weights=(lookup_row[mask_point_ids] >= 0).float(), minlength=len(self.mask_points))
+        mask_ids = torch.where(visible_counts > 0)[0]
+
+        label_lookup = BoxLabelLookup({frame_id: frame["boxes"]}, self.scaling_params, *self.depth_resolution)
+        mask_index, labels, iou, use = frame_votes(self.mask_points, mask_ids, lookup_row, frame["pixels"],
+                                                   lambda coords: label_lookup.lookup(0, coords), frame["boxes"]["bbox"], self.scaling_params)
+        bins = torch.bincount(mask_index*self.num_bins + labels+1, minlength=len(mask_ids)*self.num_bins).view(len(mask_ids), self.num_bins)
+        return {"visible_counts": visible_counts.cpu(), "mask_ids": mask_ids.cpu(), "bins": bins.cpu(),
+                "iou": iou.cpu(), "use": use.cpu()}
+
+    def instances(self):
+        """
+        Current (masks as ``PackedMasks`` over the fused cloud, classes, scores), in
+        the layout ``OpenYolo3D.predict`` returns per scene; None until the
+        first proposals.
+        """
+        if self.masks is None:
+            return None
+        voted = [frame["votes"] for frame in self.frames]
+        num_masks = len(self.masks)
+        visibility = torch.stack([votes["visible_counts"] for votes in voted], dim=1) / self.masks.areas.cpu()[:, None].float()
+        selected = torch.zeros_like(visibility, dtype=torch.bool)
+        selected.scatter_(1, torch.topk(visibility, min(self.topk, len(voted)), dim=-1).indices, True)
+
+        histograms = torch.zeros((num_masks, self.num_bins), dtype=torch.long)
+        iou_sums = torch.zeros(num_masks, dtype=torch.float64)
+        iou_counts = torch.zeros(num_masks, dtype=torch.long)
+        for frame_id, votes in enumerate(voted):
+            take = selected[votes["mask_ids"], frame_id]
+            mask_ids = votes["mask_ids"][take]
+            histograms.index_add_(0, mask_ids, votes["bins"][take])
+            use = take & votes["use"]
+            iou_sums.index_add_(0, votes["mask_ids"][use], votes["iou"][use])
+            iou_counts.index_add_(0, votes["mask_ids"][use], torch.ones_like(votes["mask_ids"][use]))
+
+        classes, scores, distributions = scores_from_votes(histograms, iou_sums, iou_counts, self.num_classes, self.topk_per_image != -1)
+        return self.openyolo3d.select_topk_per_image(self.masks.pad(self.num_points), classes, scores, distributions, False)
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {"frames": len(self.frames), "points": self.num_points,
+                "masks": 0 if self.masks is None else len(self.masks),
+                "refreshes": len(self.refresh_times), "refresh_s": round(sum(self.refresh_times), 3),
+                "latency_ms_p50": round(float(np.percentile(latencies, 50)), 2),
+                "latency_ms_p95": round(float(np.percentile(latencies, 95)), 2),
+                "latency_ms_max": round(float(latencies.max()), 2)}
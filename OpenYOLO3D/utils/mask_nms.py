@@ -0,0 +1,128 @@
+import torch
+
+# upper bound on the float copy made while casting bool/packed masks (elements)
+CAST_BUDGET = 1 << 26
+# multiplying 8 little-endian 0/1 bytes by this gathers byte k into bit 56+k
+PACK_MAGIC = 0x0102040810204080
+
+
+def set_cast_budget(elements):
+    """Caps the float copies of cast masks at ``elements``, e.g. to keep the blocks in the CPU cache"""
+    global CAST_BUDGET
+    CAST_BUDGET = max(1 << 16, int(elements))
+
+
+def cast_budget():
+    return CAST_BUDGET
+
+
+def pack_masks(masks):
+    """
+    Bit-packs (N, P) boolean masks along the points into (N, ceil(P/8)) uint8,
+    least significant bit first (``np.packbits(..., bitorder="little")``).
+    """
+    masks = masks.bool()
+    num_masks, num_points = masks.shape
+    pad = (-num_points) % 8
+    if pad:
+        masks = torch.cat([masks, masks.new_zeros((num_masks, pad))], dim=1)
+    # every 8 points as one int64 word of 0/1 bytes
+    words = masks.contiguous().view(torch.uint8).view(torch.int64).view(num_masks, (num_points + pad) // 8)
+    return ((words * PACK_MAGIC) >> 56).to(torch.uint8)
+
+
+def unpack_masks(packed, num_points, start=0, end=None):
+    """Points ``start:end`` of bit-packed masks as (N, end-start) bool; ``start`` must be a multiple of 8"""
+    end = num_points if end is None else min(end, num_points)
+    assert start % 8 == 0, "unpacking has to start on a byte boundary"
+    chunk = packed[:, start // 8:(end + 7) // 8]
+    shifts = torch.arange(8, device=packed.device, dtype=torch.uint8)
+    bits = (chunk[:, :, None] >> shifts) & 1
+    return bits.view(packed.shape[0], chunk.shape[1] * 8)[:, :end - start].bool()
+
+
+def mask_intersections(masks, packed_points=None):
+    """
+    Pairwise intersection counts of (N, P) masks as an (N, N) float matrix,
+    from a single ``masks @ masks.T``. Dense bool/int masks are cast to float
+    a block of points at a time, and ``packed_points`` marks ``masks`` as
+    bit-packed (see ``pack_masks``) over that many points; sparse COO masks
+    go through ``torch.sparse.mm``.
+    """
+    if masks.is_sparse:
+        masks = masks.coalesce().float()
+        return torch.sparse.mm(masks, masks.t()).to_dense()
+    if masks.is_floating_point() and packed_points is None:
+        return masks @ masks.T
+
+    num_masks = masks.shape[0]
+    num_points = packed_points if packed_points is not None else masks.shape[1]
+    block = max(8, CAST_BUDGET // max(num_masks, 1) // 8 * 8)
+    intersection = torch.zeros((num_masks, num_masks), dtype=torch.float32, device=masks.device)
+    for start in range(0, num_points, block):
+        if packed_points is not None:
+            part = unpack_masks(masks, num_points, start, start + block).float()
+        else:
+            part = masks[:, start:start + block].float()
+        intersection += part @ part.T
+    return intersection
+
+
+def mask_iou(masks, packed_points=None):
+    """
+    (N, N) IoU of (N, P) masks. Union is closed form, ``|a| + |b| - |a & b|``,
+    with the areas read off the diagonal of the intersection matrix, so the
+    cost is one N x N x P matmul and no (N, N, P) intermediate.
+    """
+    intersection = mask_intersections(masks, packed_points)
+    areas = intersection.diagonal()
+    union = areas[:, None] + areas[None, :] - intersection
+    return intersection / union
+
+
+def nms_keep(iou, nms_th):
+    """
+    Keep flags for IoU rows sorted by descending score: a mask is dropped when
+    any higher scoring mask overlaps it by more than ``nms_th``, whether or
+    not that mask was itself dropped.
+    """
+    overlap = torch.triu(torch.nan_to_num(iou, nan=0.0), diagonal=1)
+    return ~(overlap.max(0).values > nms_th)
+
+
+def matrix_nms_scores(iou, scores, kernel="gaussian", sigma=2.0):
+    """
+    Matrix NMS (SOLOv2) on IoU rows sorted by descending ``scores``: every
+    score is decayed by its overlap with higher scoring masks, compensated by
+    how suppressed those masks were themselves.
+    """
+    overlap = torch.triu(torch.nan_to_num(iou, nan=0.0), diagonal=1)
+    compensate = overlap.max(0).values[:, None]
+    if kernel == "gaussian":
+        decay = torch.exp(-(overlap ** 2 - compensate ** 2) / sigma)
+    elif kernel == "linear":
+        decay = (1 - overlap) / (1 - compensate).clamp(min=1e-6)
+    else:
+        raise ValueError(f"Unknown matrix NMS kernel {kernel}")
+    return scores * decay.min(0).values.clamp(max=1.0)
+
+
+def mask_nms(masks, scores, nms_th, mode="greedy", score_th=0.0, kernel="gaussian", sigma=2.0, packed_points=None):
+    """
+    Indices of the (N, P) ``masks`` surviving NMS, highest score first.
+
+    ``mode="greedy"`` drops masks overlapping a higher scoring mask by more
+    than ``nms_th``; ``mode="matrix"`` keeps masks whose matrix-NMS decayed
+    score stays at or above ``score_th``.
+    """
+    if len(scores) == 0:
+        return torch.empty(0, dtype=torch.long)
+    _, order = torch.sort(scores, descending=True)
+    iou = mask_iou(masks, packed_points)[order][:, order]
+    if mode == "greedy":
+        keep = nms_keep(iou, nms_th)
+    elif mode == "matrix":
+        keep = matrix_nms_scores(iou, scores[order].float(), kernel, sigma) >= score_th
+    else:
+        raise ValueError(f"Unknown NMS mode {mode}")
+    return order[keep].cpu()
@@ -0,0 +1,168 @@
+import time
+import torch
+from utils.mask_nms import cast_budget, pack_masks, unpack_masks, mask_intersections
+
+# host <-> device copies of packed masks, for the end-to-end report
+TRANSFERS = {"bytes": 0, "seconds": 0.0}
+
+BIT_COUNTS = torch.tensor([bin(value).count("1") for value in range(256)], dtype=torch.uint8)
+
+
+def _block(num_masks):
+    # points per block keeping a (block x masks) float temporary under CAST_BUDGET, on a byte boundary
+    return max(8, cast_budget() // max(num_masks, 1) // 8 * 8)
+
+
+class PackedMasks():
+    """
+    N boolean 3D instance masks over ``num_points`` points, bit-packed into
+    (N, ceil(points/8)) uint8 rows (see ``pack_masks``) with the per-mask
+    point counts cached. It stands in for the dense (points x N) float masks
+    between Mask3D, NMS, labeling, caching and evaluation, at 1/32 of their
+    size; ``shape`` keeps reporting the dense (points, N) layout.
+    """
+
+    def __init__(self, packed, num_points, areas=None):
+        self.packed = packed
+        self.num_points = num_points
+        self._areas = areas
+
+    @classmethod
+    def from_dense(cls, masks):
+        """From (N, points) masks of any dtype, non-zero meaning inside, packed a block of points at a time"""
+        block = _block(masks.shape[0])
+        rows = [pack_masks(masks[:, start:start+block] != 0) for start in range(0, masks.shape[1], block)]
+        if not rows:
+            return cls(torch.zeros((masks.shape[0], 0), dtype=torch.uint8, device=masks.device), 0)
+        return cls(torch.cat(rows, dim=1), masks.shape[1])
+
+    @classmethod
+    def from_voxels(cls, voxel_masks, inverse_map, point2segment_full=None):
+        """
+        Full resolution masks from (voxels, N) masks and the voxel of every
+        point (``inverse_map``), without building the (points, N) masks. With
+        ``point2segment_full`` a segment is inside when more than half of its
+        points are, as ``get_full_res_mask`` decides.
+        """
+        voxel_masks = voxel_masks.bool()
+        device = voxel_masks.device
+        inverse_map = torch.as_tensor(inverse_map).to(device).long()
+        num_points = len(inverse_map)
+        block = _block(voxel_masks.shape[1])
+        lookup, index = voxel_masks, inverse_map
+        if point2segment_full is not None:
+            segments = torch.as_tensor(point2segment_full).to(device).long()
+            num_segments = int(segments.max()) + 1 if num_points else 0
+            inside = torch.zeros((num_segments, voxel_masks.shape[1]), dtype=torch.float32, device=device)
+            for start in range(0, num_points, block):
+                inside.index_add_(0, segments[start:start+block], voxel_masks[inverse_map[start:start+block]].float())
+            counts = torch.bincount(segments, minlength=num_segments).float()
+            lookup, index = (inside / counts[:, None]) > 0.5, segments
+        rows = [pack_masks(lookup[index[start:start+block]].T) for start in range(0, num_points, block)]
+        if not rows:
+            return cls(torch.zeros((voxel_masks.shape[1], 0), dtype=torch.uint8, device=device), 0)
+        return cls(torch.cat(rows, dim=1), num_points)
+
+    def __len__(self):
+        return self.packed.shape[0]
+
+    @property
+    def shape(self):
+        """(points, N), the layout of the dense masks this replaces"""
+        return (self.num_points, len(self))
+
+    @property
+    def device(self):
+        return self.packed.device
+
+    @property
+    def areas(self):
+        """(N,) points inside each mask, counted once and cached"""
+        if self._areas is None:
+            table = BIT_COUNTS.to(self.device)
+            columns = max(1, cast_budget() // max(len(self), 1))
+            self._areas = torch.zeros(len(self), dtype=torch.long, device=self.device)
+            for start in range(0, self.packed.shape[1], columns):
+                self._areas += table[self.packed[:, start:start+columns].long()].sum(dim=1)
+        return self._areas
+
+    def __getitem__(self, index):
+        """Masks ``index`` (int, slice, bool or long tensor) as PackedMasks"""
+        if isinstance(index, int):
+            index = slice(index, index+1)
+        if isinstance(index, torch.Tensor):
+            index = index.to(self.device)
+        areas = None if self._areas is None else self._areas[index]
+        return PackedMasks(self.packed[index], self.num_points, areas)
+
+    def to(self, device):
+        device = torch.device(device)
+        if self.device == device:
+            return self
+        start = time.time()
+        packed = self.packed.to(device)
+        areas = None if self._areas is None else self._areas.to(device)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        TRANSFERS["bytes"] += self.nbytes()
+        TRANSFERS["seconds"] += time.time() - start
+        return PackedMasks(packed, self.num_points, areas)
+
+    def cpu(self):
+        return self.to("cpu")
+
+    def nbytes(self):
+        return self.packed.element_size() * self.packed.nelement()
+
+    def pad(self, num_points):
+        """The same masks over ``num_points`` >= ``self.num_points`` points, the extra points outside"""
+        extra = (num_points + 7) // 8 - self.packed.shape[1]
+        packed = torch.cat([self.packed, self.packed.new_zeros((len(self), extra))], dim=1) if extra > 0 else self.packed
+        return PackedMasks(packed, num_points, self._areas)
+
+    def mask(self, index):
+        """Mask ``index`` as a (points,) bool tensor, one column of the dense layout"""
+        return unpack_masks(self.packed[index:index+1], self.num_points)[0]
+
+    def to_dense(self):
+        """(points, N) bool, the layout the pipeline used before packing"""
+        return unpack_masks(self.packed, self.num_points).T
+
+    def gather(self, point_ids):
+        """(N, len(point_ids)) bool, whether each mask contains each of ``point_ids``"""
+        point_ids = point_ids.to(self.device).long()
+        return ((self.packed[:, point_ids >> 3] >> (point_ids & 7).to(torch.uint8)) & 1).bool()
+
+    def nonzero(self):
+        """(mask ids, point ids) of every inside point grouped by mask, ``torch.where`` of the (N, points) masks"""
+        rows = max(1, cast_budget() // max(self.num_points, 1))
+        mask_ids, point_ids = [], []
+        for start in range(0, len(self), rows):
+            block_masks, block_points = torch.where(unpack_masks(self.packed[start:start+rows], self.num_points))
+            mask_ids.append(block_masks + start)
+            point_ids.append(block_points)
+        if not mask_ids:
+            return torch.zeros(0, dtype=torch.long, device=self.device), torch.zeros(0, dtype=torch.long, device=self.device)
+        return torch.cat(mask_ids), torch.cat(point_ids)
+
+    def intersections(self, other=None):
+        """(N, M) float intersection counts with the M masks of ``other``, by default with themselves"""
+        if other is None:
+            return mask_intersections(self.packed, packed_points=self.num_points)
+        block = _block(len(self) + len(other))
+        intersection = torch.zeros((len(self), len(other)), dtype=torch.float32, device=self.device)
+        for start in range(0, self.num_points, block):
+            part = unpack_masks(self.packed, self.num_points, start, start+block).float()
+            other_part = unpack_masks(other.packed.to(self.device), self.num_points, start, start+block).float()
+            intersection += part @ other_part.T
+        return intersection
+
+    def unions(self, other=None, intersection=None):
+        """(N, M) union counts, ``|a| + |b| - |a & b|`` from the cached areas"""
+        other = self if other is None else other
+        intersection = self.intersections(other if other is not self else None) if intersection is None else intersection
+        return self.areas[:, None].float() + other.areas.to(self.device)[None].float() - intersection
+
+    def iou(self, other=None):
+        intersection = self.intersections(other)
+        return intersection / self.unions(other, intersection)
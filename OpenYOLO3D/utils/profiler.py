@@ -0,0 +1,194 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+import torch
+
+
+def host_peak_bytes():
+    """Peak resident set size of the process since it started or since ``reset_host_peak``"""
+    with open("/proc/self/status") as f:
+        return int(re.search(r"VmHWM:\s+(\d+)", f.read()).group(1)) << 10
+
+
+def reset_host_peak():
+    """Restarts the peak resident set size from the current one, False where /proc does not allow it"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class Profiler():
+    """
+    Named, nested timing spans with peak memory and counts, for one process.
+
+    ``with profiler.span("projections", frames=60) as span:`` times the block,
+    nests it under the spans open in the same thread and yields its
+    attributes, so counts known only at the end (``span["points"] = n``) can
+    be added inside. On CUDA the device is synchronized at both ends so the
+    time covers the kernels the block launched.
+
+    Host (VmHWM) and device (``max_memory_allocated``) peaks are process wide
+    watermarks: every span start folds the current peaks into all open spans
+    and restarts them, so each span gets the peak reached while it was open,
+    including what concurrently open spans of other threads allocated.
+
+    Finished spans export to JSON, to the Chrome trace format
+    (chrome://tracing, Perfetto) and to the Prometheus text format.
+    """
+
+    def __init__(self, device=None, enabled=True, sync_cuda=True):
+        self.device = torch.device("cpu") if device is None else device
+        self.enabled = enabled
+        self.sync_cuda = sync_cuda and self.device.type == "cuda"
+        self.spans = []
+        self.open = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.time()
+        self.host_peaks = enabled and reset_host_peak()
+
+    def synchronize(self):
+        if self.sync_cuda:
+            torch.cuda.synchronize(self.device)
+
+    def peaks(self):
+        host = host_peak_bytes() if self.host_peaks else 0
+        device = torch.cuda.max_memory_allocated(self.device) if self.device.type == "cuda" else 0
+        return host, device
+
+    def fold_peaks(self, reset=False):
+        # caller holds the lock
+        host, device = self.peaks()
+        for record in self.open.values():
+            record["host_peak"] = max(record["host_peak"], host)
+            record["device_peak"] = max(record["device_peak"], device)
+        if reset:
+            if self.host_peaks:
+                reset_host_peak()
+            if self.device.type == "cuda":
+                torch.cuda.reset_peak_memory_stats(self.device)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        if not self.enabled:
+            yield dict(attributes)
+            return
+        stack = self.local.__dict__.setdefault("stack", [])
+        record = {"name": name, "path": "/".join([parent["name"] for parent in stack] + [name]),
+                  "thread": threading.current_thread().name, "attributes": dict(attributes),
+                  "host_peak": 0, "device_peak": 0}
+        self.synchronize()
+        with self.lock:
+            self.fold_peaks(reset=True)
+            self.open[id(record)] = record
+        stack.append(record)
+        record["start"] = time.time()
+        try:
+            yield record["attributes"]
+        finally:
+            self.synchronize()
+            record["end"] = time.time()
+            stack.pop()
+            with self.lock:
+                self.fold_peaks()
+                del self.open[id(record)]
+                self.spans.append(record)
+
+    def records(self):
+        """Finished spans as flat dicts, in finishing order"""
+        with self.lock:
+            spans = list(self.spans)
+        records = []
+        for span in spans:
+            record = {"name": span["name"], "path": span["path"], "thread": span["thread"],
+                      "start_s": round(span["start"]-self.origin, 6), "duration_s": round(span["end"]-span["start"], 6),
+                      "host_peak_mb": round(span["host_peak"]/2**20, 1) if self.host_peaks else None,
+                      "device_peak_mb": round(span["device_peak"]/2**20, 1) if self.device.type == "cuda" else None}
+            record.update(span["attributes"])
+            records.append(record)
+        return records
+
+    def last(self, path):
+        """The most recently finished span at ``path`` as in ``records``, None if there is none"""
+        return next((record for record in reversed(self.records()) if record["path"] == path), None)
+
+    def summary(self):
+        """Per span path: calls, total and mean seconds, largest host and device peaks"""
+        summary = {}
+        for record in self.records():
+            entry = summary.setdefault(record["path"], {"calls": 0, "total_s": 0.0, "host_peak_mb": None, "device_peak_mb": None})
+            entry["calls"] += 1
+            entry["total_s"] += record["duration_s"]
+            for key in ("host_peak_mb", "device_peak_mb"):
+                if record[key] is not None:
+                    entry[key] = max(entry[key] or 0.0, record[key])
+        for entry in summary.values():
+            entry["mean_s"] = round(entry["total_s"]/entry["calls"], 6)
+            entry["total_s"] = round(entry["total_s"], 6)
+        return summary
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+
+    def save_json(self, path):
+        with open(path, "w") as f:
+            json.dump({"device": str(self.device), "spans": self.records(), "summary": self.summary()}, f, indent=1)
+
+    def save_chrome_trace(self, path):
+        """Complete ("X") events with one row per thread, loadable in chrome://tracing or Perfetto"""
+        records = self.records()
+        threads = {name: tid for tid, name in enumerate(dict.fromkeys(record["thread"] for record in records))}
+        events = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}} for name, tid in threads.items()]
+        for record in records:
+            args = {key: value for key, value in record.items() if key not in ("name", "path", "thread", "start_s", "duration_s")}
+            events.append({"name": record["name"], "cat": record["path"], "ph": "X", "pid": os.getpid(), "tid": threads[record["thread"]],
+                           "ts": round(record["start_s"]*1e6, 1), "dur": round(record["duration_s"]*1e6, 1), "args": args})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def prometheus(self, labels=None, prefix="openyolo3d"):
+        """
+        Span totals in the Prometheus text format, e.g. for the node exporter
+        textfile collector. ``labels`` (dataset, config values, ...) are added
+        to every sample so runs with different settings can be told apart.
+        Numeric span attributes are summed into ``<prefix>_span_items_total``.
+        """
+        base = "".join(f',{key}="{value}"' for key, value in sorted((labels or {}).items()))
+        seconds, calls, host, device, items = [], [], [], [], []
+        summary = self.summary()
+        for path, entry in summary.items():
+            span_labels = f'{{span="{path}"{base}}}'
+            seconds.append(f"{prefix}_span_seconds_total{span_labels} {entry['total_s']}")
+            calls.append(f"{prefix}_span_calls_total{span_labels} {entry['calls']}")
+            if entry["host_peak_mb"] is not None:
+                host.append(f"{prefix}_span_host_peak_bytes{span_labels} {int(entry['host_peak_mb']*2**20)}")
+            if entry["device_peak_mb"] is not None:
+                device.append(f"{prefix}_span_device_peak_bytes{span_labels} {int(entry['device_peak_mb']*2**20)}")
+        totals = {}
+        for record in self.records():
+            for key, value in record.items():
+                if key in ("start_s", "duration_s", "host_peak_mb", "device_peak_mb") or isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                totals[(record["path"], key)] = totals.get((record["path"], key), 0) + value
+        for (path, key), value in totals.items():
+            items.append(f'{prefix}_span_items_total{{span="{path}",item="{key}"{base}}} {value}')
+        lines = []
+        for name, kind, help_text, samples in [("span_seconds_total", "counter", "Time spent in the span", seconds),
+                                               ("span_calls_total", "counter", "Times the span ran", calls),
+                                               ("span_host_peak_bytes", "gauge", "Largest process peak RSS while the span was open", host),
+                                               ("span_device_peak_bytes", "gauge", "Largest CUDA allocation peak while the span was open", device),
+                                               ("span_items_total", "counter", "Sum of the span counts (points, frames, proposals, boxes, ...)", items)]:
+            if samples:
+                lines += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} {kind}"] + samples
+        return "\n".join(lines) + "\n"
+
+    def save_prometheus(self, path, labels=None):
+        with open(path, "w") as f:
+            f.write(self.prometheus(labels))
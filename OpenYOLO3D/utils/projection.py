@@ -0,0 +1,109 @@
+import torch
+from utils.packed_masks import PackedMasks
+
+# bytes of temporaries per (frame, point) pair while projecting a tile
+BYTES_PER_PAIR = 96
+
+
+class SparseProjections():
+    """
+    Visible mesh points of every frame in CSR layout: frame ``f`` sees points
+    ``point_ids[offsets[f]:offsets[f+1]]`` at depth-map pixels ``pixels`` (x, y)
+    of the same rows. Replaces the dense (frames x points x 2) projections and
+    (frames x points) visibility mask.
+    """
+
+    def __init__(self, offsets, point_ids, pixels, num_points):
+        self.offsets = offsets
+        self.point_ids = point_ids
+        self.pixels = pixels
+        self.num_points = num_points
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def frame(self, frame_id):
+        start, end = self.offsets[frame_id].item(), self.offsets[frame_id+1].item()
+        return self.point_ids[start:end], self.pixels[start:end]
+
+    def frame_lookup(self, frame_id, device):
+        """(num_points,) row of each point in ``frame(frame_id)``, -1 where the point is not visible"""
+        point_ids, _ = self.frame(frame_id)
+        lookup = torch.full((self.num_points,), -1, dtype=torch.long, device=device)
+        lookup[point_ids.to(device).long()] = torch.arange(len(point_ids), device=device)
+        return lookup
+
+    def visible_counts(self, masks):
+        """(N, frames) number of points of each (N, points) dense or packed mask visible in each frame"""
+        mask_ids, mask_points = masks.nonzero() if isinstance(masks, PackedMasks) else torch.where(masks.bool())
+        num_masks = len(masks) if isinstance(masks, PackedMasks) else masks.shape[0]
+        counts = torch.zeros((num_masks, len(self)), dtype=torch.float32, device=masks.device)
+        visible = torch.zeros(self.num_points, dtype=torch.bool, device=masks.device)
+        for frame_id in range(len(self)):
+            point_ids = self.frame(frame_id)[0].to(masks.device).long()
+            visible[point_ids] = True
+            counts[:, frame_id] = torch.bincount(mask_ids, weights=visible[mask_points].float(), minlength=num_masks)
+            visible[point_ids] = False
+        return counts
+
+    def nbytes(self):
+        return sum(t.element_size()*t.nelement() for t in (self.offsets, self.point_ids, self.pixels))
+
+
+def plan_tiles(num_frames, num_points, memory_budget):
+    """(frames per tile, points per tile) keeping a tile's temporaries under ``memory_budget`` bytes"""
+    pairs = max(1, memory_budget // BYTES_PER_PAIR)
+    if pairs >= num_points:
+        return max(1, min(num_frames, pairs // num_points)), num_points
+    return 1, pairs
+
+
+def project_visible_points(points, projection_matrices, load_depths, width, height, vis_depth_threshold,
+                           device, memory_budget=1 << 30, dtype=None):
+    """
+    Projects (P, 4) homogeneous ``points`` through per-frame (F, 3+, 4)
+    ``projection_matrices`` (intrinsics @ world-to-camera) a tile of frames
+    and points at a time, and keeps the points that land strictly inside the
+    depth map and within ``vis_depth_threshold`` of its depth there.
+    ``load_depths(frame_ids)`` returns those frames' (n, height, width) depth
+    maps, so only a tile's worth of depth maps is ever resident. The math runs
+    in ``dtype``, by default that of ``points``. Returns ``SparseProjections``
+    on the CPU.
+    """
+    dtype = points.dtype if dtype is None else dtype
+    num_frames, num_points = projection_matrices.shape[0], points.shape[0]
+    frames_per_tile, points_per_tile = plan_tiles(num_frames, num_points, memory_budget)
+    frame_points = [[] for _ in range(num_frames)]
+    frame_pixels = [[] for _ in range(num_frames)]
+
+    for frame_start in range(0, num_frames, frames_per_tile):
+        frame_end = min(frame_start+frames_per_tile, num_frames)
+        depth_maps = load_depths(range(frame_start, frame_end)).to(device)
+        # only the rows giving x*z, y*z and z
+        matrices = projection_matrices[frame_start:frame_end, :3].to(device=device, dtype=dtype)
+        for point_start in range(0, num_points, points_per_tile):
+            tile_points = points[point_start:point_start+points_per_tile].to(device=device, dtype=dtype)
+            camera = torch.einsum('bij, kj -> bki', matrices, tile_points)
+            depth = camera[:, :, 2]
+            safe_depth = torch.where(depth != 0, depth, torch.ones_like(depth))
+            x = camera[:, :, 0] / safe_depth
+            y = camera[:, :, 1] / safe_depth
+            # pixels truncate toward zero, so x > 0 after truncation is x >= 1 before it; only the kept ones are cast
+            inside = (depth != 0) & (x >= 1) & (x < width) & (y >= 1) & (y < height)
+            tile_frame, tile_point = torch.where(inside)
+            x, y = x[tile_frame, tile_point].long(), y[tile_frame, tile_point].long()
+            visible = torch.abs(depth_maps[tile_frame, y, x] - depth[tile_frame, tile_point]) <= vis_depth_threshold
+            tile_frame, tile_point = tile_frame[visible], tile_point[visible]
+            pixels = torch.stack([x[visible], y[visible]], dim=-1).to(torch.int16)
+            # tile_frame is sorted, so each frame's rows are one contiguous run
+            counts = torch.bincount(tile_frame, minlength=frame_end-frame_start).tolist()
+            for offset, (ids, pix) in enumerate(zip(torch.split(tile_point.int() + point_start, counts), torch.split(pixels, counts))):
+                frame_points[frame_start+offset].append(ids.cpu())
+                frame_pixels[frame_start+offset].append(pix.cpu())
+        del depth_maps
+
+    sizes = torch.tensor([sum(len(ids) for ids in chunks) for chunks in frame_points], dtype=torch.long)
+    offsets = torch.cat([torch.zeros(1, dtype=torch.long), torch.cumsum(sizes, 0)])
+    point_ids = torch.cat([ids for chunks in frame_points for ids in chunks]) if num_frames else torch.zeros(0, dtype=torch.int32)
+    pixels = torch.cat([pix for chunks in frame_pixels for pix in chunks]) if num_frames else torch.zeros((0, 2), dtype=torch.int16)
+    return SparseProjections(offsets, point_ids, pixels, num_points)
@@ -0,0 +1,105 @@
+import os
+import os.path as osp
+import hashlib
+from collections import OrderedDict
+import torch
+
+
+def checkpoint_fingerprint(path):
+    """
+    Cheap identity of a checkpoint file (name, size, mtime), so embeddings
+    produced by different weights never share a cache entry.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return osp.basename(path)
+    return f"{osp.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+class PromptEmbeddingCache():
+    """
+    Text-prompt embeddings keyed by (text encoder, prompt string).
+
+    Hot prompts live in an in-memory LRU; every embedding ever computed for an
+    encoder is also kept on disk in one file per encoder, so a fixed
+    vocabulary is encoded once per machine rather than once per frame.
+    """
+
+    def __init__(self, encoder_id, cache_dir=None, max_items=4096):
+        self.encoder_id = encoder_id
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def path(self):
+        if self.cache_dir is None:
+            return None
+        name = hashlib.sha1(self.encoder_id.encode("utf-8")).hexdigest()[:16]
+        return osp.join(self.cache_dir, f"{name}.pt")
+
+    def _load_disk(self):
+        if self.path is None or not osp.exists(self.path):
+            return {}
+        try:
+            stored = torch.load(self.path, map_location="cpu")
+        except Exception as exc:
+            print(f"Ignoring unreadable prompt embedding cache {self.path}: {exc}")
+            return {}
+        if stored.get("encoder") != self.encoder_id:
+            return {}
+        return stored["embeddings"]
+
+    def _save_disk(self, embeddings):
+        if self.path is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        torch.save({"encoder": self.encoder_id, "embeddings": embeddings}, tmp)
+        os.replace(tmp, self.path)
+
+    def _remember(self, prompt, embedding):
+        self._memory[prompt] = embedding
+        self._memory.move_to_end(prompt)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def get(self, prompts, encode_fn):
+        """
+        Embeddings for ``prompts`` as a (N, D) float CPU tensor, in order.
+        ``encode_fn(list_of_prompts)`` is only called for prompts found in
+        neither tier and must return one (D,) row per prompt.
+        """
+        found = {}
+        for prompt in prompts:
+            if prompt in found:
+                continue
+            if prompt in self._memory:
+                self._memory.move_to_end(prompt)
+                found[prompt] = self._memory[prompt]
+                self.hits += 1
+
+        missing = [p for p in dict.fromkeys(prompts) if p not in found]
+        if missing:
+            stored = self._load_disk()
+            to_encode = [p for p in missing if p not in stored]
+            self.disk_hits += len(missing) - len(to_encode)
+            if to_encode:
+                self.misses += len(to_encode)
+                encoded = encode_fn(to_encode).detach().float().cpu()
+                for prompt, embedding in zip(to_encode, encoded):
+                    stored[prompt] = embedding.clone()
+                self._save_disk(stored)
+            for prompt in missing:
+                found[prompt] = stored[prompt]
+                self._remember(prompt, stored[prompt])
+
+        return torch.stack([found[p] for p in prompts])
+
+    def stats(self):
+        return {"encoder": self.encoder_id, "in_memory": len(self._memory),
+                "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses}
@@ -0,0 +1,141 @@
+import os
+import os.path as osp
+import json
+import hashlib
+import torch
+from utils.packed_masks import PackedMasks
+from utils.projection import SparseProjections
+
+HASH_CHUNK = 1 << 20
+
+
+def hash_file(path, hasher):
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(HASH_CHUNK), b""):
+            hasher.update(chunk)
+
+
+class SceneCache():
+    """
+    On-disk cache of the prompt-independent half of ``OpenYolo3D.predict``:
+    the NMS-filtered Mask3D proposals (bit-packed) and the per-frame visible
+    point lists. Entries are keyed by a content hash of the scene files they
+    were computed from plus the config values that affect them, so changing
+    only the text prompts reuses both.
+
+    With ``max_bytes`` the directory is kept under that size: every store
+    deletes the least recently used entries (a hit refreshes an entry's
+    mtime) until the new one fits.
+    """
+
+    def __init__(self, cache_dir, max_bytes=0):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_stored = 0
+        self.evicted = 0
+        self._file_digests = {}
+
+    def file_digest(self, path):
+        # content hash, memoised per (path, size, mtime) so re-queries skip re-reading the PLY
+        stat = os.stat(path)
+        memo_key = (osp.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self._file_digests:
+            hasher = hashlib.sha1()
+            hash_file(path, hasher)
+            self._file_digests[memo_key] = hasher.hexdigest()
+        return self._file_digests[memo_key]
+
+    def key(self, kind, files=(), stat_files=(), **params):
+        """
+        Cache key of one entry: content hashes of ``files``, size and mtime of
+        ``stat_files`` (too many to hash, e.g. depth maps) and ``params``.
+        """
+        hasher = hashlib.sha1(kind.encode("utf-8"))
+        for path in files:
+            hasher.update(self.file_digest(path).encode("utf-8"))
+        for path in stat_files:
+            stat = os.stat(path)
+            hasher.update(f"{osp.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+        hasher.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        return f"{kind}_{hasher.hexdigest()}"
+
+    def _path(self, key):
+        return osp.join(self.cache_dir, f"{key}.pt")
+
+    def _load(self, key):
+        path = self._path(key)
+        if not osp.exists(path):
+            self.misses += 1
+            return None
+        try:
+            entry = torch.load(path, map_location="cpu")
+        except Exception as exc:
+            print(f"[WARNING] Ignoring unreadable scene cache entry {path}: {exc}")
+            self.misses += 1
+            return None
+        try:
+            # mtime is the entry's last use for the LRU pruning
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return entry
+
+    def _store(self, key, entry):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        torch.save(entry, tmp)
+        os.replace(tmp, path)
+        self.bytes_stored += os.path.getsize(path)
+        if self.max_bytes:
+            self._prune(keep=path)
+
+    def _prune(self, keep):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = osp.join(self.cache_dir, name)
+            if not name.endswith(".pt"):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evicted += 1
+
+    def load_proposals(self, key):
+        """(masks as ``PackedMasks``, scores (N,)) or None"""
+        entry = self._load(key)
+        if entry is None:
+            return None
+        return PackedMasks(entry["masks"], entry["num_points"]), entry["scores"]
+
+    def store_proposals(self, key, masks, scores):
+        self._store(key, {"masks": masks.cpu().packed, "num_points": masks.num_points, "scores": scores.cpu()})
+
+    def load_projections(self, key):
+        entry = self._load(key)
+        if entry is None:
+            return None
+        return SparseProjections(entry["offsets"], entry["point_ids"], entry["pixels"], entry["num_points"])
+
+    def store_projections(self, key, projections):
+        self._store(key, {"offsets": projections.offsets, "point_ids": projections.point_ids,
+                          "pixels": projections.pixels, "num_points": projections.num_points})
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes_stored": self.bytes_stored, "evicted": self.evicted}
@@ -0,0 +1,98 @@
+import queue
+import threading
+import time
+
+# end of the scene stream, passed down the queues after the last scene
+_DONE = object()
+
+
+class ScenePipeline():
+    """
+    Runs scenes through a chain of stages, e.g. loading (projections and 3D
+    proposals), 2D detection and labeling, with one thread per stage and a
+    bounded queue between consecutive stages. Scene N can then be detected
+    while scene N+1 loads and scene N-1 is labeled, and the GPU keeps working
+    during depth I/O and Python-side labeling.
+
+    Every stage handles the scenes one at a time in input order, so each
+    scene goes through the same calls as in a sequential loop and the results
+    are the same. ``queue_size`` bounds how many scenes wait between two
+    stages, which also bounds how many scenes are held in memory.
+    """
+
+    def __init__(self, stages, queue_size=1):
+        # stages: [(name, function)], each function maps the previous stage's output to its own
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.busy = {name: 0.0 for name, _ in self.stages}
+        self.waiting = {name: 0.0 for name, _ in self.stages}
+        self.blocked = {name: 0.0 for name, _ in self.stages}
+        self.scenes = {name: 0 for name, _ in self.stages}
+        self.wall_time = 0.0
+        self.errors = []
+
+    def run_stage(self, name, function, inputs, outputs):
+        while True:
+            start = time.time()
+            item = inputs.get()
+            self.waiting[name] += time.time() - start
+            if item is _DONE or self.errors:
+                break
+            start = time.time()
+            try:
+                result = function(item)
+            except BaseException as error:
+                self.errors.append((name, error))
+                break
+            self.busy[name] += time.time() - start
+            self.scenes[name] += 1
+            start = time.time()
+            outputs.put(result)
+            self.blocked[name] += time.time() - start
+        # downstream stages drain what is queued and stop, upstream ones stop at their next put
+        outputs.put(_DONE)
+        while item is not _DONE:
+            item = inputs.get()
+
+    def run(self, items):
+        """Outputs of the last stage for ``items``, in input order"""
+        start = time.time()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages)+1)]
+        queues[-1] = queue.Queue()
+        threads = [threading.Thread(target=self.run_stage, args=(name, function, queues[i], queues[i+1]), name=f"stage-{name}", daemon=True)
+                   for i, (name, function) in enumerate(self.stages)]
+        for thread in threads:
+            thread.start()
+        results = []
+        feeder = threading.Thread(target=self.feed, args=(items, queues[0]), daemon=True)
+        feeder.start()
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            results.append(item)
+        feeder.join()
+        for thread in threads:
+            thread.join()
+        self.wall_time += time.time() - start
+        if self.errors:
+            name, error = self.errors[0]
+            raise RuntimeError(f"Stage '{name}' failed") from error
+        return results
+
+    def feed(self, items, inputs):
+        for item in items:
+            if self.errors:
+                break
+            inputs.put(item)
+        inputs.put(_DONE)
+
+    def stats(self):
+        """Per stage scenes, busy time, time waiting for input or for room downstream, and busy share of the wall time"""
+        report = {}
+        for name, _ in self.stages:
+            report[name] = {"scenes": self.scenes[name], "busy_s": round(self.busy[name], 3),
+                            "wait_in_s": round(self.waiting[name], 3), "wait_out_s": round(self.blocked[name], 3),
+                            "utilization": round(self.busy[name] / max(self.wall_time, 1e-9), 3)}
+        report["wall_s"] = round(self.wall_time, 3)
+        return report
@@ -1,8 +1,11 @@
 # Copyright (c) Tencent Inc. All rights reserved.
 import os
 import cv2
+import time
 import os.path as osp
-from torchvision.ops import nms
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from torchvision.ops import batched_nms
 import torch
 from mmengine.runner.amp import autocast
 from tqdm import tqdm
@@ -13,6 +16,9 @@ from mmyolo.registry import RUNNERS
 from mmengine.config import Config, DictAction
 from mmengine.runner import Runner
 import supervision as sv
+from utils.prompt_cache import PromptEmbeddingCache, checkpoint_fingerprint
+from utils.device import get_device
+from utils.profiler import Profiler
 
 def load_yaml(path):
     with open(path) as stream:
@@ -34,12 +40,18 @@ def get_image_resolution(image_path):
     return width, height
 
 class Network_2D():
-    def __init__(self, config):
+    def __init__(self, config, device=None, profiler=None):
         self.texts = [[t] for t in config["network2d"]["text_prompts"]] + [[' ']]
         self.topk = config["network2d"]["topk"]
         self.th = config["network2d"]["th"]
         self.nms = config["network2d"]["nms"]
-        self.use_amp = config["network2d"]["use_amp"]
+        self.device = get_device(config["openyolo3d"].get("device", "auto")) if device is None else device
+        self.profiler = Profiler(enabled=False) if profiler is None else profiler
+        # mixed precision only pays off on CUDA
+        self.use_amp = config["network2d"]["use_amp"] and self.device.type == "cuda"
+        self.batch_size = config["network2d"].get("batch_size", 1)
+        self.num_workers = config["network2d"].get("num_workers", 4)
+        self.prefetch = config["network2d"].get("prefetch", 2*max(self.batch_size, self.num_workers))
         self.resolution = None  
         self.frequency = config["openyolo3d"]["frequency"]
         cfg = Config.fromfile(os.path.join(os.getcwd(), config["network2d"]["config_path"]))
@@ -55,58 +67,143 @@ class Network_2D():
         self.runner.load_or_resume()
         pipeline = cfg.test_dataloader.dataset.pipeline
         self.runner.pipeline = Compose(pipeline)
+        # same pipeline for frames already in memory (live sessions)
+        self.array_pipeline = Compose([dict(pipeline[0], type='mmdet.LoadImageFromNDArray')] + list(pipeline[1:]))
+        self.runner.model.to(self.device)
         self.runner.model.eval() 
+        
+        text_model = cfg.model.backbone.get("text_model", {})
+        encoder_id = f'{text_model.get("model_name", text_model.get("type", "text_model"))}@{checkpoint_fingerprint(cfg.load_from)}'
+        cache_dir = config["network2d"].get("embedding_cache_dir", "pretrained/prompt_embeddings")
+        self.prompt_cache = PromptEmbeddingCache(encoder_id, 
+                                                 os.path.join(os.getcwd(), cache_dir) if cache_dir else None)
+        self.encoded_texts = None
+        self.set_texts(self.texts)
+
+    def encode_prompts(self, prompts):
+        with torch.no_grad():
+            text_feats = self.runner.model.backbone.forward_text([[p] for p in prompts])
+        return text_feats.reshape(len(prompts), -1)
+
+    def set_texts(self, texts):
+        # Same effect as YOLOWorldDetector.reparameterize, but served from the
+        # prompt cache; frames then only run the image backbone
+        if texts == self.encoded_texts:
+            return
+        text_feats = self.prompt_cache.get([t[0] for t in texts], self.encode_prompts)
+        self.texts = texts
+        self.text_feats = text_feats[None].to(next(self.runner.model.parameters()).device)
+        self.runner.model.texts = texts
+        self.runner.model.text_feats = self.text_feats
+        self.encoded_texts = texts
 
     def get_bounding_boxes(self, path_2_images, text=None): 
-        self.texts = [[t] for t in text] + [[' ']] if text is not None else self.texts 
+        if text is not None:
+            self.set_texts([[t] for t in text] + [[' ']])
         print(f"Infering from {len(path_2_images)} images")
         
         scene_preds = {}
-        for image_path in tqdm(path_2_images):
-            frame_prediction = self.inference_detector([image_path]) 
-            scene_preds.update(frame_prediction)
+        start = time.time()
+        batch = []
+        with tqdm(total=len(path_2_images)) as progress:
+            for frame in self.prefetch_frames(path_2_images):
+                batch.append(frame)
+                if len(batch) == self.batch_size:
+                    scene_preds.update(self.detect_batch(batch))
+                    progress.update(len(batch))
+                    batch = []
+            if len(batch) > 0:
+                scene_preds.update(self.detect_batch(batch))
+                progress.update(len(batch))
+        self.frames_per_second = len(path_2_images) / max(time.time() - start, 1e-9)
+        print(f"{self.frames_per_second:.2f} frames/sec (batch size {self.batch_size})")
         return scene_preds
 
+    def prepare_frame(self, img_id, image_path):
+        data_info = dict(img_id=img_id, img_path=image_path, texts=self.texts)
+        data_info = self.runner.pipeline(data_info)
+        # without texts the detector uses the cached text_feats
+        del data_info['data_samples'].texts
+        return image_path, data_info['inputs'], data_info['data_samples']
+
+    def prefetch_frames(self, path_2_images):
+        """
+        Yields prepared frames in order. Decoding and the test pipeline run in a
+        thread pool with at most ``self.prefetch`` frames in flight, so they
+        overlap with the detector instead of stalling it.
+        """
+        if self.num_workers == 0:
+            for img_id, image_path in enumerate(path_2_images):
+                yield self.prepare_frame(img_id, image_path)
+            return
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            pending = deque()
+            for img_id, image_path in enumerate(path_2_images):
+                pending.append(pool.submit(self.prepare_frame, img_id, image_path))
+                if len(pending) >= self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def prepare_array(self, img_id, image):
+        data_info = dict(img_id=img_id, img=image, texts=self.texts)
+        data_info = self.array_pipeline(data_info)
+        del data_info['data_samples'].texts
+        return str(img_id), data_info['inputs'], data_info['data_samples']
+
+    def detect_arrays(self, images, frame_ids):
+        """
+        Boxes of in-memory RGB frames (H, W, 3) uint8, keyed by the string of
+        each of ``frame_ids`` like ``get_bounding_boxes`` keys frames by name.
+        """
+        if self.resolution is None:
+            self.resolution = (images[0].shape[1], images[0].shape[0])
+        # the test pipeline expects BGR, as cv2 decodes files
+        return self.detect_batch([self.prepare_array(frame_id, image[..., ::-1].copy()) for frame_id, image in zip(frame_ids, images)])
+
     def inference_detector(self, images_batch):
-        
+        return self.detect_batch([self.prepare_frame(img_id, image_path) for img_id, image_path in enumerate(images_batch)])
+
+    def detect_batch(self, frames):
+        paths, inputs, data_samples = zip(*frames)
         if self.resolution is None:
-            self.resolution = get_image_resolution(images_batch[0])
-        inputs = []
-        data_samples = []
-        for img_id, image_path in enumerate(images_batch):
-            data_info = dict(img_id=img_id, img_path=image_path, texts=self.texts)
-            data_info = self.runner.pipeline(data_info)
-            inputs.append(data_info['inputs'])
-            data_samples.append(data_info['data_samples'])
-        
+            self.resolution = get_image_resolution(paths[0])
         
         data_batch = dict(inputs=torch.stack(inputs),
-                        data_samples=data_samples)
+                        data_samples=list(data_samples))
+        self.runner.model.text_feats = self.text_feats.expand(len(inputs), -1, -1)
         
-        with autocast(enabled=self.use_amp), torch.no_grad():
+        with self.profiler.span("detector", frames=len(inputs)), autocast(enabled=self.use_amp), torch.no_grad():
             output = self.runner.model.test_step(data_batch)
-        frame_prediction = {}
+        with self.profiler.span("postprocess", frames=len(inputs)) as span:
+            frame_prediction = self.postprocess(paths, [out.pred_instances for out in output])
+            span["boxes"] = sum(len(prediction["bbox"]) for prediction in frame_prediction.values())
+        return frame_prediction
 
-        for img_id, image_path in enumerate(images_batch):
-            with autocast(enabled=self.use_amp), torch.no_grad():
-                pred_instances = output[img_id].pred_instances
-            keep = nms(pred_instances.bboxes, pred_instances.scores, iou_threshold=self.nms)
-            pred_instances = pred_instances[keep]
-            pred_instances = pred_instances[pred_instances.scores.float() > self.th]
-            
-            if len(pred_instances.scores) > self.topk:
-                indices = pred_instances.scores.float().topk(self.topk)[1]
-                pred_instances = pred_instances[indices]
-            mask = ~(((pred_instances['bboxes'][:,2]-pred_instances['bboxes'][:,0] > self.resolution[0]-50)*(pred_instances['bboxes'][:,3]-pred_instances['bboxes'][:,1] > self.resolution[1]-50)) == 1)
-            bboxes_ = pred_instances['bboxes'][mask].cpu()
-            labels_ = pred_instances['labels'][mask].cpu()
-            scores_ = pred_instances['scores'][mask].cpu()
+    def postprocess(self, paths, preds):
+        """Score threshold, per-frame NMS, top-k and full-frame box removal for a whole batch on the device"""
+        bboxes = torch.cat([pred.bboxes for pred in preds])
+        labels = torch.cat([pred.labels for pred in preds])
+        scores = torch.cat([pred.scores for pred in preds])
+        frame_ids = torch.cat([torch.full((len(pred),), i, dtype=torch.long) for i, pred in enumerate(preds)]).to(bboxes.device)
+        
+        # thresholding first is exact: a box under the threshold could only
+        # have suppressed boxes scoring even lower
+        keep = torch.where(scores.float() > self.th)[0]
+        keep = keep[batched_nms(bboxes[keep].float(), scores[keep].float(), frame_ids[keep], self.nms)]
+        # batched_nms sorts by score; a stable sort by frame keeps that order per frame
+        keep = keep[torch.sort(frame_ids[keep], stable=True)[1]]
+        counts = torch.bincount(frame_ids[keep], minlength=len(preds))
+        rank = torch.arange(len(keep), device=keep.device) - (torch.cumsum(counts, 0) - counts)[frame_ids[keep]]
+        keep = keep[rank < self.topk]
+        
+        full_frame = ((bboxes[keep, 2] - bboxes[keep, 0] > self.resolution[0]-50)*(bboxes[keep, 3] - bboxes[keep, 1] > self.resolution[1]-50)) == 1
+        keep = keep[~full_frame]
+        counts = torch.bincount(frame_ids[keep], minlength=len(preds)).tolist()
+        
+        frame_prediction = {}
+        for image_path, bboxes_, labels_, scores_ in zip(paths, *(t[keep].cpu().split(counts) for t in (bboxes, labels, scores))):
             frame_id = osp.basename(image_path).split(".")[0] 
-            
             frame_prediction.update({frame_id:{"bbox":bboxes_, "labels":labels_, "scores":scores_}})
         
         return frame_prediction
-        
-            
-
-
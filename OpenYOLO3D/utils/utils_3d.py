@@ -1,19 +1,23 @@
 
 import sys
 sys.path.append("..")
-from models.Mask3D.mask3d import get_model, load_mesh, prepare_data, map_output_to_pointcloud, save_colorized_mesh 
+from models.Mask3D.mask3d import get_model, load_mesh, prepare_data, map_output_to_voxels, save_colorized_mesh 
+from utils.packed_masks import PackedMasks
+from utils.device import get_device
 import torch
 
 class Network_3D():
-    def __init__(self, config):
+    def __init__(self, config, device=None):
         self.model = get_model(config["network3d"]["pretrained_path"])
         self.model.eval()
-        self.device = torch.device("cuda:0")
+        self.device = get_device(config["openyolo3d"].get("device", "auto")) if device is None else device
         self.model.to(self.device)
     
     def get_class_agnostic_masks(self, pointcloud_file, datatype="point cloud", point2segment=None):
         data, points, colors, features, unique_map, inverse_map, point2segment, point2segment_full = prepare_data(pointcloud_file, datatype, self.device)
         with torch.no_grad():
             outputs = self.model(data, raw_coordinates=features, point2segment=[point2segment] if point2segment is not None else None)
-        return map_output_to_pointcloud(outputs, inverse_map, point2segment, point2segment_full)
+        # expand to every input point straight into bit-packed rows, never as (points x queries) floats
+        voxel_masks, scores = map_output_to_voxels(outputs, point2segment)
+        return PackedMasks.from_voxels(voxel_masks, inverse_map, point2segment_full[0] if point2segment_full is not None else None), scores
         
\ No newline at end of file
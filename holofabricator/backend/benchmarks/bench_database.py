@@ -0,0 +1,123 @@
+"""
+Upload-burst microbenchmark for the scans database.
+
+Simulates several headsets uploading at once (save_scan + update_mesh_status
+per upload) and reports uploads/sec for the old connect-per-call layer and
+the pooled WAL layer in database.py.
+
+    cd backend && python -m benchmarks.bench_database --clients 8 --uploads 200
+
+On a single-core container the pooled layer ran about 1.2-2.2x the old one
+at 4 clients x 50 uploads and 2.2-2.8x at 8 clients x 100-200 uploads
+(roughly 350 -> 900 uploads/sec); run-to-run noise is large, so repeat it.
+"""
+
+import argparse
+import asyncio
+import json
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import ScanDatabase  # noqa: E402
+
+ANALYSIS = {
+    "object_name": "Cordless Drill",
+    "category": "Power Tool",
+    "description": "Benchmark payload " + "x" * 512,
+    "parts": [{"name": f"part {i}", "function": "spin", "material": "steel"} for i in range(12)],
+    "materials": ["steel", "ABS"],
+    "confidence": 0.9,
+}
+
+
+class LegacyDatabase:
+    """The pre-pool layer: one connection and rollback-journal commit per call"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        conn = sqlite3.connect(db_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS scans (
+                scan_id TEXT PRIMARY KEY, timestamp TEXT NOT NULL, image_path TEXT NOT NULL,
+                analysis TEXT NOT NULL, mesh_file TEXT, mesh_status TEXT DEFAULT 'pending',
+                mesh_timings TEXT, created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+        conn.close()
+
+    def save_scan(self, scan_id, analysis):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute(
+            "INSERT OR REPLACE INTO scans (scan_id, timestamp, image_path, analysis, mesh_file, mesh_status) VALUES (?, ?, ?, ?, ?, ?)",
+            (scan_id, "now", f"uploads/{scan_id}.jpg", json.dumps(analysis), None, "processing"),
+        )
+        conn.commit()
+        conn.close()
+
+    def update_mesh_status(self, scan_id):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("UPDATE scans SET mesh_file = ?, mesh_status = ? WHERE scan_id = ?",
+                     (f"meshes/{scan_id}_mesh.ply", "ready", scan_id))
+        conn.commit()
+        conn.close()
+
+
+def bench_legacy(db_path: Path, clients: int, uploads: int) -> float:
+    db = LegacyDatabase(db_path)
+
+    def headset(client_id: int):
+        for i in range(uploads):
+            scan_id = f"legacy_{client_id}_{i}"
+            db.save_scan(scan_id, ANALYSIS)
+            db.update_mesh_status(scan_id)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(headset, range(clients)))
+    return clients * uploads / (time.perf_counter() - start)
+
+
+def bench_pooled(db_path: Path, clients: int, uploads: int) -> float:
+    db = ScanDatabase(db_path)
+    db.init_schema().result()
+
+    async def headset(client_id: int):
+        for i in range(uploads):
+            scan_id = f"pooled_{client_id}_{i}"
+            await asyncio.wrap_future(db.save_scan(scan_id, "now", f"uploads/{scan_id}.jpg", ANALYSIS, None, "processing"))
+            await asyncio.wrap_future(db.update_mesh_status(scan_id, f"meshes/{scan_id}_mesh.ply", "ready"))
+
+    async def burst():
+        await asyncio.gather(*(headset(c) for c in range(clients)))
+
+    start = time.perf_counter()
+    asyncio.run(burst())
+    rate = clients * uploads / (time.perf_counter() - start)
+    db.close()
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent headsets")
+    parser.add_argument("--uploads", type=int, default=200, help="uploads per headset")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = bench_legacy(Path(tmp) / "legacy.db", args.clients, args.uploads)
+        pooled = bench_pooled(Path(tmp) / "pooled.db", args.clients, args.uploads)
+
+    print(f"clients={args.clients} uploads/client={args.uploads}")
+    print(f"  connect-per-call : {legacy:8.1f} uploads/sec")
+    print(f"  pooled WAL       : {pooled:8.1f} uploads/sec  ({pooled / legacy:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Offline throughput benchmark for the Gemini gateway.
+
+Fires a burst of requests (a share of them exact duplicates, like Quest
+clients retrying an upload) at a FakeGenerativeModel, once by calling the
+blocking SDK method inline from async code (the old handlers) and once
+through GeminiGateway. A ticker coroutine measures how long the event loop
+stalls, which is what /ws/voice audio relays feel.
+
+    cd backend && python -m benchmarks.bench_gemini_gateway --requests 40 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.fake_gemini import FakeGenerativeModel  # noqa: E402
+from services.gemini_gateway import GeminiGateway, request_key  # noqa: E402
+
+
+async def loop_lag_probe(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """Largest observed delay between scheduled and actual wake-ups (ms)"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst * 1000.0
+
+
+def prompts_for(n: int, duplicate_ratio: float):
+    unique = max(1, int(round(n * (1.0 - duplicate_ratio))))
+    return [f"Analyze object #{i % unique}" for i in range(n)]
+
+
+async def run_inline(model: FakeGenerativeModel, prompts) -> dict:
+    async def handler(prompt):
+        return model.generate_content([prompt])
+
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(p) for p in prompts))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return {"elapsed": elapsed, "lag_ms": await probe, "calls": model.calls}
+
+
+async def run_gateway(model: FakeGenerativeModel, prompts, concurrency: int) -> dict:
+    gateway = GeminiGateway(max_concurrency=concurrency, timeout=30, max_retries=2, backoff_base=0.05)
+
+    async def handler(prompt):
+        return await gateway.call("analyze", model.generate_content, [prompt], key=request_key("analyze", prompt))
+
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(p) for p in prompts))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    result = {"elapsed": elapsed, "lag_ms": await probe, "calls": model.calls,
+              "stats": gateway.stats()["endpoints"]["analyze"]}
+    gateway.shutdown()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency (s)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duplicates", type=float, default=0.25, help="share of duplicate requests")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    prompts = prompts_for(args.requests, args.duplicates)
+    inline = asyncio.run(run_inline(FakeGenerativeModel(args.latency, failure_rate=0.0), prompts))
+    gated = asyncio.run(run_gateway(FakeGenerativeModel(args.latency, failure_rate=args.failure_rate),
+                                    prompts, args.concurrency))
+
+    print(f"requests={args.requests} latency={args.latency}s concurrency={args.concurrency} "
+          f"duplicates={args.duplicates:.0%}")
+    for name, r in (("inline (blocking)", inline), ("gateway", gated)):
+        print(f"  {name:18s}: {args.requests / r['elapsed']:7.1f} req/s  "
+              f"model calls={r['calls']:4d}  worst loop stall={r['lag_ms']:8.1f} ms")
+    s = gated["stats"]
+    print(f"  gateway p50<={s['p50_ms']} ms p95<={s['p95_ms']} ms retries={s['retries']} coalesced={s['coalesced']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Parse-time and memory benchmark for /upload-webxr-mesh body formats.
+
+Builds a grid mesh the size of a Quest room scan and decodes it three ways:
+the nested-JSON body MeshData was designed for, the flat-JSON body the WebXR
+pages actually send, and the binary format from services/mesh_codec.py.
+Memory is the tracemalloc peak while decoding (the body itself excluded).
+
+    cd backend && python -m benchmarks.bench_mesh_transport --vertices 500000
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+from pydantic import BaseModel
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.mesh_codec import decode_mesh, encode_mesh, mesh_from_lists  # noqa: E402
+
+
+class MeshData(BaseModel):
+    """Mirror of main_v4.MeshData (importing main_v4 would start the app)"""
+
+    vertices: Union[List[List[float]], List[float]]
+    indices: List[int]
+    semantic_label: Optional[str] = None
+
+
+def grid_mesh(n_vertices: int):
+    side = max(2, int(np.sqrt(n_vertices)))
+    ys, xs = np.mgrid[0:side, 0:side].astype(np.float32) / side
+    vertices = np.stack([xs.ravel(), ys.ravel(), np.sin(xs * 6.0).ravel() * 0.05], axis=1)
+    idx = np.arange(side * side, dtype=np.uint32).reshape(side, side)
+    a, b, c, d = idx[:-1, :-1].ravel(), idx[1:, :-1].ravel(), idx[:-1, 1:].ravel(), idx[1:, 1:].ravel()
+    indices = np.concatenate([np.stack([a, b, c], 1), np.stack([b, d, c], 1)])
+    return vertices, indices
+
+
+def decode_json(body: bytes):
+    data = MeshData(**json.loads(body))
+    return mesh_from_lists(data.vertices, data.indices, data.semantic_label)
+
+
+def measure(fn, body, repeats: int):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(body)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best * 1000.0, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vertices", type=int, default=500_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    vertices, indices = grid_mesh(args.vertices)
+    label = "global mesh"
+    bodies = {
+        "json (nested)": json.dumps({"vertices": vertices.tolist(), "indices": indices.ravel().tolist(),
+                                     "semantic_label": label}).encode(),
+        "json (flat)": json.dumps({"vertices": vertices.ravel().tolist(), "indices": indices.ravel().tolist(),
+                                   "semantic_label": label}).encode(),
+        "binary": encode_mesh(vertices, indices, label),
+    }
+    decoders = {"json (nested)": decode_json, "json (flat)": decode_json, "binary": decode_mesh}
+
+    reference = decode_mesh(bodies["binary"])
+    print(f"vertices={len(vertices)} triangles={len(indices)}")
+    for name, body in bodies.items():
+        decoded = decoders[name](body)
+        assert np.array_equal(decoded.vertices, reference.vertices)
+        assert np.array_equal(decoded.indices, reference.indices)
+        ms, peak_mb = measure(decoders[name], body, args.repeats)
+        print(f"  {name:14s}: body {len(body) / 1e6:7.1f} MB  decode {ms:9.1f} ms  peak alloc {peak_mb:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Offline stand-in for google.generativeai.GenerativeModel.
+
+Sleeps for a configurable latency (blocking, like the real SDK) and returns a
+canned analysis, so gateway throughput can be measured without an API key.
+"""
+
+import json
+import random
+import threading
+import time
+
+
+class FakeServiceUnavailable(Exception):
+    """Transient 503, carrying its status as ``code`` like google.api_core exceptions"""
+    code = 503
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """Blocking fake with latency jitter and optional transient failures"""
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.1, failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, **kwargs) -> FakeResponse:
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            fail = self._rng.random() < self.failure_rate
+        time.sleep(delay)
+        if fail:
+            raise FakeServiceUnavailable("503 The model is overloaded. Please try again later.")
+        return FakeResponse(json.dumps({
+            "object_name": "Fake Widget",
+            "category": "Benchmark",
+            "description": "Canned response from FakeGenerativeModel.",
+            "parts": [{"name": "housing", "function": "holds things", "location": "outside", "material": "ABS"}],
+            "materials": ["ABS"],
+            "confidence": 0.9
+        }))
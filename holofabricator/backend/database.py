@@ -1,133 +1,624 @@
 """
 Database layer for HoloFabricator
 Persists scans across server restarts using SQLite
+
+Connections are opened once and reused: reads borrow from a small pool,
+writes go through a single writer thread that group-commits whatever is
+queued into one WAL transaction. The plain functions block the caller;
+the ``*_async`` variants are safe to await from FastAPI handlers.
 """
 
-import sqlite3
+import asyncio
+import base64
 import json
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
-from typing import Optional, List, Dict
+from typing import Any, Callable, Optional, List, Dict
 
 DB_PATH = Path(__file__).parent / "holofabricator.db"
 
+READ_POOL_SIZE = 4
+WRITE_BATCH_MAX = 64          # statements per group commit
+WRITE_BATCH_WINDOW = 0.002    # seconds to wait for more writes to join a batch
+
+# Applied to every connection. WAL lets readers proceed during writes and
+# synchronous=NORMAL only fsyncs at checkpoints, which is safe in WAL mode.
+PRAGMAS = (
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+)
+
+# Statements are module constants so sqlite3's per-connection statement
+# cache hands back the already-prepared statement on every call.
+SQL_SAVE_SCAN = """
+    INSERT OR REPLACE INTO scans (scan_id, timestamp, image_path, analysis, mesh_file, mesh_status,
+                                  object_name, category)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_SCAN_ROWID = "SELECT rowid FROM scans WHERE scan_id = ?"
+# scans_fts rows share the rowid of their scans row, so both statements are
+# rowid lookups rather than scans of the whole index
+SQL_FTS_DELETE = "DELETE FROM scans_fts WHERE rowid = ?"
+SQL_FTS_INSERT = """
+    INSERT INTO scans_fts (rowid, object_name, category, parts)
+    VALUES (?, ?, ?, ?)
+"""
+SQL_GET_SCAN = """
+    SELECT scan_id, timestamp, image_path, analysis, mesh_file, mesh_status, mesh_timings
+    FROM scans WHERE scan_id = ?
+"""
+SQL_UPDATE_MESH = """
+    UPDATE scans SET mesh_file = ?, mesh_status = ?, mesh_timings = COALESCE(?, mesh_timings)
+    WHERE scan_id = ?
+"""
+SQL_ALL_SCANS = """
+    SELECT scan_id, timestamp, object_name, category, mesh_status, created_at
+    FROM scans ORDER BY created_at DESC, scan_id DESC
+"""
+SQL_SCANS_PAGE = """
+    SELECT scan_id, timestamp, object_name, category, mesh_status, created_at
+    FROM scans ORDER BY created_at DESC, scan_id DESC LIMIT ?
+"""
+SQL_SCANS_PAGE_AFTER = """
+    SELECT scan_id, timestamp, object_name, category, mesh_status, created_at
+    FROM scans WHERE (created_at, scan_id) < (?, ?)
+    ORDER BY created_at DESC, scan_id DESC LIMIT ?
+"""
+SQL_COUNT_SCANS = "SELECT COUNT(*) FROM scans"
+SQL_GET_CACHE = "SELECT payload, stored_at FROM analysis_cache WHERE cache_key = ?"
+SQL_PUT_CACHE = """
+    INSERT OR REPLACE INTO analysis_cache (cache_key, kind, payload, stored_at)
+    VALUES (?, ?, ?, ?)
+"""
+SQL_PRUNE_CACHE_EXPIRED = "DELETE FROM analysis_cache WHERE stored_at < ?"
+SQL_PRUNE_CACHE_EXCESS = """
+    DELETE FROM analysis_cache WHERE cache_key IN (
+        SELECT cache_key FROM analysis_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?
+    )
+"""
+SQL_SEARCH_SCANS = """
+    SELECT s.scan_id, s.timestamp, s.object_name, s.category, s.mesh_status, s.created_at
+    FROM scans_fts JOIN scans s ON s.rowid = scans_fts.rowid
+    WHERE scans_fts MATCH ? ORDER BY scans_fts.rank LIMIT ?
+"""
+SQL_GET_ROOM_ANCHOR = """
+    SELECT room_id, anchor_key, scan_id, revision, vertex_count, triangle_count, semantic_label,
+           vertex_keys, updated_at
+    FROM room_anchors WHERE room_id = ? AND anchor_key = ?
+"""
+SQL_PUT_ROOM_ANCHOR = """
+    INSERT OR REPLACE INTO room_anchors (room_id, anchor_key, scan_id, revision, vertex_count,
+                                         triangle_count, semantic_label, vertex_keys, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_LIST_ROOM_ANCHORS = """
+    SELECT anchor_key, scan_id, revision, vertex_count, triangle_count, semantic_label, updated_at
+    FROM room_anchors WHERE room_id = ? ORDER BY anchor_key
+"""
+SQL_SAVE_CHAT = """
+    INSERT INTO chat_history (scan_id, question, answer, highlighted_parts)
+    VALUES (?, ?, ?, ?)
+"""
+
+
+def _connect(db_path: Path) -> sqlite3.Connection:
+    """Open a connection with the tuned pragmas and manual transactions"""
+    conn = sqlite3.connect(
+        str(db_path),
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=128,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _summary_fields(analysis: dict):
+    """Columns denormalised out of the analysis blob for listing and search"""
+    parts = analysis.get("parts") or []
+    part_text = " ".join(
+        " ".join(str(part.get(key, "")) for key in ("name", "function"))
+        if isinstance(part, dict) else str(part)
+        for part in parts
+    )
+    return analysis.get("object_name", "Unknown"), analysis.get("category"), part_text
+
+
+def _summary_row(row) -> Dict:
+    return {
+        "scan_id": row[0],
+        "timestamp": row[1],
+        "object_name": row[2] or "Unknown",
+        "category": row[3],
+        "mesh_status": row[4],
+        "created_at": row[5]
+    }
+
+
+def encode_cursor(created_at: str, scan_id: str) -> str:
+    """Opaque keyset cursor for the next page of /scans"""
+    return base64.urlsafe_b64encode(f"{created_at}|{scan_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    created_at, _, scan_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition("|")
+    if not scan_id:
+        raise ValueError("Malformed cursor")
+    return created_at, scan_id
+
+
+def fts_query(text: str) -> str:
+    """Turn free text into an FTS5 prefix query, quoting every token"""
+    tokens = [t for t in text.replace('"', " ").split() if t]
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+class _WriteOp:
+    __slots__ = ("fn", "future")
+
+    def __init__(self, fn: Callable[[sqlite3.Connection], Any]):
+        self.fn = fn
+        self.future: Future = Future()
+
+
+class ScanDatabase:
+    """
+    Pooled SQLite access for the scans database.
+
+    Reads run on ``READ_POOL_SIZE`` reusable connections. Writes are queued
+    to one writer thread, which drains up to ``WRITE_BATCH_MAX`` pending
+    operations into a single ``BEGIN IMMEDIATE ... COMMIT`` so a burst of
+    uploads shares one WAL commit. Each operation runs in its own savepoint,
+    so one failing write does not roll back its neighbours.
+    """
+
+    def __init__(self, db_path: Path = DB_PATH, read_pool_size: int = READ_POOL_SIZE):
+        self.db_path = Path(db_path)
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(read_pool_size):
+            self._readers.put(_connect(self.db_path))
+        self._read_executor = ThreadPoolExecutor(max_workers=read_pool_size, thread_name_prefix="db-read")
+
+        self._writes: "queue.Queue[Optional[_WriteOp]]" = queue.Queue()
+        self._writer_conn = _connect(self.db_path)
+        self._writer = threading.Thread(target=self._write_loop, name="db-writer", daemon=True)
+        self._writer.start()
+
+    # --- plumbing ---
+
+    @contextmanager
+    def _reader(self):
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def _read(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self._reader() as conn:
+            return fn(conn)
+
+    def _submit_write(self, fn: Callable[[sqlite3.Connection], Any]) -> Future:
+        op = _WriteOp(fn)
+        self._writes.put(op)
+        return op.future
+
+    def _write_loop(self) -> None:
+        while True:
+            op = self._writes.get()
+            if op is None:
+                return
+            batch = [op]
+            try:
+                while len(batch) < WRITE_BATCH_MAX:
+                    nxt = self._writes.get(timeout=WRITE_BATCH_WINDOW)
+                    if nxt is None:
+                        self._writes.put(None)
+                        break
+                    batch.append(nxt)
+            except queue.Empty:
+                pass
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch: List[_WriteOp]) -> None:
+        conn = self._writer_conn
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for op in batch:
+                conn.execute("SAVEPOINT op")
+                try:
+                    result = op.fn(conn)
+                    conn.execute("RELEASE op")
+                    outcomes.append((op, result, None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    outcomes.append((op, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for op in batch:
+                if not op.future.done():
+                    op.future.set_exception(e)
+            return
+
+        for op, result, error in outcomes:
+            if error is not None:
+                op.future.set_exception(error)
+            else:
+                op.future.set_result(result)
+
+    def close(self) -> None:
+        """Flush pending writes and close every connection"""
+        self._writes.put(None)
+        self._writer.join()
+        self._writer_conn.close()
+        self._read_executor.shutdown(wait=True)
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+    # --- schema ---
+
+    def init_schema(self) -> Future:
+        def _create(conn: sqlite3.Connection):
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS scans (
+                    scan_id TEXT PRIMARY KEY,
+                    timestamp TEXT NOT NULL,
+                    image_path TEXT NOT NULL,
+                    analysis TEXT NOT NULL,
+                    mesh_file TEXT,
+                    mesh_status TEXT DEFAULT 'pending',
+                    mesh_timings TEXT,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Older databases predate per-stage mesh timings and the
+            # denormalised summary columns
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(scans)")}
+            for column in ("mesh_timings", "object_name", "category"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE scans ADD COLUMN {column} TEXT")
+
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_scans_created_at
+                ON scans (created_at DESC, scan_id DESC)
+            """)
+
+            # Older databases keyed the index by an UNINDEXED scan_id column,
+            # which made every delete a full scan; rebuild them keyed by rowid
+            fts_columns = {row[1] for row in conn.execute("PRAGMA table_info(scans_fts)")}
+            rebuild_fts = "scan_id" in fts_columns
+            if rebuild_fts:
+                conn.execute("DROP TABLE scans_fts")
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS scans_fts USING fts5(
+                    object_name, category, parts,
+                    tokenize = 'porter unicode61'
+                )
+            """)
+
+            # Persistent tier of the content-addressed analysis/render cache
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_analysis_cache_stored_at
+                ON analysis_cache (stored_at)
+            """)
+
+            # One row per WebXR anchor: its current scan and voxel hash set
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS room_anchors (
+                    room_id TEXT NOT NULL,
+                    anchor_key TEXT NOT NULL,
+                    scan_id TEXT NOT NULL,
+                    revision INTEGER NOT NULL,
+                    vertex_count INTEGER,
+                    triangle_count INTEGER,
+                    semantic_label TEXT,
+                    vertex_keys BLOB NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (room_id, anchor_key)
+                )
+            """)
+
+            # Backfill rows written before the summary columns existed, and
+            # every row when the search index was rebuilt
+            stale = conn.execute(
+                "SELECT rowid, analysis FROM scans" if rebuild_fts else
+                "SELECT rowid, analysis FROM scans WHERE object_name IS NULL"
+            ).fetchall()
+            for rowid, analysis_json in stale:
+                object_name, category, part_text = _summary_fields(json.loads(analysis_json))
+                conn.execute("UPDATE scans SET object_name = ?, category = ? WHERE rowid = ?",
+                             (object_name, category, rowid))
+                conn.execute(SQL_FTS_DELETE, (rowid,))
+                conn.execute(SQL_FTS_INSERT, (rowid, object_name, category, part_text))
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    scan_id TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    highlighted_parts TEXT,
+                    timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (scan_id) REFERENCES scans(scan_id)
+                )
+            """)
+
+        return self._submit_write(_create)
+
+    # --- operations (return Futures for writes) ---
+
+    def save_scan(self, scan_id: str, timestamp: str, image_path: str, analysis: dict,
+                  mesh_file: Optional[str] = None, mesh_status: str = "pending") -> Future:
+        object_name, category, part_text = _summary_fields(analysis)
+        params = (scan_id, timestamp, image_path, json.dumps(analysis), mesh_file, mesh_status,
+                  object_name, category)
+
+        def _save(conn: sqlite3.Connection):
+            # REPLACE gives the scan a new rowid, drop the index row of the old one first
+            old = conn.execute(SQL_SCAN_ROWID, (scan_id,)).fetchone()
+            if old:
+                conn.execute(SQL_FTS_DELETE, old)
+            cursor = conn.execute(SQL_SAVE_SCAN, params)
+            conn.execute(SQL_FTS_INSERT, (cursor.lastrowid, object_name, category, part_text))
+            return cursor.rowcount
+
+        return self._submit_write(_save)
+
+    def update_mesh_status(self, scan_id: str, mesh_file: Optional[str], status: str = "ready",
+                           timings: Optional[Dict] = None) -> Future:
+        params = (mesh_file, status, json.dumps(timings) if timings else None, scan_id)
+        return self._submit_write(lambda conn: conn.execute(SQL_UPDATE_MESH, params).rowcount)
+
+    def save_chat(self, scan_id: str, question: str, answer: str, highlighted_parts: List[str]) -> Future:
+        params = (scan_id, question, answer, json.dumps(highlighted_parts))
+        return self._submit_write(lambda conn: conn.execute(SQL_SAVE_CHAT, params).lastrowid)
+
+    def get_scan(self, scan_id: str) -> Optional[Dict]:
+        row = self._read(lambda conn: conn.execute(SQL_GET_SCAN, (scan_id,)).fetchone())
+        if row:
+            return {
+                "scan_id": row[0],
+                "timestamp": row[1],
+                "image_path": row[2],
+                "analysis": json.loads(row[3]),
+                "mesh_file": row[4],
+                "mesh_status": row[5],
+                "mesh_timings": json.loads(row[6]) if row[6] else None
+            }
+        return None
+
+    def get_all_scans(self) -> List[Dict]:
+        rows = self._read(lambda conn: conn.execute(SQL_ALL_SCANS).fetchall())
+        return [_summary_row(row) for row in rows]
+
+    def count_scans(self) -> int:
+        return self._read(lambda conn: conn.execute(SQL_COUNT_SCANS).fetchone()[0])
+
+    def list_scans_page(self, limit: int = 50, cursor: Optional[str] = None) -> Dict:
+        """Newest-first page of scan summaries plus the cursor for the next one"""
+        if cursor:
+            created_at, scan_id = decode_cursor(cursor)
+            sql, params = SQL_SCANS_PAGE_AFTER, (created_at, scan_id, limit + 1)
+        else:
+            sql, params = SQL_SCANS_PAGE, (limit + 1,)
+        rows = self._read(lambda conn: conn.execute(sql, params).fetchall())
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][5], rows[-1][0])
+        return {"scans": [_summary_row(row) for row in rows], "next_cursor": next_cursor}
+
+    def search_scans(self, text: str, limit: int = 20) -> List[Dict]:
+        """Full-text search over object names, categories and part names"""
+        query = fts_query(text)
+        if not query:
+            return []
+        rows = self._read(lambda conn: conn.execute(SQL_SEARCH_SCANS, (query, limit)).fetchall())
+        return [_summary_row(row) for row in rows]
+
+    def get_cache_entry(self, cache_key: str):
+        row = self._read(lambda conn: conn.execute(SQL_GET_CACHE, (cache_key,)).fetchone())
+        if row:
+            return json.loads(row[0]), row[1]
+        return None
+
+    def put_cache_entry(self, cache_key: str, kind: str, payload: Any) -> Future:
+        params = (cache_key, kind, json.dumps(payload), datetime.now().timestamp())
+        return self._submit_write(lambda conn: conn.execute(SQL_PUT_CACHE, params).rowcount)
+
+    def prune_cache(self, max_age: float, max_rows: int) -> Future:
+        """Delete cache rows older than ``max_age`` seconds, then the oldest beyond ``max_rows``"""
+        cutoff = datetime.now().timestamp() - max_age
+
+        def _prune(conn: sqlite3.Connection):
+            expired = conn.execute(SQL_PRUNE_CACHE_EXPIRED, (cutoff,)).rowcount
+            return expired + conn.execute(SQL_PRUNE_CACHE_EXCESS, (max_rows,)).rowcount
+
+        return self._submit_write(_prune)
+
+    def get_room_anchor(self, room_id: str, anchor_key: str) -> Optional[Dict]:
+        row = self._read(lambda conn: conn.execute(SQL_GET_ROOM_ANCHOR, (room_id, anchor_key)).fetchone())
+        if row:
+            keys = ("room_id", "anchor_key", "scan_id", "revision", "vertex_count", "triangle_count",
+                    "semantic_label", "vertex_keys", "updated_at")
+            return dict(zip(keys, row))
+        return None
+
+    def put_room_anchor(self, room_id: str, anchor_key: str, scan_id: str, revision: int,
+                        vertex_count: int, triangle_count: int, semantic_label: Optional[str],
+                        vertex_keys: bytes, updated_at: float) -> Future:
+        params = (room_id, anchor_key, scan_id, revision, vertex_count, triangle_count,
+                  semantic_label, sqlite3.Binary(vertex_keys), updated_at)
+        return self._submit_write(lambda conn: conn.execute(SQL_PUT_ROOM_ANCHOR, params).rowcount)
+
+    def list_room_anchors(self, room_id: str) -> List[Dict]:
+        rows = self._read(lambda conn: conn.execute(SQL_LIST_ROOM_ANCHORS, (room_id,)).fetchall())
+        return [
+            {
+                "anchor": row[0],
+                "scan_id": row[1],
+                "revision": row[2],
+                "vertices": row[3],
+                "triangles": row[4],
+                "semantic_label": row[5],
+                "updated_at": row[6]
+            }
+            for row in rows
+        ]
+
+    async def run_read(self, fn: Callable, *args) -> Any:
+        """Run a read method on the DB read pool without blocking the loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, fn, *args)
+
+
+_db: Optional[ScanDatabase] = None
+_db_lock = threading.Lock()
+
+
+def get_database() -> ScanDatabase:
+    """Return the process-wide database handle, opening it on first use"""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = ScanDatabase(DB_PATH)
+    return _db
+
+
+def close_db():
+    """Flush pending writes and release all connections"""
+    global _db
+    with _db_lock:
+        if _db is not None:
+            _db.close()
+            _db = None
+
+
 def init_db():
     """Initialize database schema"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS scans (
-            scan_id TEXT PRIMARY KEY,
-            timestamp TEXT NOT NULL,
-            image_path TEXT NOT NULL,
-            analysis TEXT NOT NULL,
-            mesh_file TEXT,
-            mesh_status TEXT DEFAULT 'pending',
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            scan_id TEXT NOT NULL,
-            question TEXT NOT NULL,
-            answer TEXT NOT NULL,
-            highlighted_parts TEXT,
-            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (scan_id) REFERENCES scans(scan_id)
-        )
-    """)
-
-    conn.commit()
-    conn.close()
-    print(f"[OK] Database initialized: {DB_PATH}")
+    get_database().init_schema().result()
+    print(f"[OK] Database initialized: {DB_PATH} (WAL, pooled)")
 
 def save_scan(scan_id: str, timestamp: str, image_path: str, analysis: dict, mesh_file: Optional[str] = None, mesh_status: str = "pending"):
     """Save or update a scan"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        INSERT OR REPLACE INTO scans (scan_id, timestamp, image_path, analysis, mesh_file, mesh_status)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (scan_id, timestamp, image_path, json.dumps(analysis), mesh_file, mesh_status))
-
-    conn.commit()
-    conn.close()
+    get_database().save_scan(scan_id, timestamp, image_path, analysis, mesh_file, mesh_status).result()
 
 def get_scan(scan_id: str) -> Optional[Dict]:
     """Retrieve a scan by ID"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT scan_id, timestamp, image_path, analysis, mesh_file, mesh_status
-        FROM scans WHERE scan_id = ?
-    """, (scan_id,))
-
-    row = cursor.fetchone()
-    conn.close()
-
-    if row:
-        return {
-            "scan_id": row[0],
-            "timestamp": row[1],
-            "image_path": row[2],
-            "analysis": json.loads(row[3]),
-            "mesh_file": row[4],
-            "mesh_status": row[5]
-        }
-    return None
-
-def update_mesh_status(scan_id: str, mesh_file: str, status: str = "ready"):
-    """Update mesh file and status"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        UPDATE scans SET mesh_file = ?, mesh_status = ?
-        WHERE scan_id = ?
-    """, (mesh_file, status, scan_id))
-
-    conn.commit()
-    conn.close()
+    return get_database().get_scan(scan_id)
+
+def update_mesh_status(scan_id: str, mesh_file: Optional[str], status: str = "ready", timings: Optional[Dict] = None):
+    """Update mesh file, status and (optionally) the per-stage timing breakdown"""
+    get_database().update_mesh_status(scan_id, mesh_file, status, timings).result()
 
 def get_all_scans() -> List[Dict]:
     """Get all scans"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    return get_database().get_all_scans()
+
+def count_scans() -> int:
+    """Number of stored scans (index-only COUNT, no JSON decoding)"""
+    return get_database().count_scans()
+
+def save_chat(scan_id: str, question: str, answer: str, highlighted_parts: List[str]):
+    """Save chat interaction"""
+    get_database().save_chat(scan_id, question, answer, highlighted_parts).result()
 
-    cursor.execute("""
-        SELECT scan_id, timestamp, analysis, mesh_status
-        FROM scans ORDER BY created_at DESC
-    """)
+# === Async variants for FastAPI handlers ===
 
-    rows = cursor.fetchall()
-    conn.close()
+async def init_db_async():
+    """Initialize database schema without blocking the event loop"""
+    await asyncio.wrap_future(get_database().init_schema())
+    print(f"[OK] Database initialized: {DB_PATH} (WAL, pooled)")
 
-    scans = []
-    for row in rows:
-        analysis = json.loads(row[2])
-        scans.append({
-            "scan_id": row[0],
-            "timestamp": row[1],
-            "object_name": analysis.get("object_name", "Unknown"),
-            "mesh_status": row[3]
-        })
+async def save_scan_async(scan_id: str, timestamp: str, image_path: str, analysis: dict, mesh_file: Optional[str] = None, mesh_status: str = "pending"):
+    """Save or update a scan without blocking the event loop"""
+    await asyncio.wrap_future(get_database().save_scan(scan_id, timestamp, image_path, analysis, mesh_file, mesh_status))
 
-    return scans
+async def get_scan_async(scan_id: str) -> Optional[Dict]:
+    """Retrieve a scan by ID without blocking the event loop"""
+    db = get_database()
+    return await db.run_read(db.get_scan, scan_id)
 
-def save_chat(scan_id: str, question: str, answer: str, highlighted_parts: List[str]):
-    """Save chat interaction"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+async def update_mesh_status_async(scan_id: str, mesh_file: Optional[str], status: str = "ready", timings: Optional[Dict] = None):
+    """Update mesh status without blocking the event loop"""
+    await asyncio.wrap_future(get_database().update_mesh_status(scan_id, mesh_file, status, timings))
+
+async def get_all_scans_async() -> List[Dict]:
+    """Get all scans without blocking the event loop"""
+    db = get_database()
+    return await db.run_read(db.get_all_scans)
+
+async def save_chat_async(scan_id: str, question: str, answer: str, highlighted_parts: List[str]):
+    """Save chat interaction without blocking the event loop"""
+    await asyncio.wrap_future(get_database().save_chat(scan_id, question, answer, highlighted_parts))
+
+async def count_scans_async() -> int:
+    """Count scans without blocking the event loop"""
+    db = get_database()
+    return await db.run_read(db.count_scans)
+
+async def list_scans_page_async(limit: int = 50, cursor: Optional[str] = None) -> Dict:
+    """Fetch one keyset-paginated page of scans without blocking the event loop"""
+    db = get_database()
+    return await db.run_read(db.list_scans_page, limit, cursor)
+
+async def search_scans_async(text: str, limit: int = 20) -> List[Dict]:
+    """Full-text search scans without blocking the event loop"""
+    db = get_database()
+    return await db.run_read(db.search_scans, text, limit)
+
+async def get_cache_entry_async(cache_key: str):
+    """Look up a persisted cache entry -> (payload, stored_at) or None"""
+    db = get_database()
+    return await db.run_read(db.get_cache_entry, cache_key)
+
+async def put_cache_entry_async(cache_key: str, kind: str, payload: Any):
+    """Persist a cache entry without blocking the event loop"""
+    await asyncio.wrap_future(get_database().put_cache_entry(cache_key, kind, payload))
+
+async def prune_cache_async(max_age: float, max_rows: int) -> int:
+    """Expire and trim the persistent cache on the writer thread -> rows deleted"""
+    return await asyncio.wrap_future(get_database().prune_cache(max_age, max_rows))
+
+async def get_room_anchor_async(room_id: str, anchor_key: str) -> Optional[Dict]:
+    """Look up a WebXR anchor's stored state without blocking the event loop"""
+    db = get_database()
+    return await db.run_read(db.get_room_anchor, room_id, anchor_key)
 
-    cursor.execute("""
-        INSERT INTO chat_history (scan_id, question, answer, highlighted_parts)
-        VALUES (?, ?, ?, ?)
-    """, (scan_id, question, answer, json.dumps(highlighted_parts)))
+async def put_room_anchor_async(room_id: str, anchor_key: str, scan_id: str, revision: int,
+                                vertex_count: int, triangle_count: int, semantic_label: Optional[str],
+                                vertex_keys: bytes, updated_at: float):
+    """Persist a WebXR anchor's state without blocking the event loop"""
+    await asyncio.wrap_future(get_database().put_room_anchor(
+        room_id, anchor_key, scan_id, revision, vertex_count, triangle_count,
+        semantic_label, vertex_keys, updated_at))
 
-    conn.commit()
-    conn.close()
+async def list_room_anchors_async(room_id: str) -> List[Dict]:
+    """List a room's anchors without blocking the event loop"""
+    db = get_database()
+    return await db.run_read(db.list_room_anchors, room_id)
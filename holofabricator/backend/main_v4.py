@@ -6,7 +6,7 @@ HoloFabricator Backend v4 - 3D File Upload Support
 - All v3 features included
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
@@ -16,12 +16,11 @@ import io
 import os
 import json
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Tuple, Union
 import numpy as np
 import open3d as o3d
 from datetime import datetime
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 import shutil
 
 # Load environment variables
@@ -30,13 +29,41 @@ load_dotenv()
 
 # Import database
 from database import (
-    init_db, save_scan, get_scan, update_mesh_status,
-    get_all_scans, save_chat
+    init_db_async, close_db,
+    save_scan_async, get_scan_async, update_mesh_status_async,
+    save_chat_async, count_scans_async, list_scans_page_async,
+    search_scans_async, get_cache_entry_async, put_cache_entry_async, prune_cache_async,
+    get_room_anchor_async, put_room_anchor_async, list_room_anchors_async
 )
 
+# Off-loop Gemini calls (concurrency limit, timeouts, retries, coalescing)
+from services.gemini_gateway import GeminiGateway, GeminiGatewayTimeout, request_key
+
+# Content-addressed cache for analyses and renders
+from services.analysis_cache import AnalysisCache, bytes_digest, image_digest
+
+# Streaming / resumable upload ingestion
+from services.ingest import (
+    ResumableUploadStore, SpooledUpload, UploadIncomplete, UploadOffsetMismatch,
+    UploadTooLarge, parse_upload_metadata, spool_upload
+)
+
+# Binary WebXR mesh transport (zero-copy decode)
+from services.mesh_codec import MESH_CONTENT_TYPE, DecodedMesh, MeshDecodeError, decode_mesh, mesh_from_lists
+
+# Incremental per-anchor fusion of repeated WebXR uploads
+from services.scene_store import SceneStore
+
+# Process-pool mesh generation
+from services.mesh_engine import MeshEngine, MeshEngineBusy, MeshJob
+
+# Warm headless renderer (multi-view thumbnails for Gemini)
+from services.render_engine import RenderEngine, RenderEngineBusy
+
 # Import Gemini Live services
 try:
     from services.gemini_live import GeminiLiveClient, GeminiWebClient
+    from services.voice_relay import VoiceRelay, metrics_snapshot as voice_metrics_snapshot
     GEMINI_LIVE_AVAILABLE = True
 except ImportError:
     print("[WARNING] Gemini Live services not available")
@@ -55,6 +82,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Location", "Upload-Offset", "Upload-Length", "Tus-Resumable"],
 )
 
 # Directories
@@ -65,10 +93,38 @@ WEBXR_DIR = Path("../webxr-app")
 for dir in [UPLOAD_DIR, STATIC_DIR, MESH_DIR]:
     dir.mkdir(exist_ok=True)
 
+# Upload bodies are spooled here in chunks instead of being held in memory
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "1024")) * 1024 * 1024
+INCOMING_DIR = UPLOAD_DIR / "incoming"
+INCOMING_DIR.mkdir(exist_ok=True)
+resumable_uploads = ResumableUploadStore(
+    UPLOAD_DIR / "partial",
+    max_bytes=MAX_UPLOAD_BYTES,
+    expiry=float(os.getenv("RESUMABLE_UPLOAD_EXPIRY", str(24 * 3600)))
+)
+TUS_VERSION = "1.0.0"
+
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 app.mount("/app", StaticFiles(directory=str(WEBXR_DIR), html=True), name="webxr")
 
-executor = ThreadPoolExecutor(max_workers=3)
+# Poisson meshing runs in worker processes behind a bounded queue
+mesh_engine = MeshEngine(
+    MESH_DIR,
+    max_workers=int(os.getenv("MESH_WORKERS", "0")) or None,
+    max_queue=int(os.getenv("MESH_QUEUE_SIZE", "8"))
+)
+
+# One long-lived offscreen render context instead of a Visualizer window per upload
+render_engine = RenderEngine(
+    UPLOAD_DIR,
+    width=int(os.getenv("RENDER_SIZE", "512")),
+    height=int(os.getenv("RENDER_SIZE", "512")),
+    max_triangles=int(os.getenv("RENDER_MAX_TRIANGLES", "200000")),
+    max_queue=int(os.getenv("RENDER_QUEUE_SIZE", "16")),
+    backend=os.getenv("RENDER_BACKEND", "auto")
+)
+# Bump when the render layout changes so cached renders are not reused
+RENDER_CACHE_VERSION = "multiview/v1"
 
 # Gemini - USING 2.5 FLASH FOR SPEED (3-5s vs 30-45s)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
@@ -80,9 +136,50 @@ else:
     print("[WARNING] GEMINI_API_KEY not set")
     model = None
 
+# Every blocking Gemini SDK call goes through the gateway so a slow request
+# never stalls the event loop (and with it the /ws/voice relay)
+gemini_gateway = GeminiGateway(
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "4")),
+    timeout=float(os.getenv("GEMINI_TIMEOUT", "60")),
+    max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "2"))
+)
+
+# Repeated uploads of identical pixels / mesh bytes skip Gemini and re-rendering.
+# Bump the version whenever the analysis prompt or model changes.
+ANALYSIS_CACHE_VERSION = "gemini-2.5-flash/v2"
+analysis_cache = AnalysisCache(
+    max_entries=int(os.getenv("ANALYSIS_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("ANALYSIS_CACHE_TTL", "3600")),
+    persistent_ttl=float(os.getenv("ANALYSIS_CACHE_DISK_TTL", str(7 * 24 * 3600))),
+    persistent_max_entries=int(os.getenv("ANALYSIS_CACHE_DISK_SIZE", "10000")),
+    load=get_cache_entry_async,
+    store=put_cache_entry_async,
+    prune=prune_cache_async
+)
+
+# Continuous WebXR scanning resends each anchor every few seconds; only
+# geometry that moved past the threshold is rewritten and re-analyzed
+scene_store = SceneStore(
+    voxel_size=float(os.getenv("SCENE_VOXEL_SIZE", "0.01")),
+    change_threshold=float(os.getenv("SCENE_CHANGE_THRESHOLD", "0.05")),
+    load=get_room_anchor_async,
+    store=put_room_anchor_async
+)
+
+_web_client = None
+
+def get_web_client():
+    """Shared GeminiWebClient (configuring the SDK per request is wasted work)"""
+    global _web_client
+    if _web_client is None:
+        _web_client = GeminiWebClient(GEMINI_API_KEY)
+    return _web_client
+
 # Supported 3D formats
 SUPPORTED_3D_FORMATS = {'.glb', '.obj', '.ply', '.stl', '.fbx'}
 SUPPORTED_IMAGE_FORMATS = {'.jpg', '.jpeg', '.png', '.webp'}
+# Formats o3d.io.read_triangle_mesh parses (glTF and FBX through Assimp)
+OPEN3D_MESH_FORMATS = {'.ply', '.obj', '.stl', '.off', '.gltf', '.glb', '.fbx'}
 
 class AnalysisResponse(BaseModel):
     object_name: str
@@ -101,19 +198,32 @@ class ChatRequest(BaseModel):
     question: str
 
 class MeshData(BaseModel):
-    vertices: List[List[float]]  # [[x,y,z], [x,y,z], ...]
+    vertices: Union[List[List[float]], List[float]]  # [[x,y,z], ...] or flat [x,y,z, ...]
     indices: List[int]  # Triangle indices
     semantic_label: Optional[str] = None  # "table", "chair", "global mesh", etc.
+    room_id: Optional[str] = None  # set to fuse repeated uploads per anchor
+    anchor_id: Optional[str] = None  # defaults to semantic_label
 
 @app.on_event("startup")
 async def startup_event():
-    init_db()
-    scans = get_all_scans()
-    print(f"[OK] Database ready - {len(scans)} existing scans")
+    await init_db_async()
+    print(f"[OK] Database ready - {await count_scans_async()} existing scans")
+    pruned = await analysis_cache.prune()
+    if pruned:
+        print(f"[OK] Pruned {pruned} expired analysis cache entries")
+    await mesh_engine.start()
+    render_engine.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await mesh_engine.stop()
+    render_engine.stop()
+    gemini_gateway.shutdown()
+    close_db()
 
 @app.get("/")
 async def root():
-    scans = get_all_scans()
+    total_scans = await count_scans_async()
     return {
         "name": "HoloFabricator API v4",
         "version": "4.0.0",
@@ -127,15 +237,24 @@ async def root():
             "async_processing": True,
             "persistent_storage": True
         },
-        "total_scans": len(scans),
+        "total_scans": total_scans,
+        "mesh_engine": mesh_engine.stats(),
+        "render_engine": render_engine.stats(),
+        "analysis_cache": analysis_cache.stats(),
+        "scene_store": scene_store.stats(),
         "endpoints": {
             "POST /upload": "Upload 2D image OR 3D file",
-            "POST /upload-webxr-mesh": "Upload WebXR detected mesh from Quest",
+            "GET /rooms/{room_id}": "Anchors fused from WebXR uploads sent with ?room_id=",
+            "POST /uploads": "Start a resumable (tus) upload; PATCH /uploads/{id}, then POST /uploads/{id}/complete",
+            "POST /upload-webxr-mesh": "Upload WebXR detected mesh from Quest (JSON or application/vnd.holofabricator.mesh)",
             "GET /analyze/{scan_id}": "Get results + mesh status",
             "POST /chat": "Ask questions about scanned object",
             "POST /search": "Search web with Gemini 2.5 Pro + Google Search",
             "WS /ws/voice": "Real-time voice conversation (Gemini Live API)",
-            "GET /scans": "List all scans"
+            "GET /scans": "List scans, newest first (?limit=&cursor=)",
+            "GET /scans/search": "Full-text search over object names and parts (?q=)",
+            "GET /metrics/gemini": "Gemini latency histograms per endpoint",
+            "GET /metrics/voice": "Voice relay drops/merges and mic-to-first-audio latency"
         },
         "gemini_features": {
             "vision_analysis": "gemini-2.5-flash",
@@ -154,59 +273,166 @@ async def upload_file(file: UploadFile = File(...)):
     if not GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="Gemini API key not configured")
 
+    check_upload_type(file.filename)
     try:
-        # Get file extension
-        file_ext = Path(file.filename).suffix.lower()
-        contents = await file.read()
+        # Spool to disk in chunks (hash + size computed on the way)
+        spooled = await spool_upload(file, INCOMING_DIR, MAX_UPLOAD_BYTES)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
+    return await process_upload(spooled)
+
+def check_upload_type(filename: Optional[str]):
+    """Reject unsupported formats (and images while the mesh queue is full) before reading the body"""
+    file_ext = Path(filename or "").suffix.lower()
+    if file_ext in SUPPORTED_3D_FORMATS:
+        return
+    if file_ext not in SUPPORTED_IMAGE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported format. Use: {SUPPORTED_IMAGE_FORMATS | SUPPORTED_3D_FORMATS}"
+        )
+    if mesh_engine.saturated:
+        raise HTTPException(
+            status_code=503,
+            detail="Mesh generation queue is full, retry shortly",
+            headers={"Retry-After": "5"}
+        )
+
+async def process_upload(spooled: SpooledUpload):
+    """Run analysis (and meshing for images) on an upload already on disk"""
+    try:
         scan_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
 
         # Check if it's a 3D file
-        if file_ext in SUPPORTED_3D_FORMATS:
-            return await handle_3d_upload(scan_id, file_ext, contents, file.filename)
+        if spooled.suffix in SUPPORTED_3D_FORMATS:
+            return await handle_3d_upload(scan_id, spooled)
 
         # Otherwise treat as image
-        elif file_ext in SUPPORTED_IMAGE_FORMATS:
-            return await handle_image_upload(scan_id, contents)
-
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Unsupported format. Use: {SUPPORTED_IMAGE_FORMATS | SUPPORTED_3D_FORMATS}"
-            )
+        return await handle_image_upload(scan_id, spooled)
 
+    except HTTPException:
+        raise
+    except GeminiGatewayTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         print(f"[ERROR] Upload error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # No-op once handle_3d_upload has moved the file into MESH_DIR
+        spooled.discard()
+
+# === RESUMABLE UPLOADS (tus 1.0 core + creation) ===
+
+def tus_headers(**extra) -> dict:
+    return {"Tus-Resumable": TUS_VERSION, "Cache-Control": "no-store", **extra}
+
+def resumable_info(upload_id: str) -> dict:
+    try:
+        return resumable_uploads.info(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found", headers=tus_headers())
+
+@app.post("/uploads", status_code=201)
+async def create_resumable_upload(request: Request):
+    """
+    Start a resumable upload. Send Upload-Length and
+    Upload-Metadata: filename <base64>, then PATCH chunks to the Location
+    """
+    try:
+        length = int(request.headers["Upload-Length"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Upload-Length header required", headers=tus_headers())
+
+    filename = parse_upload_metadata(request.headers.get("Upload-Metadata")).get("filename", "")
+    check_upload_type(filename)
+    try:
+        upload_id = resumable_uploads.create(length, filename)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e), headers=tus_headers())
+
+    return Response(status_code=201, headers=tus_headers(Location=f"/uploads/{upload_id}"))
+
+@app.head("/uploads/{upload_id}")
+async def resumable_upload_offset(upload_id: str):
+    """Where to resume: Upload-Offset out of Upload-Length"""
+    info = resumable_info(upload_id)
+    return Response(status_code=200, headers=tus_headers(**{
+        "Upload-Offset": str(info["offset"]),
+        "Upload-Length": str(info["length"])
+    }))
+
+@app.patch("/uploads/{upload_id}")
+async def append_resumable_upload(upload_id: str, request: Request):
+    """Append the request body (application/offset+octet-stream) at Upload-Offset"""
+    resumable_info(upload_id)
+    if request.headers.get("Content-Type") != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Use Content-Type: application/offset+octet-stream", headers=tus_headers())
+    try:
+        offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Upload-Offset header required", headers=tus_headers())
 
-async def handle_3d_upload(scan_id: str, file_ext: str, contents: bytes, filename: str):
+    try:
+        new_offset = await resumable_uploads.append(upload_id, offset, request.stream())
+    except UploadOffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e), headers=tus_headers())
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e), headers=tus_headers())
+
+    return Response(status_code=204, headers=tus_headers(**{"Upload-Offset": str(new_offset)}))
+
+@app.delete("/uploads/{upload_id}", status_code=204)
+async def cancel_resumable_upload(upload_id: str):
+    resumable_info(upload_id)
+    resumable_uploads.discard(upload_id)
+    return Response(status_code=204, headers=tus_headers())
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_resumable_upload(upload_id: str):
+    """Process a fully received resumable upload exactly like POST /upload"""
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="Gemini API key not configured")
+
+    info = resumable_info(upload_id)
+    check_upload_type(info.get("filename"))
+    try:
+        spooled = await resumable_uploads.finish(upload_id)
+    except UploadIncomplete as e:
+        raise HTTPException(status_code=409, detail=str(e), headers=tus_headers())
+
+    return await process_upload(spooled)
+
+def load_mesh(mesh_path: Path, file_ext: str) -> Optional[o3d.geometry.TriangleMesh]:
+    """Parse a mesh file once; the geometry is shared by stats and rendering"""
+    if file_ext not in OPEN3D_MESH_FORMATS:
+        return None
+    mesh = o3d.io.read_triangle_mesh(str(mesh_path))
+    return mesh if mesh.has_vertices() else None
+
+async def handle_3d_upload(scan_id: str, spooled: SpooledUpload):
     """
     Handle direct 3D file upload (Quest 3 scans, etc.)
     Skip mesh generation - use uploaded file directly!
     """
-    print(f"\n[3D] 3D file upload: {scan_id}")
+    print(f"\n[3D] 3D file upload: {scan_id} ({spooled.size / 1e6:.1f} MB)")
+    file_ext = spooled.suffix
+    filename = spooled.filename
 
-    # Save 3D file
+    # Move the spooled file into place (no copy, no re-read)
     mesh_filename = f"{scan_id}_mesh{file_ext}"
     mesh_path = MESH_DIR / mesh_filename
-
-    with open(mesh_path, 'wb') as f:
-        f.write(contents)
+    await asyncio.to_thread(shutil.move, str(spooled.path), str(mesh_path))
 
     print(f"[OK] 3D file saved: {mesh_filename}")
 
-    # Load mesh to get basic info
+    # Parse once, off the event loop
+    mesh = None
     try:
-        if file_ext == '.ply':
-            mesh = o3d.io.read_triangle_mesh(str(mesh_path))
-        elif file_ext == '.obj':
-            mesh = o3d.io.read_triangle_mesh(str(mesh_path))
-        else:
-            # For .glb, .stl - Open3D might not support, that's ok
-            mesh = None
+        mesh = await asyncio.to_thread(load_mesh, mesh_path, file_ext)
 
         # Get mesh statistics
-        if mesh and mesh.has_vertices():
+        if mesh is not None:
             vertices = np.asarray(mesh.vertices)
             bbox = mesh.get_axis_aligned_bounding_box()
             dimensions = bbox.get_extent()
@@ -226,13 +452,14 @@ async def handle_3d_upload(scan_id: str, file_ext: str, contents: bytes, filenam
         print(f"[WARNING] Could not analyze mesh: {e}")
         mesh_info = {}
 
-    # Try to render mesh to image for Gemini analysis
-    image_path = await render_mesh_to_image(mesh_path, scan_id)
+    # Try to render mesh to image for Gemini analysis (cached by file contents)
+    image_path = await render_mesh_cached(mesh, scan_id, spooled.digest)
 
+    cache_hit = False
     if image_path:
         # Analyze rendered image with Gemini
         image = Image.open(image_path)
-        analysis = await analyze_with_gemini(image, is_3d_scan=True)
+        analysis, cache_hit = await analyze_cached(image, is_3d_scan=True)
     else:
         # Fallback: generic analysis
         analysis = {
@@ -248,7 +475,7 @@ async def handle_3d_upload(scan_id: str, file_ext: str, contents: bytes, filenam
     analysis["upload_type"] = "3d_file"
 
     # Save to database with mesh already ready!
-    save_scan(
+    await save_scan_async(
         scan_id=scan_id,
         timestamp=datetime.now().isoformat(),
         image_path=str(image_path) if image_path else "",
@@ -266,6 +493,7 @@ async def handle_3d_upload(scan_id: str, file_ext: str, contents: bytes, filenam
         "message": "3D file uploaded successfully!",
         "mesh_file": f"/static/meshes/{mesh_filename}",
         "mesh_status": "ready",
+        "cache_hit": cache_hit,
         "analysis": {
             **analysis,
             "mesh_status": "ready",
@@ -273,20 +501,28 @@ async def handle_3d_upload(scan_id: str, file_ext: str, contents: bytes, filenam
         }
     }
 
-async def handle_image_upload(scan_id: str, contents: bytes):
+def decode_image_upload(src: Path, dest: Path) -> Tuple[Image.Image, np.ndarray]:
+    """Decode an uploaded image once, save it as JPEG -> (RGB image, its pixel array)"""
+    with Image.open(src) as image:
+        rgb = image.convert("RGB")
+    rgb.save(dest, "JPEG")
+    return rgb, np.asarray(rgb)
+
+async def handle_image_upload(scan_id: str, spooled: SpooledUpload):
     """Handle 2D image upload (original v3 behavior)"""
-    image = Image.open(io.BytesIO(contents))
     image_path = UPLOAD_DIR / f"{scan_id}.jpg"
-    image.save(image_path, "JPEG")
+    # decode, convert and save in one worker call; the RGB copy feeds the
+    # digest, Gemini and the mesh job
+    image, img_array = await asyncio.to_thread(decode_image_upload, spooled.path, image_path)
 
     print(f"\n[IMAGE] Image upload: {scan_id}")
 
-    # Analyze with Gemini
-    analysis = await analyze_with_gemini(image, is_3d_scan=False)
+    # Analyze with Gemini (or reuse the analysis of identical pixels)
+    analysis, cache_hit = await analyze_cached(image, is_3d_scan=False)
     analysis["upload_type"] = "image"
 
     # Save to DB
-    save_scan(
+    await save_scan_async(
         scan_id=scan_id,
         timestamp=datetime.now().isoformat(),
         image_path=str(image_path),
@@ -294,26 +530,35 @@ async def handle_image_upload(scan_id: str, contents: bytes):
         mesh_status="processing"
     )
 
-    # Start async mesh generation
+    # Queue mesh generation on the process pool
     print(f"[MESH] Generating 3D mesh (async)...")
-    asyncio.create_task(generate_mesh_async(image, scan_id))
+    mesh_status = "processing"
+    message = "Analysis complete. 3D mesh generating..."
+    try:
+        mesh_engine.submit(MeshJob(scan_id, img_array, on_mesh_done))
+    except MeshEngineBusy as e:
+        print(f"[WARNING] {e}")
+        await update_mesh_status_async(scan_id, None, "failed")
+        mesh_status = "failed"
+        message = "Analysis complete. Mesh queue full, 3D mesh skipped."
 
     return {
         "scan_id": scan_id,
         "status": "success",
         "upload_type": "image",
-        "message": "Analysis complete. 3D mesh generating...",
+        "message": message,
+        "cache_hit": cache_hit,
         "analysis": {
             **analysis,
-            "mesh_status": "processing"
+            "mesh_status": mesh_status
         }
     }
 
-async def analyze_with_gemini(image: Image.Image, is_3d_scan: bool = False):
-    """Analyze image with Gemini 2.5 Pro"""
+async def analyze_with_gemini(image: Image.Image, is_3d_scan: bool = False, digest: Optional[str] = None):
+    """Analyze image with Gemini 2.5 Pro; ``digest`` (image_digest) coalesces identical requests"""
     print(f"[AI] Analyzing with Gemini 2.5 Flash...")
 
-    context = "3D scanned model" if is_3d_scan else "photographed object"
+    context = "3D scanned model (front, side and top views, left to right)" if is_3d_scan else "photographed object"
 
     prompt = f"""
     Analyze this {context} as an expert engineer.
@@ -341,7 +586,10 @@ async def analyze_with_gemini(image: Image.Image, is_3d_scan: bool = False):
     }}
     """
 
-    response = model.generate_content([prompt, image])
+    response = await gemini_gateway.call(
+        "analyze", model.generate_content, [prompt, image],
+        key=request_key("analyze", prompt, digest) if digest else None
+    )
     text = response.text.strip()
 
     # Parse JSON
@@ -356,37 +604,53 @@ async def analyze_with_gemini(image: Image.Image, is_3d_scan: bool = False):
     print(f"[OK] Analysis: {analysis['object_name']}")
     return analysis
 
-async def render_mesh_to_image(mesh_path: Path, scan_id: str) -> Optional[Path]:
-    """Render 3D mesh to image for Gemini analysis"""
-    try:
-        mesh = o3d.io.read_triangle_mesh(str(mesh_path))
-        if not mesh.has_vertices():
-            return None
-
-        # Create visualizer (headless)
-        vis = o3d.visualization.Visualizer()
-        vis.create_window(visible=False, width=800, height=600)
-        vis.add_geometry(mesh)
-        vis.update_geometry(mesh)
-        vis.poll_events()
-        vis.update_renderer()
-
-        # Capture image
-        image_path = UPLOAD_DIR / f"{scan_id}_render.jpg"
-        vis.capture_screen_image(str(image_path))
-        vis.destroy_window()
+async def analyze_cached(image: Image.Image, is_3d_scan: bool = False) -> Tuple[dict, bool]:
+    """analyze_with_gemini behind the content-addressed cache -> (analysis, cache_hit)"""
+    digest = await asyncio.to_thread(image_digest, image)
+    version = f"{ANALYSIS_CACHE_VERSION}:{'3d' if is_3d_scan else 'image'}"
+    key = AnalysisCache.key("analysis", digest, version)
+
+    cached = await analysis_cache.get(key)
+    if cached is not None:
+        print(f"[CACHE] Analysis hit: {cached.get('object_name', 'Unknown')}")
+        return cached, True
+
+    analysis = await analyze_with_gemini(image, is_3d_scan=is_3d_scan, digest=digest)
+    await analysis_cache.put(key, analysis)
+    return analysis, False
+
+async def render_mesh_cached(mesh: Optional[o3d.geometry.TriangleMesh], scan_id: str,
+                             mesh_digest: str) -> Optional[Path]:
+    """render_mesh_to_image, reusing an earlier render of identical mesh bytes"""
+    key = AnalysisCache.key("render", mesh_digest, RENDER_CACHE_VERSION)
+    cached = await analysis_cache.get(key)
+    if cached is not None and Path(cached["image_path"]).exists():
+        return Path(cached["image_path"])
+    if mesh is None:
+        return None
 
-        return image_path
+    image_path = await render_mesh_to_image(mesh, scan_id)
+    if image_path:
+        await analysis_cache.put(key, {"image_path": str(image_path)})
+    return image_path
 
-    except Exception as e:
-        print(f"[WARNING] Mesh render failed: {e}")
+async def render_mesh_to_image(mesh: o3d.geometry.TriangleMesh, scan_id: str) -> Optional[Path]:
+    """Render front/side/top views of an already-loaded mesh into one image for Gemini"""
+    try:
+        result = await render_engine.render(mesh, scan_id)
+    except RenderEngineBusy as e:
+        print(f"[WARNING] {e}")
         return None
+    if result is None:
+        return None
+    print(f"[RENDER] {scan_id}: {result.triangles} triangles via {result.backend} {result.timings}")
+    return result.sheet_path
 
 # === V3 ENDPOINTS (unchanged) ===
 
 @app.get("/analyze/{scan_id}")
 async def get_analysis(scan_id: str):
-    scan_data = get_scan(scan_id)
+    scan_data = await get_scan_async(scan_id)
     if not scan_data:
         raise HTTPException(status_code=404, detail="Scan not found")
 
@@ -397,6 +661,9 @@ async def get_analysis(scan_id: str):
         "analysis": scan_data['analysis']
     }
 
+    if scan_data.get('mesh_timings'):
+        result['mesh_timings'] = scan_data['mesh_timings']
+
     if scan_data['mesh_file'] and scan_data['mesh_status'] == 'ready':
         result['mesh_file'] = f"/static/{scan_data['mesh_file']}"
         result['analysis']['mesh_file'] = f"/static/{scan_data['mesh_file']}"
@@ -408,7 +675,7 @@ async def chat_about_object(request: ChatRequest):
     if not GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="Gemini not configured")
 
-    scan_data = get_scan(request.scan_id)
+    scan_data = await get_scan_async(request.scan_id)
     if not scan_data:
         raise HTTPException(status_code=404, detail="Scan not found")
 
@@ -418,7 +685,8 @@ async def chat_about_object(request: ChatRequest):
     if not image_path or not Path(image_path).exists():
         raise HTTPException(status_code=400, detail="No image for chat")
 
-    image = Image.open(image_path)
+    # Opened off the loop and only decoded by the SDK on the gateway thread
+    image = await asyncio.to_thread(Image.open, image_path)
 
     prompt = f"""
     Object: {analysis['object_name']}
@@ -433,7 +701,14 @@ async def chat_about_object(request: ChatRequest):
     }}
     """
 
-    response = model.generate_content([prompt, image])
+    try:
+        response = await gemini_gateway.call(
+            "chat", model.generate_content, [prompt, image],
+            # the stored image never changes for a scan, so its path identifies the pixels
+            key=request_key("chat", prompt, str(image_path))
+        )
+    except GeminiGatewayTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     text = response.text.strip()
 
     if "```json" in text:
@@ -442,38 +717,141 @@ async def chat_about_object(request: ChatRequest):
         json_str = text
 
     chat_response = json.loads(json_str)
-    save_chat(request.scan_id, request.question,
+    await save_chat_async(request.scan_id, request.question,
               chat_response['answer'], chat_response['highlighted_parts'])
 
     return chat_response
 
 @app.get("/scans")
-async def list_scans():
-    scans = get_all_scans()
-    return {"total": len(scans), "scans": scans}
+async def list_scans(limit: int = Query(50, ge=1, le=500), cursor: Optional[str] = None):
+    """Keyset-paginated scan listing; pass back next_cursor to get the following page"""
+    try:
+        page = await list_scans_page_async(limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    total = await count_scans_async()
+    return {"total": total, "scans": page["scans"], "next_cursor": page["next_cursor"]}
+
+@app.get("/scans/search")
+async def search_scans(q: str = Query(..., min_length=1), limit: int = Query(20, ge=1, le=100)):
+    """Full-text search (SQLite FTS5) over object names, categories and parts"""
+    results = await search_scans_async(q, limit)
+    return {"query": q, "total": len(results), "scans": results}
+
+async def read_body_limited(request: Request, max_bytes: int) -> bytearray:
+    """Request body, 413 as soon as it passes ``max_bytes`` (chunked bodies carry no Content-Length)"""
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Mesh exceeds {max_bytes} bytes")
+    return body
 
 @app.post("/upload-webxr-mesh")
-async def upload_webxr_mesh(mesh_data: MeshData):
+async def upload_webxr_mesh(request: Request,
+                            room_id: Optional[str] = Query(None, max_length=128),
+                            anchor_id: Optional[str] = Query(None, max_length=128)):
     """
     Accept WebXR mesh detection data directly from Quest 3
     Converts vertices + indices → PLY mesh → Gemini analysis
+
+    Body is either JSON (MeshData) or, with Content-Type
+    application/vnd.holofabricator.mesh, the binary layout from
+    services/mesh_codec.py (float32 vertices + uint32 indices, no parsing)
+
+    With room_id, uploads of the same anchor (anchor_id, else semantic label)
+    update one scan and are only re-analyzed when the geometry changed
     """
     if not GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="Gemini API key not configured")
 
+    if int(request.headers.get("Content-Length") or 0) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Mesh exceeds {MAX_UPLOAD_BYTES} bytes")
+
+    content_type = request.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    body = await read_body_limited(request, MAX_UPLOAD_BYTES)
     try:
-        print(f"\n[WEBXR] WebXR mesh upload: {len(mesh_data.vertices)} vertices")
-        print(f"   Label: {mesh_data.semantic_label}")
+        if content_type in (MESH_CONTENT_TYPE, "application/octet-stream"):
+            decoded = decode_mesh(body)
+        else:
+            payload = json.loads(body)
+            if not isinstance(payload, dict):
+                raise HTTPException(status_code=400, detail="Mesh JSON body must be an object")
+            mesh_data = MeshData(**payload)
+            room_id = room_id or mesh_data.room_id
+            anchor_id = anchor_id or mesh_data.anchor_id
+            decoded = await asyncio.to_thread(
+                mesh_from_lists, mesh_data.vertices, mesh_data.indices, mesh_data.semantic_label
+            )
+    except MeshDecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError as e:
+        # Malformed JSON or a body that fails MeshData validation
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if room_id:
+        return await fuse_webxr_mesh(decoded, room_id, anchor_id or decoded.semantic_label or "mesh")
+    return await process_webxr_mesh(decoded)
+
+async def fuse_webxr_mesh(decoded: DecodedMesh, room_id: str, anchor_key: str):
+    """Merge an anchor's upload into its room, skipping near-identical resends"""
+    async with scene_store.lock(room_id, anchor_key):
+        update = await scene_store.compare(room_id, anchor_key, decoded.vertices)
+        fusion = {"room_id": room_id, "anchor": anchor_key, "change": round(update.change, 4)}
+
+        if not update.changed:
+            state = update.state
+            scan_data = await get_scan_async(state.scan_id)
+            if scan_data:
+                scene_store.record_skip()
+                mesh_file = f"/static/{scan_data['mesh_file']}"
+                return {
+                    "scan_id": state.scan_id,
+                    "status": "unchanged",
+                    "upload_type": "webxr_mesh",
+                    "message": "Geometry unchanged, reusing previous analysis",
+                    "mesh_file": mesh_file,
+                    "mesh_status": scan_data["mesh_status"],
+                    "cache_hit": True,
+                    "fusion": {**fusion, "revision": state.revision},
+                    "analysis": {**scan_data["analysis"], "mesh_status": scan_data["mesh_status"], "mesh_file": mesh_file}
+                }
 
-        scan_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        scan_id = update.state.scan_id if update.state else None
+        revision = update.state.revision + 1 if update.state else 1
+        result = await process_webxr_mesh(decoded, scan_id=scan_id, revision=revision)
+        state = await scene_store.commit(
+            room_id, anchor_key, result["scan_id"], update,
+            len(decoded.vertices), len(decoded.indices), decoded.semantic_label
+        )
+        result["fusion"] = {**fusion, "revision": state.revision}
+        return result
+
+@app.get("/rooms/{room_id}")
+async def get_room(room_id: str):
+    """Anchors of a fused WebXR room with their current scans and revisions"""
+    anchors = await list_room_anchors_async(room_id)
+    if not anchors:
+        raise HTTPException(status_code=404, detail="Room not found")
+    return {"room_id": room_id, "anchors": anchors}
+
+async def process_webxr_mesh(decoded: DecodedMesh, scan_id: Optional[str] = None, revision: int = 1):
+    """
+    Write, render and analyze a decoded WebXR mesh (shared by JSON and binary uploads)
+    Passing scan_id overwrites that scan in place (fused room anchors)
+    """
+    try:
+        vertices = decoded.vertices
+        indices = decoded.indices
+        print(f"\n[WEBXR] WebXR mesh upload: {len(vertices)} vertices")
+        print(f"   Label: {decoded.semantic_label}")
 
-        # Convert to Open3D mesh
-        vertices = np.array(mesh_data.vertices)
-        indices = np.array(mesh_data.indices).reshape(-1, 3)
+        scan_id = scan_id or datetime.now().strftime("%Y%m%d_%H%M%S_%f")
 
+        # Convert to Open3D mesh (Open3D keeps float64/int32, so this is the one copy)
         mesh = o3d.geometry.TriangleMesh()
-        mesh.vertices = o3d.utility.Vector3dVector(vertices)
-        mesh.triangles = o3d.utility.Vector3iVector(indices)
+        mesh.vertices = o3d.utility.Vector3dVector(vertices.astype(np.float64))
+        mesh.triangles = o3d.utility.Vector3iVector(indices.astype(np.int32))
         mesh.compute_vertex_normals()
 
         # Save as PLY
@@ -483,16 +861,20 @@ async def upload_webxr_mesh(mesh_data: MeshData):
 
         print(f"[OK] WebXR mesh saved: {mesh_filename}")
 
-        # Render to image for Gemini
-        image_path = await render_mesh_to_image(mesh_path, scan_id)
+        # Render to image for Gemini (cached by vertex/index buffers)
+        mesh_digest = await asyncio.to_thread(bytes_digest, vertices, indices)
+        # Revisions get their own render file so cached renders stay valid
+        render_name = scan_id if revision == 1 else f"{scan_id}_r{revision}"
+        image_path = await render_mesh_cached(mesh, render_name, mesh_digest)
 
+        cache_hit = False
         if image_path:
             image = Image.open(image_path)
-            analysis = await analyze_with_gemini(image, is_3d_scan=True)
+            analysis, cache_hit = await analyze_cached(image, is_3d_scan=True)
         else:
             # Fallback
             analysis = {
-                "object_name": mesh_data.semantic_label or "Detected Object",
+                "object_name": decoded.semantic_label or "Detected Object",
                 "category": "Scanned Object",
                 "description": f"WebXR detected mesh with {len(vertices)} vertices",
                 "parts": [],
@@ -501,10 +883,10 @@ async def upload_webxr_mesh(mesh_data: MeshData):
             }
 
         analysis["upload_type"] = "webxr_mesh"
-        analysis["semantic_label"] = mesh_data.semantic_label
+        analysis["semantic_label"] = decoded.semantic_label
 
         # Save to database
-        save_scan(
+        await save_scan_async(
             scan_id=scan_id,
             timestamp=datetime.now().isoformat(),
             image_path=str(image_path) if image_path else "",
@@ -522,6 +904,7 @@ async def upload_webxr_mesh(mesh_data: MeshData):
             "message": "WebXR mesh uploaded successfully!",
             "mesh_file": f"/static/meshes/{mesh_filename}",
             "mesh_status": "ready",
+            "cache_hit": cache_hit,
             "analysis": {
                 **analysis,
                 "mesh_status": "ready",
@@ -533,59 +916,15 @@ async def upload_webxr_mesh(mesh_data: MeshData):
         print(f"[ERROR] WebXR mesh error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# === MESH GENERATION (v3 code) ===
+# === MESH GENERATION ===
 
-async def generate_mesh_async(image: Image.Image, scan_id: str):
-    loop = asyncio.get_event_loop()
-    try:
-        mesh_file = await loop.run_in_executor(executor, generate_3d_mesh, image, scan_id)
-        if mesh_file:
-            update_mesh_status(scan_id, f"meshes/{mesh_file}", "ready")
-            print(f"[OK] Mesh ready: {scan_id}")
-        else:
-            update_mesh_status(scan_id, None, "failed")
-    except Exception as e:
-        print(f"[ERROR] Mesh error: {e}")
-        update_mesh_status(scan_id, None, "failed")
-
-def generate_3d_mesh(image: Image.Image, scan_id: str) -> Optional[str]:
-    """Generate mesh from 2D image (basic depth estimation)"""
-    try:
-        img_array = np.array(image)
-        height, width = img_array.shape[:2]
-
-        # Simple depth from brightness
-        gray = np.mean(img_array, axis=2) / 255.0
-        depth = 0.1 * (1 - gray)
-
-        points = []
-        colors = []
-        scale = 0.01
-
-        for y in range(0, height, 4):
-            for x in range(0, width, 4):
-                z = depth[y, x]
-                points.append([x * scale, -y * scale, z])
-                colors.append(img_array[y, x] / 255.0)
-
-        pcd = o3d.geometry.PointCloud()
-        pcd.points = o3d.utility.Vector3dVector(np.array(points))
-        pcd.colors = o3d.utility.Vector3dVector(np.array(colors))
-        pcd.estimate_normals()
-
-        mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(pcd, depth=8)
-        vertices_to_remove = densities < np.quantile(densities, 0.1)
-        mesh.remove_vertices_by_mask(vertices_to_remove)
-
-        mesh_file = f"{scan_id}_mesh.ply"
-        mesh_path = MESH_DIR / mesh_file
-        o3d.io.write_triangle_mesh(str(mesh_path), mesh)
-
-        return mesh_file
-
-    except Exception as e:
-        print(f"[WARNING] Mesh gen error: {e}")
-        return None
+async def on_mesh_done(scan_id: str, mesh_file: Optional[str], timings: dict):
+    """Persist the result (and stage timings) of a process-pool mesh job"""
+    if mesh_file:
+        await update_mesh_status_async(scan_id, f"meshes/{mesh_file}", "ready", timings)
+        print(f"[OK] Mesh ready: {scan_id} ({timings.get('total', 0):.0f} ms)")
+    else:
+        await update_mesh_status_async(scan_id, None, "failed", timings)
 
 # === GEMINI 2.5 ENHANCED FEATURES ===
 
@@ -613,17 +952,20 @@ async def web_search(request: WebSearchRequest):
         raise HTTPException(status_code=503, detail="Gemini Web client not available")
 
     try:
-        web_client = GeminiWebClient(GEMINI_API_KEY)
+        web_client = get_web_client()
 
         # If scan_id provided, add object context
         context = request.context
         if request.scan_id:
-            scan_data = get_scan(request.scan_id)
+            scan_data = await get_scan_async(request.scan_id)
             if scan_data:
                 analysis = scan_data['analysis']
                 context = f"Object: {analysis.get('object_name', 'Unknown')}\n{analysis.get('description', '')}"
 
-        result = web_client.search_and_answer(request.question, context)
+        result = await gemini_gateway.call(
+            "search", web_client.search_and_answer, request.question, context,
+            key=request_key("search", request.question, context)
+        )
 
         return {
             "question": request.question,
@@ -631,6 +973,8 @@ async def web_search(request: WebSearchRequest):
             "model": result["model"]
         }
 
+    except GeminiGatewayTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         print(f"[ERROR] Search error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -648,17 +992,20 @@ async def web_fetch(request: WebFetchRequest):
         raise HTTPException(status_code=503, detail="Gemini Web client not available")
 
     try:
-        web_client = GeminiWebClient(GEMINI_API_KEY)
+        web_client = get_web_client()
 
         # If scan_id provided, add object context
         context = request.context
         if request.scan_id:
-            scan_data = get_scan(request.scan_id)
+            scan_data = await get_scan_async(request.scan_id)
             if scan_data:
                 analysis = scan_data['analysis']
                 context = f"Object: {analysis.get('object_name', 'Unknown')}\n{analysis.get('description', '')}"
 
-        result = web_client.fetch_and_analyze(request.url, request.question, context)
+        result = await gemini_gateway.call(
+            "web_fetch", web_client.fetch_and_analyze, request.url, request.question, context,
+            key=request_key("web_fetch", request.url, request.question, context)
+        )
 
         return {
             "url": result["url"],
@@ -669,11 +1016,19 @@ async def web_fetch(request: WebFetchRequest):
             "model": result["model"]
         }
 
+    except GeminiGatewayTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         print(f"[ERROR] Web fetch error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/metrics/gemini")
+async def gemini_metrics():
+    """Per-endpoint Gemini latency histograms, retries, timeouts and coalesced calls"""
+    return gemini_gateway.stats()
+
+
 @app.websocket("/ws/voice")
 async def voice_conversation(websocket: WebSocket):
     """
@@ -713,47 +1068,34 @@ async def voice_conversation(websocket: WebSocket):
             await websocket.send_json({"error": "Failed to connect to Gemini Live"})
             return
 
-        # Define callbacks for Gemini responses
-        async def on_audio(audio_bytes: bytes):
-            """Send audio response back to client"""
-            await websocket.send_bytes(audio_bytes)
-
-        async def on_text(text: str):
-            """Send text response back to client"""
-            await websocket.send_json({"type": "text", "content": text})
-
-        # Start receiving from Gemini in background
-        receive_task = asyncio.create_task(
-            live_client.receive_stream(on_audio=on_audio, on_text=on_text)
+        # Bounded queues + a task per direction; mic audio re-cut into 40 ms packets
+        relay = VoiceRelay(
+            websocket, live_client,
+            packet_ms=int(os.getenv("VOICE_PACKET_MS", "40")),
+            uplink_queue=int(os.getenv("VOICE_UPLINK_QUEUE", "25")),
+            downlink_queue=int(os.getenv("VOICE_DOWNLINK_QUEUE", "64"))
         )
-
-        # Handle client messages
-        while True:
-            message = await websocket.receive()
-
-            if "bytes" in message:
-                # Client sent audio
-                audio_data = message["bytes"]
-                await live_client.send_audio(audio_data)
-
-            elif "text" in message:
-                # Client sent text
-                data = json.loads(message["text"])
-
-                if data.get("type") == "text":
-                    await live_client.send_text(data["content"])
-
-                elif data.get("type") == "end":
-                    break
+        stats = await relay.run()
+        print(f"[VOICE] Session ended: {stats}")
 
     except WebSocketDisconnect:
         print("[VOICE] Client disconnected")
     except Exception as e:
         print(f"[VOICE] Error: {e}")
-        await websocket.send_json({"error": str(e)})
+        try:
+            await websocket.send_json({"error": str(e)})
+        except Exception:
+            pass
     finally:
         await live_client.close()
-        receive_task.cancel()
+
+
+@app.get("/metrics/voice")
+async def voice_metrics():
+    """Voice relay totals and mic-to-first-audio latency histogram"""
+    if not GEMINI_LIVE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Gemini Live not available")
+    return voice_metrics_snapshot()
 
 
 if __name__ == "__main__":
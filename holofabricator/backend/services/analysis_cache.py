@@ -0,0 +1,160 @@
+"""
+Content-addressed cache for Gemini analyses and mesh renders
+Keyed by a hash of the decoded pixels / mesh bytes, so a client retrying the
+same upload gets the earlier result back without another Gemini call
+"""
+
+import copy
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("holofabricator.analysis_cache")
+
+try:
+    import blake3
+    BLAKE3_AVAILABLE = True
+except ImportError:
+    BLAKE3_AVAILABLE = False
+
+HASH_NAME = "blake3" if BLAKE3_AVAILABLE else "sha256"
+
+# Persistent tier hooks: load(key) -> (payload, stored_at) | None, store(key, kind, payload),
+# prune(max_age, max_rows) -> rows deleted
+LoadFn = Callable[[str], Awaitable[Optional[Tuple[Any, float]]]]
+StoreFn = Callable[[str, str, Any], Awaitable[None]]
+PruneFn = Callable[[float, int], Awaitable[int]]
+
+
+def new_hasher():
+    """Incremental hasher matching the digests produced by this module"""
+    return blake3.blake3() if BLAKE3_AVAILABLE else hashlib.sha256()
+
+
+def bytes_digest(*chunks: bytes) -> str:
+    """Hash raw buffers (file contents, vertex/index arrays)"""
+    h = new_hasher()
+    for chunk in chunks:
+        h.update(memoryview(chunk).cast("B"))
+    return f"{HASH_NAME}:{h.hexdigest()}"
+
+
+def image_digest(image) -> str:
+    """
+    Hash the decoded pixels of a PIL image, so the same photo re-encoded or
+    re-sent with different metadata still maps to the same key
+    """
+    h = new_hasher()
+    h.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode())
+    h.update(image.tobytes())
+    return f"{HASH_NAME}:{h.hexdigest()}"
+
+
+class AnalysisCache:
+    """
+    Two-tier cache: an in-memory LRU with TTL in front of an optional
+    persistent store (the scans database). Values are deep-copied on the way
+    in and out so callers can freely mutate what they get back.
+
+    The persistent tier is pruned every ``prune_every`` puts (and whenever
+    ``prune`` is awaited, e.g. at startup): rows past ``persistent_ttl`` are
+    deleted and the rest trimmed to the newest ``persistent_max_entries``.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 3600.0,
+                 persistent_ttl: float = 7 * 24 * 3600.0, persistent_max_entries: int = 10000,
+                 prune_every: int = 256, load: Optional[LoadFn] = None,
+                 store: Optional[StoreFn] = None, prune: Optional[PruneFn] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent_ttl = persistent_ttl
+        self.persistent_max_entries = persistent_max_entries
+        self.prune_every = prune_every
+        self._load = load
+        self._store = store
+        self._prune = prune
+        self._puts_since_prune = 0
+        self.disk_pruned = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(kind: str, digest: str, version: str = "") -> str:
+        return f"{kind}:{version}:{digest}"
+
+    def _remember(self, key: str, value: Any, stored_at: float) -> None:
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            if now - stored_at <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(value)
+            del self._entries[key]
+
+        if self._load is not None:
+            try:
+                loaded = await self._load(key)
+            except Exception as e:
+                logger.warning(f"[CACHE] Persistent lookup failed: {e}")
+                loaded = None
+            if loaded is not None:
+                value, stored_at = loaded
+                if now - stored_at <= self.persistent_ttl:
+                    self._remember(key, value, now)
+                    self.disk_hits += 1
+                    return copy.deepcopy(value)
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, value: Any) -> None:
+        self._remember(key, copy.deepcopy(value), time.time())
+        if self._store is not None:
+            try:
+                await self._store(key, key.split(":", 1)[0], value)
+            except Exception as e:
+                logger.warning(f"[CACHE] Persistent store failed: {e}")
+        self._puts_since_prune += 1
+        if self._puts_since_prune >= self.prune_every:
+            await self.prune()
+
+    async def prune(self) -> int:
+        """Expire and trim the persistent tier -> rows deleted"""
+        self._puts_since_prune = 0
+        if self._prune is None:
+            return 0
+        try:
+            deleted = await self._prune(self.persistent_ttl, self.persistent_max_entries)
+        except Exception as e:
+            logger.warning(f"[CACHE] Persistent prune failed: {e}")
+            return 0
+        self.disk_pruned += deleted
+        return deleted
+
+    def invalidate(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hash": HASH_NAME,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "disk_pruned": self.disk_pruned,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+        }
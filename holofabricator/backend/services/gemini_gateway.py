@@ -0,0 +1,210 @@
+"""
+Gemini gateway
+Runs blocking Gemini SDK calls off the event loop with bounded concurrency,
+timeouts, jittered retries and in-flight de-duplication of identical requests
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger("holofabricator.gemini_gateway")
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class GeminiGatewayTimeout(TimeoutError):
+    """Raised when a Gemini call (including retries) exceeds its deadline."""
+
+
+# HTTP statuses worth another attempt: rate limits and server-side failures.
+# google.api_core exceptions carry theirs as ``code``.
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether a failed Gemini call may succeed if repeated (bad requests, safety blocks and local bugs never do)"""
+    if isinstance(error, ConnectionError):
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and code in TRANSIENT_STATUS_CODES
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram for one endpoint."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.errors = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.coalesced = 0
+
+    def observe(self, latency_ms: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, latency_ms)] += 1
+        self.total += 1
+        self.sum_ms += latency_ms
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Bucket upper bound containing the q-quantile (None when empty)"""
+        if self.total == 0:
+            return None
+        target = q * self.total
+        running = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            running += count
+            if running >= target:
+                return bound
+        return float("inf")
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"le_{b}" for b in self.buckets] + ["le_inf"]
+        return {
+            "count": self.total,
+            "mean_ms": round(self.sum_ms / self.total, 1) if self.total else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+            "coalesced": self.coalesced,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+def request_key(endpoint: str, *parts: Any) -> str:
+    """
+    Stable hash of a request's inputs, used to coalesce identical calls.
+    Strings/bytes are hashed directly; PIL images by mode, size and pixels.
+    """
+    digest = hashlib.sha256(endpoint.encode())
+    for part in parts:
+        digest.update(b"\x00")
+        if part is None:
+            continue
+        if isinstance(part, bytes):
+            digest.update(part)
+        elif hasattr(part, "tobytes") and hasattr(part, "mode"):
+            digest.update(f"{part.mode}:{part.size}".encode())
+            digest.update(part.tobytes())
+        else:
+            digest.update(str(part).encode())
+    return digest.hexdigest()
+
+
+class GeminiGateway:
+    """
+    Async front door for synchronous Gemini calls.
+
+    At most ``max_concurrency`` calls run at once on a private thread pool.
+    Transient failures (``is_transient``) are retried up to ``max_retries``
+    times with full-jitter exponential backoff; ``timeout`` seconds is one
+    deadline for the call, waiting, attempts and backoff included. Calls
+    sharing a ``key`` while one is still in flight await the same result
+    instead of hitting the API.
+    """
+
+    def __init__(self, max_concurrency: int = 4, timeout: float = 60.0,
+                 max_retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 8.0):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Threads of timed-out calls keep running until the SDK returns, so
+        # leave headroom beyond the semaphore for them.
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="gemini")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._histograms: Dict[str, LatencyHistogram] = {}
+
+    def _histogram(self, endpoint: str) -> LatencyHistogram:
+        if endpoint not in self._histograms:
+            self._histograms[endpoint] = LatencyHistogram()
+        return self._histograms[endpoint]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": len(self._inflight),
+            "endpoints": {name: h.snapshot() for name, h in self._histograms.items()},
+        }
+
+    async def call(self, endpoint: str, fn: Callable, *args, key: Optional[str] = None, **kwargs) -> Any:
+        """Run ``fn(*args, **kwargs)`` in the gateway, coalescing on ``key``"""
+        if key is None:
+            return await self._call_with_retries(endpoint, fn, args, kwargs)
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self._histogram(endpoint).coalesced += 1
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._call_with_retries(endpoint, fn, args, kwargs)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _call_with_retries(self, endpoint: str, fn: Callable, args: tuple, kwargs: dict) -> Any:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        histogram = self._histogram(endpoint)
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        deadline = loop.time() + self.timeout
+
+        async def attempt_call():
+            async with self._semaphore:
+                return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+        attempt = 0
+        while True:
+            try:
+                result = await asyncio.wait_for(attempt_call(), timeout=max(0.0, deadline - loop.time()))
+                histogram.observe((time.perf_counter() - start) * 1000.0)
+                return result
+            except asyncio.TimeoutError as e:
+                histogram.timeouts += 1
+                histogram.errors += 1
+                error = GeminiGatewayTimeout(f"{endpoint} timed out after {self.timeout:.0f}s ({attempt + 1} attempts)")
+                logger.error(f"[GATEWAY] {error}")
+                raise error from e
+            except Exception as e:
+                error = e
+
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt + 1)))
+            if not is_transient(error) or attempt >= self.max_retries or loop.time() + delay >= deadline:
+                histogram.errors += 1
+                logger.error(f"[GATEWAY] {endpoint} failed after {attempt + 1} attempts: {error}")
+                raise error
+
+            attempt += 1
+            histogram.retries += 1
+            logger.warning(f"[GATEWAY] {endpoint} attempt {attempt} failed ({error}); retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
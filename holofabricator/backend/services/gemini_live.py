@@ -5,14 +5,31 @@ Uses gemini-live-2.5-flash-preview for audio I/O
 """
 
 import asyncio
+import inspect
 import json
 import base64
-from typing import Optional, Callable
+from typing import Any, Awaitable, Optional, Callable, Union
 import websockets
 import logging
 
 logger = logging.getLogger("holofabricator.gemini_live")
 
+# realtime_input frame split around the base64 payload, so each audio chunk
+# costs one b64encode and a concatenation instead of building and dumping a dict
+_AUDIO_FRAME_HEAD = '{"realtime_input":{"media_chunks":[{"mime_type":"audio/pcm","data":"'
+_AUDIO_FRAME_TAIL = '"}]}}'
+
+Callback = Callable[..., Union[None, Awaitable[None]]]
+
+
+async def _invoke(callback: Optional[Callback], *args: Any) -> None:
+    """Call a sync or async callback, awaiting it in the async case"""
+    if callback is None:
+        return
+    result = callback(*args)
+    if inspect.isawaitable(result):
+        await result
+
 class GeminiLiveClient:
     """
     WebSocket client for Gemini Live API
@@ -64,7 +81,7 @@ class GeminiLiveClient:
             logger.error(f"[LIVE] Connection failed: {e}")
             return False
 
-    async def send_audio(self, audio_data: bytes):
+    async def send_audio(self, audio_data: Union[bytes, bytearray, memoryview]):
         """
         Send audio to Gemini
         Audio must be: 16-bit PCM, 16kHz, mono
@@ -72,21 +89,9 @@ class GeminiLiveClient:
         if not self.ws:
             raise RuntimeError("Not connected to Live API")
 
-        # Encode audio as base64
-        audio_b64 = base64.b64encode(audio_data).decode('utf-8')
-
-        message = {
-            "realtime_input": {
-                "media_chunks": [
-                    {
-                        "mime_type": "audio/pcm",
-                        "data": audio_b64
-                    }
-                ]
-            }
-        }
-
-        await self.ws.send(json.dumps(message))
+        # The Live API only takes base64 inside JSON; encode straight into the frame
+        audio_b64 = base64.b64encode(audio_data).decode('ascii')
+        await self.ws.send(_AUDIO_FRAME_HEAD + audio_b64 + _AUDIO_FRAME_TAIL)
         logger.debug("[LIVE] Sent audio chunk")
 
     async def send_text(self, text: str):
@@ -110,11 +115,13 @@ class GeminiLiveClient:
         logger.info(f"[LIVE] Sent text: {text}")
 
     async def receive_stream(self,
-                           on_audio: Optional[Callable[[bytes], None]] = None,
-                           on_text: Optional[Callable[[str], None]] = None):
+                           on_audio: Optional[Callback] = None,
+                           on_text: Optional[Callback] = None,
+                           on_turn_complete: Optional[Callback] = None):
         """
         Receive streaming responses from Gemini
-        Callbacks for audio and text chunks
+        Callbacks (sync or async, async ones are awaited) for audio and text
+        chunks and for the end of each model turn
         """
         if not self.ws:
             raise RuntimeError("Not connected to Live API")
@@ -131,12 +138,12 @@ class GeminiLiveClient:
                     if "modelTurn" in content:
                         for part in content["modelTurn"].get("parts", []):
                             # Audio response
-                            if "inlineData" in part and part["inlineData"].get("mimeType") == "audio/pcm":
+                            # mimeType carries the rate, e.g. "audio/pcm;rate=24000"
+                            if "inlineData" in part and part["inlineData"].get("mimeType", "").startswith("audio/pcm"):
                                 audio_b64 = part["inlineData"]["data"]
                                 audio_bytes = base64.b64decode(audio_b64)
 
-                                if on_audio:
-                                    on_audio(audio_bytes)
+                                await _invoke(on_audio, audio_bytes)
 
                                 logger.debug(f"[LIVE] Received audio chunk: {len(audio_bytes)} bytes")
 
@@ -144,11 +151,13 @@ class GeminiLiveClient:
                             if "text" in part:
                                 text = part["text"]
 
-                                if on_text:
-                                    on_text(text)
+                                await _invoke(on_text, text)
 
                                 logger.info(f"[LIVE] Received text: {text}")
 
+                    if content.get("turnComplete"):
+                        await _invoke(on_turn_complete)
+
                 # Handle tool calls (for search grounding)
                 if "toolCall" in data:
                     logger.info(f"[LIVE] Tool call: {data['toolCall']}")
@@ -0,0 +1,241 @@
+"""
+Streaming upload ingestion
+Spools request bodies to disk in fixed-size chunks, hashing and sizing them on
+the way, so memory per upload stays flat no matter how big the scan is. Also
+backs the tus-style resumable upload endpoints used by headset clients.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional
+
+from .analysis_cache import HASH_NAME, new_hasher
+
+logger = logging.getLogger("holofabricator.ingest")
+
+CHUNK_SIZE = 1 << 20  # 1 MiB
+
+
+class UploadTooLarge(ValueError):
+    """Raised when a body exceeds the configured or declared size."""
+
+
+class UploadOffsetMismatch(ValueError):
+    """Raised when a resumable chunk does not start at the stored offset."""
+
+
+class UploadIncomplete(ValueError):
+    """Raised when completing a resumable upload that is still missing bytes."""
+
+
+@dataclass
+class SpooledUpload:
+    """An upload body that has been written to disk."""
+
+    path: Path
+    size: int
+    digest: str
+    filename: str
+
+    @property
+    def suffix(self) -> str:
+        return Path(self.filename).suffix.lower()
+
+    def discard(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+def _write_chunk(fh, hasher, chunk: bytes) -> None:
+    fh.write(chunk)
+    hasher.update(chunk)
+
+
+async def spool_upload(upload, dest_dir: Path, max_bytes: int, chunk_size: int = CHUNK_SIZE) -> SpooledUpload:
+    """
+    Copy a FastAPI ``UploadFile`` to ``dest_dir`` chunk by chunk.
+    Raises ``UploadTooLarge`` (and removes the partial file) past ``max_bytes``.
+    """
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    path = dest_dir / f"{uuid.uuid4().hex}{Path(upload.filename or '').suffix.lower()}"
+    hasher = new_hasher()
+    size = 0
+    try:
+        with open(path, "wb") as fh:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                await asyncio.to_thread(_write_chunk, fh, hasher, chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+
+    return SpooledUpload(path, size, f"{HASH_NAME}:{hasher.hexdigest()}", upload.filename or path.name)
+
+
+def _hash_file(path: Path, chunk_size: int = CHUNK_SIZE):
+    hasher = new_hasher()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+class ResumableUploadStore:
+    """
+    Server side of a minimal tus 1.0 upload (creation, HEAD, PATCH).
+
+    Each upload is a ``{id}.part`` file plus a ``{id}.json`` sidecar holding
+    the declared length, current offset and filename. The running hash lives
+    in memory; after a restart it is rebuilt from the part file on the next
+    append, so clients can resume across server restarts too.
+    """
+
+    def __init__(self, root: Path, max_bytes: int, expiry: float = 24 * 3600.0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.expiry = expiry
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._hashers: Dict[str, Any] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _part(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.part"
+
+    def _meta(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.json"
+
+    def _write_meta(self, upload_id: str, meta: Dict[str, Any]) -> None:
+        tmp = self._meta(upload_id).with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self._meta(upload_id))
+
+    def info(self, upload_id: str) -> Dict[str, Any]:
+        """Stored metadata for an upload; ``KeyError`` if unknown or expired"""
+        if not upload_id.isalnum():
+            raise KeyError(upload_id)
+        try:
+            return json.loads(self._meta(upload_id).read_text())
+        except FileNotFoundError:
+            raise KeyError(upload_id) from None
+
+    def create(self, length: int, filename: str) -> str:
+        if length > self.max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+        self.purge_expired()
+        upload_id = uuid.uuid4().hex
+        self._part(upload_id).touch()
+        self._write_meta(upload_id, {
+            "length": length,
+            "offset": 0,
+            "filename": filename,
+            "created_at": time.time(),
+        })
+        self._hashers[upload_id] = new_hasher()
+        return upload_id
+
+    async def append(self, upload_id: str, offset: int, stream: AsyncIterator[bytes]) -> int:
+        """Write a chunk stream starting at ``offset``; returns the new offset"""
+        lock = self._locks.setdefault(upload_id, asyncio.Lock())
+        async with lock:
+            meta = self.info(upload_id)
+            if offset != meta["offset"]:
+                raise UploadOffsetMismatch(f"Expected offset {meta['offset']}, got {offset}")
+
+            part = self._part(upload_id)
+            hasher = self._hashers.get(upload_id)
+            if hasher is None:
+                # Lost on restart; the part file on disk is the source of truth
+                os.truncate(part, meta["offset"])
+                hasher = await asyncio.to_thread(_hash_file, part)
+                self._hashers[upload_id] = hasher
+
+            written = meta["offset"]
+            try:
+                with open(part, "ab") as fh:
+                    async for chunk in stream:
+                        if not chunk:
+                            continue
+                        if written + len(chunk) > meta["length"]:
+                            raise UploadTooLarge("Chunk runs past the declared Upload-Length")
+                        await asyncio.to_thread(_write_chunk, fh, hasher, chunk)
+                        written += len(chunk)
+            except BaseException:
+                # A dropped connection keeps whatever was flushed, but the
+                # in-memory hash may be ahead of the sidecar; rebuild next time
+                self._hashers.pop(upload_id, None)
+                raise
+            finally:
+                meta["offset"] = written
+                self._write_meta(upload_id, meta)
+            return written
+
+    async def finish(self, upload_id: str) -> SpooledUpload:
+        """Hand a fully received upload over as a ``SpooledUpload``"""
+        lock = self._locks.setdefault(upload_id, asyncio.Lock())
+        async with lock:
+            meta = self.info(upload_id)
+            if meta["offset"] != meta["length"]:
+                raise UploadIncomplete(f"Received {meta['offset']} of {meta['length']} bytes")
+
+            part = self._part(upload_id)
+            hasher = self._hashers.pop(upload_id, None)
+            if hasher is None:
+                hasher = await asyncio.to_thread(_hash_file, part)
+
+            filename = meta.get("filename") or upload_id
+            final = part.with_name(f"{upload_id}{Path(filename).suffix.lower()}")
+            os.replace(part, final)
+            self._meta(upload_id).unlink(missing_ok=True)
+            self._locks.pop(upload_id, None)
+            return SpooledUpload(final, meta["length"], f"{HASH_NAME}:{hasher.hexdigest()}", filename)
+
+    def discard(self, upload_id: str) -> None:
+        self.info(upload_id)
+        self._part(upload_id).unlink(missing_ok=True)
+        self._meta(upload_id).unlink(missing_ok=True)
+        self._hashers.pop(upload_id, None)
+        self._locks.pop(upload_id, None)
+
+    def purge_expired(self) -> int:
+        """Drop uploads idle for longer than ``expiry`` seconds"""
+        cutoff = time.time() - self.expiry
+        purged = 0
+        for meta_path in self.root.glob("*.json"):
+            try:
+                if meta_path.stat().st_mtime < cutoff:
+                    self.discard(meta_path.stem)
+                    purged += 1
+            except (OSError, KeyError):
+                continue
+        if purged:
+            logger.info(f"[INGEST] Purged {purged} expired resumable uploads")
+        return purged
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": len(list(self.root.glob("*.json"))), "max_bytes": self.max_bytes}
+
+
+def parse_upload_metadata(header: Optional[str]) -> Dict[str, str]:
+    """Decode a tus ``Upload-Metadata`` header ("key b64value,key b64value")"""
+    metadata: Dict[str, str] = {}
+    for pair in (header or "").split(","):
+        pair = pair.strip()
+        if not pair:
+            continue
+        key, _, value = pair.partition(" ")
+        try:
+            metadata[key] = base64.b64decode(value).decode("utf-8") if value else ""
+        except (ValueError, UnicodeDecodeError):
+            continue
+    return metadata
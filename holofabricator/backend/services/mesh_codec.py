@@ -0,0 +1,109 @@
+"""
+Binary WebXR mesh transport
+A 20-byte little-endian header, the UTF-8 semantic label, then raw float32
+vertex and uint32 index buffers. Decoding is a pair of ``np.frombuffer`` views
+over the request body, so no per-float Python objects are ever created.
+
+    offset  size  field
+    0       4     magic b"HFM1"
+    4       2     version (1)
+    6       2     flags (reserved, 0)
+    8       4     vertex count (xyz triples)
+    12      4     index count (multiple of 3)
+    16      2     label length in bytes
+    18      2     reserved
+    20      n     label, zero-padded to a 4-byte boundary
+    ...     12*V  vertices, float32
+    ...     4*I   indices, uint32
+"""
+
+import struct
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+MESH_CONTENT_TYPE = "application/vnd.holofabricator.mesh"
+MAGIC = b"HFM1"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIHH")
+
+
+class MeshDecodeError(ValueError):
+    """Raised for truncated, oversized or inconsistent binary meshes."""
+
+
+@dataclass
+class DecodedMesh:
+    """Vertices (V, 3) float32 and triangle indices (T, 3) uint32."""
+
+    vertices: np.ndarray
+    indices: np.ndarray
+    semantic_label: Optional[str] = None
+
+
+def _pad4(n: int) -> int:
+    return (n + 3) & ~3
+
+
+def encode_mesh(vertices: np.ndarray, indices: np.ndarray, semantic_label: Optional[str] = None) -> bytes:
+    """Pack a mesh in the binary transport format (what headset clients send)"""
+    vertices = np.ascontiguousarray(vertices, dtype="<f4").reshape(-1)
+    indices = np.ascontiguousarray(indices, dtype="<u4").reshape(-1)
+    label = (semantic_label or "").encode("utf-8")
+    header = HEADER.pack(MAGIC, VERSION, 0, len(vertices) // 3, len(indices), len(label), 0)
+    return b"".join([
+        header, label, b"\x00" * (_pad4(len(label)) - len(label)),
+        vertices.tobytes(), indices.tobytes(),
+    ])
+
+
+def decode_mesh(buf, max_vertices: int = 10_000_000) -> DecodedMesh:
+    """Zero-copy decode; the returned arrays are read-only views over ``buf``"""
+    if len(buf) < HEADER.size:
+        raise MeshDecodeError("Body shorter than mesh header")
+    magic, version, _flags, n_vertices, n_indices, label_len, _ = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise MeshDecodeError("Bad magic, expected HFM1")
+    if version != VERSION:
+        raise MeshDecodeError(f"Unsupported mesh version {version}")
+    if n_indices % 3:
+        raise MeshDecodeError("Index count is not a multiple of 3")
+    if n_vertices > max_vertices:
+        raise MeshDecodeError(f"Mesh has {n_vertices} vertices (limit {max_vertices})")
+
+    offset = HEADER.size
+    label = bytes(buf[offset:offset + label_len]).decode("utf-8", errors="replace") or None
+    offset += _pad4(label_len)
+    expected = offset + 12 * n_vertices + 4 * n_indices
+    if len(buf) != expected:
+        raise MeshDecodeError(f"Body is {len(buf)} bytes, header implies {expected}")
+
+    vertices = np.frombuffer(buf, dtype="<f4", count=3 * n_vertices, offset=offset).reshape(-1, 3)
+    offset += 12 * n_vertices
+    indices = np.frombuffer(buf, dtype="<u4", count=n_indices, offset=offset).reshape(-1, 3)
+    _check_indices(indices, n_vertices)
+    return DecodedMesh(vertices, indices, label)
+
+
+def mesh_from_lists(vertices: Sequence, indices: Sequence, semantic_label: Optional[str] = None) -> DecodedMesh:
+    """Normalise the JSON body (nested [[x, y, z]] or flat [x, y, z, ...]) to the binary layout"""
+    vertex_array = np.asarray(vertices, dtype=np.float32)
+    index_array = np.asarray(indices, dtype=np.int64)
+    # nested input must already be triples; regrouping e.g. [[x, y], ...] would scramble the mesh
+    for name, array in (("Vertices", vertex_array), ("Indices", index_array)):
+        if array.ndim > 2 or (array.ndim == 2 and array.shape[1] != 3):
+            raise MeshDecodeError(f"{name} must be flat or nested as [[a, b, c], ...]")
+    index_array = index_array.reshape(-1)
+    if vertex_array.size % 3 or index_array.size % 3:
+        raise MeshDecodeError("Vertices and indices must come in triples")
+    if index_array.size and index_array.min() < 0:
+        raise MeshDecodeError("Negative triangle index")
+    vertex_array = vertex_array.reshape(-1, 3)
+    _check_indices(index_array, len(vertex_array))
+    return DecodedMesh(vertex_array, index_array.astype(np.uint32).reshape(-1, 3), semantic_label)
+
+
+def _check_indices(indices: np.ndarray, n_vertices: int) -> None:
+    if indices.size and int(indices.max()) >= n_vertices:
+        raise MeshDecodeError("Triangle index out of range")
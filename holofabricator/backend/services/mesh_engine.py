@@ -0,0 +1,122 @@
+"""Process-pool mesh generation with a bounded job queue."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .reconstruction import build_mesh_from_array
+
+logger = logging.getLogger("holofabricator.mesh_engine")
+
+MeshCallback = Callable[[str, Optional[str], Dict[str, float]], Awaitable[None]]
+
+
+class MeshEngineBusy(RuntimeError):
+    """Raised when the mesh queue is full and the caller should back off."""
+
+
+@dataclass
+class MeshJob:
+    """A single meshing request waiting for a worker process."""
+
+    scan_id: str
+    img_array: np.ndarray
+    on_done: MeshCallback
+    flip_y: bool = True
+
+
+class MeshEngine:
+    """
+    Runs Poisson meshing in worker processes so it never holds the server's GIL.
+
+    Jobs go through a bounded asyncio queue drained by one dispatcher per
+    worker process; when the queue is full ``submit`` raises ``MeshEngineBusy``
+    so the upload endpoint can answer 503 instead of piling up work.
+    """
+
+    def __init__(self, output_dir: Path, max_workers: Optional[int] = None, max_queue: int = 8):
+        self.output_dir = output_dir
+        self.max_workers = max_workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._dispatchers: List[asyncio.Task] = []
+        self._in_flight = 0
+
+    async def start(self) -> None:
+        """Spin up worker processes and queue dispatchers."""
+        if self._pool is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        self._dispatchers = [
+            asyncio.create_task(self._dispatch()) for _ in range(self.max_workers)
+        ]
+        logger.info("[MESH] Engine started: %d workers, queue size %d", self.max_workers, self.max_queue)
+
+    async def stop(self) -> None:
+        """Cancel dispatchers and shut the worker pool down."""
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self._dispatchers = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @property
+    def saturated(self) -> bool:
+        """True when a new job would be rejected."""
+        return self._queue is not None and self._queue.full()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.max_workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "in_flight": self._in_flight,
+            "max_queue": self.max_queue,
+        }
+
+    def submit(self, job: MeshJob) -> None:
+        """Enqueue a job, raising ``MeshEngineBusy`` if the queue is full."""
+        if self._queue is None:
+            raise RuntimeError("Mesh engine not started")
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull as exc:
+            raise MeshEngineBusy(f"Mesh queue full ({self.max_queue} jobs)") from exc
+
+    async def _dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job: MeshJob = await self._queue.get()
+            self._in_flight += 1
+            mesh_file: Optional[str] = None
+            timings: Dict[str, float] = {}
+            try:
+                mesh_file, timings = await loop.run_in_executor(
+                    self._pool,
+                    build_mesh_from_array,
+                    job.img_array,
+                    self.output_dir,
+                    job.scan_id,
+                    job.flip_y,
+                )
+            except Exception as exc:
+                logger.error("[MESH] Worker failed for %s: %s", job.scan_id, exc)
+            finally:
+                self._in_flight -= 1
+                self._queue.task_done()
+
+            try:
+                await job.on_done(job.scan_id, mesh_file, timings)
+            except Exception as exc:
+                logger.error("[MESH] Completion callback failed for %s: %s", job.scan_id, exc)
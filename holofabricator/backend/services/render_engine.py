@@ -0,0 +1,313 @@
+"""Long-lived headless mesh renderer producing multi-view thumbnails."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import open3d as o3d
+from PIL import Image, ImageDraw
+
+logger = logging.getLogger("holofabricator.render_engine")
+
+# (eye direction from the mesh centre, up vector) per named view
+VIEWS: Dict[str, Tuple[Tuple[float, float, float], Tuple[float, float, float]]] = {
+    "front": ((0.0, 0.0, 1.0), (0.0, 1.0, 0.0)),
+    "side": ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0)),
+    "top": ((0.0, 1.0, 0.0), (0.0, 0.0, -1.0)),
+}
+BACKGROUND = (255, 255, 255)
+BASE_COLOUR = np.array([0.7, 0.7, 0.72])
+LIGHT_DIR = np.array([0.3, 0.5, 1.0]) / np.linalg.norm([0.3, 0.5, 1.0])
+
+
+class RenderEngineBusy(RuntimeError):
+    """Raised when the render queue is full and the caller should back off."""
+
+
+@dataclass
+class RenderResult:
+    """Contact sheet (all views side by side) plus the individual views."""
+
+    sheet_path: Path
+    view_paths: Dict[str, Path]
+    backend: str
+    triangles: int
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+def decimate_for_render(mesh: o3d.geometry.TriangleMesh, max_triangles: int) -> o3d.geometry.TriangleMesh:
+    """Cheaply reduce ``mesh`` to roughly ``max_triangles`` for thumbnailing.
+
+    Vertex clustering is linear in the input size, so multi-million triangle
+    scans cost about the same to thumbnail as small ones. The input mesh is
+    never modified.
+    """
+    n = len(mesh.triangles)
+    if n <= max_triangles:
+        return mesh
+    extent = float(np.max(mesh.get_axis_aligned_bounding_box().get_extent()))
+    # A surface of side L clustered at voxel v has ~2 * (L / v)^2 triangles
+    voxel = extent / np.sqrt(max_triangles / 2.0)
+    simplified = mesh
+    for _ in range(5):
+        simplified = mesh.simplify_vertex_clustering(
+            voxel_size=voxel, contraction=o3d.geometry.SimplificationContraction.Average
+        )
+        if len(simplified.triangles) <= max_triangles:
+            break
+        voxel *= 1.5
+    logger.info("[RENDER] Decimated %d -> %d triangles", n, len(simplified.triangles))
+    return simplified
+
+
+def _view_basis(view: str) -> np.ndarray:
+    """Rows are the screen right, screen up and towards-camera axes."""
+    eye, up = (np.asarray(v, dtype=np.float64) for v in VIEWS[view])
+    right = np.cross(up, eye)
+    return np.stack([right, up, eye])
+
+
+def software_render(
+    vertices: np.ndarray,
+    triangles: np.ndarray,
+    colours: Optional[np.ndarray],
+    view: str,
+    size: Tuple[int, int],
+) -> Image.Image:
+    """Orthographic painter's-algorithm render with Lambert shading.
+
+    Pure NumPy/PIL, so it works on servers with neither a display nor EGL.
+    Meshes without triangles are drawn as points.
+    """
+    width, height = size
+    image = Image.new("RGB", size, BACKGROUND)
+    if len(vertices) == 0:
+        return image
+
+    screen = (vertices - vertices.mean(axis=0)) @ _view_basis(view).T
+    span = np.ptp(screen[:, :2], axis=0).max() or 1.0
+    scale = 0.9 * min(width, height) / span
+    xy = np.empty((len(screen), 2))
+    xy[:, 0] = width / 2.0 + screen[:, 0] * scale
+    xy[:, 1] = height / 2.0 - screen[:, 1] * scale
+    vert_rgb = colours if colours is not None and len(colours) == len(vertices) else None
+    draw = ImageDraw.Draw(image)
+
+    if len(triangles) == 0:
+        order = np.argsort(screen[:, 2])
+        rgb = vert_rgb[order] if vert_rgb is not None else np.tile(BASE_COLOUR, (len(order), 1))
+        fill = (np.clip(rgb, 0.0, 1.0) * 255).astype(np.uint8)
+        for (x, y), c in zip(xy[order], fill):
+            draw.point((x, y), fill=tuple(c))
+        return image
+
+    corners = screen[triangles]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = normals / np.where(lengths > 0, lengths, 1.0)
+    # Two-sided lighting: scans are rarely consistently oriented
+    shade = 0.25 + 0.75 * np.abs(normals @ LIGHT_DIR)
+
+    rgb = vert_rgb[triangles].mean(axis=1) if vert_rgb is not None else np.tile(BASE_COLOUR, (len(triangles), 1))
+    fill = (np.clip(rgb * shade[:, None], 0.0, 1.0) * 255).astype(np.uint8)
+
+    order = np.argsort(corners[:, :, 2].mean(axis=1))  # far to near
+    polys = xy[triangles[order]].reshape(-1, 6).tolist()
+    for poly, c in zip(polys, map(tuple, fill[order].tolist())):
+        draw.polygon(poly, fill=c)
+    return image
+
+
+class _OffscreenBackend:
+    """Filament-based ``OffscreenRenderer``; must live on a single thread."""
+
+    name = "offscreen"
+
+    def __init__(self, width: int, height: int):
+        from open3d.visualization import rendering
+
+        self.renderer = rendering.OffscreenRenderer(width, height)
+        self.renderer.scene.set_background([1.0, 1.0, 1.0, 1.0])
+        self.material = rendering.MaterialRecord()
+        self.material.shader = "defaultLit"
+        self.point_material = rendering.MaterialRecord()
+        self.point_material.shader = "defaultUnlit"
+        self.point_material.point_size = 3.0
+
+    def render(self, mesh: o3d.geometry.TriangleMesh, views: List[str]) -> Dict[str, Image.Image]:
+        scene = self.renderer.scene
+        scene.clear_geometry()
+        if mesh.has_triangles():
+            if not mesh.has_vertex_normals():
+                mesh = o3d.geometry.TriangleMesh(mesh)
+                mesh.compute_vertex_normals()
+            scene.add_geometry("mesh", mesh, self.material)
+        else:
+            cloud = o3d.geometry.PointCloud(mesh.vertices)
+            if mesh.has_vertex_colors():
+                cloud.colors = mesh.vertex_colors
+            scene.add_geometry("mesh", cloud, self.point_material)
+
+        bbox = mesh.get_axis_aligned_bounding_box()
+        center = bbox.get_center()
+        distance = 1.8 * float(np.max(bbox.get_extent()) or 1.0)
+        images = {}
+        for view in views:
+            eye_dir, up = VIEWS[view]
+            eye = center + distance * np.asarray(eye_dir)
+            self.renderer.setup_camera(45.0, center, eye, np.asarray(up))
+            images[view] = Image.fromarray(np.asarray(self.renderer.render_to_image()))
+        return images
+
+
+class _SoftwareBackend:
+    name = "software"
+
+    def __init__(self, width: int, height: int):
+        self.size = (width, height)
+
+    def render(self, mesh: o3d.geometry.TriangleMesh, views: List[str]) -> Dict[str, Image.Image]:
+        vertices = np.asarray(mesh.vertices)
+        triangles = np.asarray(mesh.triangles)
+        colours = np.asarray(mesh.vertex_colors) if mesh.has_vertex_colors() else None
+        return {view: software_render(vertices, triangles, colours, view, self.size) for view in views}
+
+
+@dataclass
+class _RenderJob:
+    mesh: o3d.geometry.TriangleMesh
+    name: str
+    future: asyncio.Future
+    loop: asyncio.AbstractEventLoop
+
+
+class RenderEngine:
+    """
+    One warm rendering context on a dedicated thread, fed by a bounded queue.
+
+    GL contexts are bound to the thread that created them, so every job runs
+    on the same worker instead of building a Visualizer window per request.
+    ``backend="auto"`` tries Open3D's ``OffscreenRenderer`` (EGL, or Mesa when
+    ``OPEN3D_CPU_RENDERING=true``) and drops to the NumPy rasteriser if no
+    context can be created; ``backend="software"`` skips straight to it.
+    """
+
+    def __init__(self, output_dir: Path, width: int = 512, height: int = 512,
+                 views: Optional[List[str]] = None, max_triangles: int = 200_000,
+                 software_max_triangles: int = 60_000, max_queue: int = 16, backend: str = "auto"):
+        self.output_dir = output_dir
+        self.width = width
+        self.height = height
+        self.views = list(views or VIEWS)
+        self.max_triangles = max_triangles
+        self.software_max_triangles = software_max_triangles
+        self.max_queue = max_queue
+        self.backend_name = backend
+        self._backend = None
+        self._queue: "queue.Queue[Optional[_RenderJob]]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self.rendered = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="render-engine", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    @property
+    def saturated(self) -> bool:
+        return self._queue.full()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": self._backend.name if self._backend else self.backend_name,
+            "views": self.views,
+            "queued": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "rendered": self.rendered,
+            "failed": self.failed,
+        }
+
+    async def render(self, mesh: o3d.geometry.TriangleMesh, name: str) -> Optional[RenderResult]:
+        """Render every view of ``mesh``; ``None`` if the mesh cannot be drawn"""
+        if self._thread is None:
+            raise RuntimeError("Render engine not started")
+        loop = asyncio.get_running_loop()
+        job = _RenderJob(mesh, name, loop.create_future(), loop)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full as exc:
+            raise RenderEngineBusy(f"Render queue full ({self.max_queue} jobs)") from exc
+        return await job.future
+
+    def _create_backend(self):
+        if self.backend_name != "software":
+            try:
+                backend = _OffscreenBackend(self.width, self.height)
+                logger.info("[RENDER] Using Open3D OffscreenRenderer")
+                return backend
+            except Exception as exc:
+                logger.warning("[RENDER] OffscreenRenderer unavailable (%s), using software renderer", exc)
+        return _SoftwareBackend(self.width, self.height)
+
+    def _run(self) -> None:
+        self._backend = self._create_backend()
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                result = self._render(job.mesh, job.name)
+            except Exception as exc:
+                logger.error("[RENDER] Render failed for %s: %s", job.name, exc)
+                self.failed += 1
+                result = None
+            job.loop.call_soon_threadsafe(_resolve, job.future, result)
+
+    def _render(self, mesh: o3d.geometry.TriangleMesh, name: str) -> Optional[RenderResult]:
+        if not mesh.has_vertices():
+            return None
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
+        limit = self.software_max_triangles if self._backend.name == "software" else self.max_triangles
+        mesh = decimate_for_render(mesh, limit)
+        timings["decimate"] = round((time.perf_counter() - started) * 1000.0, 2)
+
+        started = time.perf_counter()
+        images = self._backend.render(mesh, self.views)
+        timings["render"] = round((time.perf_counter() - started) * 1000.0, 2)
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        view_paths = {}
+        sheet = Image.new("RGB", (self.width * len(images), self.height), BACKGROUND)
+        for i, (view, image) in enumerate(images.items()):
+            image = image.convert("RGB")
+            sheet.paste(image, (i * self.width, 0))
+            view_paths[view] = self.output_dir / f"{name}_render_{view}.jpg"
+            image.save(view_paths[view], "JPEG", quality=90)
+        sheet_path = self.output_dir / f"{name}_render.jpg"
+        sheet.save(sheet_path, "JPEG", quality=90)
+
+        self.rendered += 1
+        return RenderResult(sheet_path, view_paths, self._backend.name, len(mesh.triangles), timings)
+
+
+def _resolve(future: asyncio.Future, result: Optional[RenderResult]) -> None:
+    if not future.done():
+        future.set_result(result)
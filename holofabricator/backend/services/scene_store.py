@@ -0,0 +1,218 @@
+"""
+Incremental WebXR scene store
+Headsets resend the same anchored mesh (same semantic label) every few
+seconds with small changes. Each anchor keeps one scan, one PLY and a spatial
+hash of its vertices; a new upload only gets written, rendered and analyzed
+when its geometry differs from the stored one by more than a threshold.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("holofabricator.scene_store")
+
+VOXEL_SIZE = 0.01         # metres; vertices closer than this hash together
+CHANGE_THRESHOLD = 0.05   # share of occupied voxels that must change to re-analyze
+
+# 21 bits per axis keeps +-10 km of 1 cm voxels in one int64
+_AXIS_BITS = 21
+_AXIS_OFFSET = 1 << (_AXIS_BITS - 1)
+_AXIS_MASK = (1 << _AXIS_BITS) - 1
+_NEIGHBOUR_OFFSETS = np.array([
+    (dx << (2 * _AXIS_BITS)) + (dy << _AXIS_BITS) + dz
+    for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+], dtype=np.int64)
+
+# Persistent tier hooks: load(room_id, anchor_key) -> row dict | None, store(**row)
+LoadFn = Callable[[str, str], Awaitable[Optional[Dict[str, Any]]]]
+StoreFn = Callable[..., Awaitable[None]]
+
+
+def vertex_keys(vertices: np.ndarray, voxel_size: float = VOXEL_SIZE) -> np.ndarray:
+    """Sorted unique int64 voxel hashes of the occupied cells"""
+    if len(vertices) == 0:
+        return np.empty(0, dtype=np.int64)
+    cells = np.floor(np.asarray(vertices, dtype=np.float64) / voxel_size).astype(np.int64)
+    cells = (cells + _AXIS_OFFSET) & _AXIS_MASK
+    keys = (cells[:, 0] << (2 * _AXIS_BITS)) | (cells[:, 1] << _AXIS_BITS) | cells[:, 2]
+    return np.unique(keys)
+
+
+def _covered(keys: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """Mask of ``keys`` with an occupied voxel in ``other`` at most one cell away"""
+    hit = np.zeros(len(keys), dtype=bool)
+    if len(other) == 0:
+        return hit
+    for offset in _NEIGHBOUR_OFFSETS:
+        candidates = keys + offset
+        idx = np.minimum(np.searchsorted(other, candidates), len(other) - 1)
+        hit |= other[idx] == candidates
+    return hit
+
+
+def geometry_change(old_keys: np.ndarray, new_keys: np.ndarray) -> float:
+    """
+    Share of occupied voxels (in either set) with no counterpart within one
+    cell in the other set: 0 = same surface, 1 = disjoint. The one-cell slack
+    keeps sensor jitter across voxel boundaries from counting as change.
+    """
+    total = len(old_keys) + len(new_keys)
+    if total == 0:
+        return 0.0
+    matched = int(_covered(new_keys, old_keys).sum()) + int(_covered(old_keys, new_keys).sum())
+    return 1.0 - matched / total
+
+
+@dataclass
+class AnchorState:
+    """Latest accepted geometry and scan for one anchor in a room."""
+
+    room_id: str
+    anchor_key: str
+    scan_id: str
+    keys: np.ndarray
+    revision: int = 0
+    vertex_count: int = 0
+    triangle_count: int = 0
+    semantic_label: Optional[str] = None
+    updated_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "AnchorState":
+        row = dict(row)
+        row["keys"] = np.frombuffer(row.pop("vertex_keys"), dtype=np.int64)
+        return cls(**row)
+
+    def to_row(self) -> Dict[str, Any]:
+        return {
+            "room_id": self.room_id,
+            "anchor_key": self.anchor_key,
+            "scan_id": self.scan_id,
+            "revision": self.revision,
+            "vertex_count": self.vertex_count,
+            "triangle_count": self.triangle_count,
+            "semantic_label": self.semantic_label,
+            "vertex_keys": self.keys.astype(np.int64).tobytes(),
+            "updated_at": self.updated_at,
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "anchor": self.anchor_key,
+            "scan_id": self.scan_id,
+            "semantic_label": self.semantic_label,
+            "revision": self.revision,
+            "vertices": self.vertex_count,
+            "triangles": self.triangle_count,
+            "updated_at": self.updated_at,
+        }
+
+
+@dataclass
+class AnchorUpdate:
+    """Outcome of comparing an upload against the anchor's stored geometry."""
+
+    state: Optional[AnchorState]
+    keys: np.ndarray
+    change: float
+    changed: bool
+
+
+class SceneStore:
+    """
+    Per-room registry of anchors, backed by optional persistent hooks (the
+    scans database) so skipping survives restarts. Callers hold ``lock()`` for
+    an anchor across ``compare`` and ``commit`` (or ``record_skip``) so two
+    uploads of the same anchor never both re-analyze.
+    """
+
+    def __init__(self, voxel_size: float = VOXEL_SIZE, change_threshold: float = CHANGE_THRESHOLD,
+                 load: Optional[LoadFn] = None, store: Optional[StoreFn] = None):
+        self.voxel_size = voxel_size
+        self.change_threshold = change_threshold
+        self._load = load
+        self._store = store
+        self._anchors: Dict[Tuple[str, str], AnchorState] = {}
+        # lock and number of holders/waiters, dropped when that reaches 0
+        self._locks: Dict[Tuple[str, str], List[Any]] = {}
+        self.accepted = 0
+        self.skipped = 0
+
+    @asynccontextmanager
+    async def lock(self, room_id: str, anchor_key: str) -> AsyncIterator[None]:
+        """Hold the anchor's lock; it is forgotten once nobody holds or awaits it"""
+        key = (room_id, anchor_key)
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def _state(self, room_id: str, anchor_key: str) -> Optional[AnchorState]:
+        state = self._anchors.get((room_id, anchor_key))
+        if state is None and self._load is not None:
+            try:
+                row = await self._load(room_id, anchor_key)
+                state = AnchorState.from_row(row) if row else None
+            except Exception as e:
+                logger.warning(f"[SCENE] Persistent lookup failed: {e}")
+            if state is not None:
+                self._anchors[(room_id, anchor_key)] = state
+        return state
+
+    async def compare(self, room_id: str, anchor_key: str, vertices: np.ndarray) -> AnchorUpdate:
+        """Hash the upload and measure how far it moved from the stored anchor"""
+        state = await self._state(room_id, anchor_key)
+        keys = await asyncio.to_thread(vertex_keys, vertices, self.voxel_size)
+        if state is None:
+            return AnchorUpdate(None, keys, 1.0, True)
+
+        change = await asyncio.to_thread(geometry_change, state.keys, keys)
+        return AnchorUpdate(state, keys, change, change > self.change_threshold)
+
+    def record_skip(self) -> None:
+        """Count an upload answered from the stored anchor instead of reprocessed"""
+        self.skipped += 1
+
+    async def commit(self, room_id: str, anchor_key: str, scan_id: str, update: AnchorUpdate,
+                     vertex_count: int, triangle_count: int, semantic_label: Optional[str]) -> AnchorState:
+        """Record an accepted upload as the anchor's new geometry"""
+        previous = update.state
+        state = AnchorState(
+            room_id=room_id,
+            anchor_key=anchor_key,
+            scan_id=scan_id,
+            keys=update.keys,
+            revision=previous.revision + 1 if previous else 1,
+            vertex_count=vertex_count,
+            triangle_count=triangle_count,
+            semantic_label=semantic_label,
+        )
+        self._anchors[(room_id, anchor_key)] = state
+        self.accepted += 1
+        if self._store is not None:
+            try:
+                await self._store(**state.to_row())
+            except Exception as e:
+                logger.warning(f"[SCENE] Persistent store failed: {e}")
+        return state
+
+    def stats(self) -> Dict[str, Any]:
+        uploads = self.accepted + self.skipped
+        return {
+            "anchors": len(self._anchors),
+            "accepted": self.accepted,
+            "skipped": self.skipped,
+            "skip_rate": round(self.skipped / uploads, 3) if uploads else None,
+            "change_threshold": self.change_threshold,
+        }
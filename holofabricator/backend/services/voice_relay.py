@@ -0,0 +1,239 @@
+"""
+Bidirectional /ws/voice <-> Gemini Live relay
+Each direction goes through a bounded queue drained by its own task, so a slow
+headset never stalls Gemini and a slow Gemini never stalls the microphone.
+Mic audio is re-cut into fixed-size PCM packets; under backpressure uplink
+packets are merged and downlink packets are dropped oldest-first.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Union
+
+from .gemini_gateway import LatencyHistogram
+
+logger = logging.getLogger("holofabricator.voice_relay")
+
+MIC_SAMPLE_RATE = 16000     # Live API input: 16-bit PCM, 16 kHz, mono
+SAMPLE_WIDTH = 2
+PACKET_MS = 40              # uplink packet length (20-40 ms keeps latency low)
+UPLINK_QUEUE = 25           # ~1 s of 40 ms packets
+DOWNLINK_QUEUE = 64
+MAX_MERGED_MS = 1000        # beyond this, merged uplink audio drops its oldest part
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+# Latency from the first mic packet of a turn to the first audio reply, all sessions
+mic_to_first_audio = LatencyHistogram()
+_totals: Dict[str, int] = {"sessions": 0, "active": 0}
+
+
+def metrics_snapshot() -> Dict[str, Any]:
+    """Relay counters summed over finished sessions plus the latency histogram"""
+    return {**_totals, "mic_to_first_audio": mic_to_first_audio.snapshot()}
+
+
+class PcmPacketizer:
+    """Re-cut arbitrary PCM writes into fixed ``packet_ms`` packets."""
+
+    def __init__(self, packet_ms: int = PACKET_MS, sample_rate: int = MIC_SAMPLE_RATE,
+                 sample_width: int = SAMPLE_WIDTH):
+        self.packet_bytes = sample_rate * sample_width * packet_ms // 1000
+        self._buffer = bytearray()
+
+    def push(self, data: Buffer) -> List[bytes]:
+        self._buffer += data
+        usable = len(self._buffer) - len(self._buffer) % self.packet_bytes
+        if not usable:
+            return []
+        view = memoryview(self._buffer)
+        packets = [bytes(view[i:i + self.packet_bytes]) for i in range(0, usable, self.packet_bytes)]
+        view.release()
+        del self._buffer[:usable]
+        return packets
+
+    def flush(self) -> Optional[bytes]:
+        """Whatever is left (a short final packet), or None"""
+        if not self._buffer:
+            return None
+        tail = bytes(self._buffer)
+        self._buffer.clear()
+        return tail
+
+
+class VoiceRelay:
+    """
+    Relays one /ws/voice session to a connected ``GeminiLiveClient``.
+
+    Four tasks: client -> uplink queue, uplink queue -> Gemini, Gemini ->
+    downlink queue, downlink queue -> client. The session ends when any of
+    them finishes (client hangs up, sends {"type": "end"}, or Gemini closes).
+    """
+
+    def __init__(self, websocket, live_client, packet_ms: int = PACKET_MS,
+                 uplink_queue: int = UPLINK_QUEUE, downlink_queue: int = DOWNLINK_QUEUE,
+                 max_merged_ms: int = MAX_MERGED_MS):
+        self.websocket = websocket
+        self.live = live_client
+        self.packetizer = PcmPacketizer(packet_ms)
+        self.max_merged_bytes = self.packetizer.packet_bytes * max(1, max_merged_ms // packet_ms)
+        self.uplink_limit = uplink_queue
+        self.downlink_limit = downlink_queue
+        self._uplink: Deque[Any] = deque()
+        self._downlink: Deque[Any] = deque()
+        self._uplink_ready = asyncio.Event()
+        self._downlink_ready = asyncio.Event()
+        # A turn starts with the first uplink after turn_complete; only its
+        # first audio reply is a mic-to-first-audio sample
+        self._turn_started: Optional[float] = None
+        self._awaiting_reply = False
+        self.stats: Dict[str, Any] = {
+            "audio_in_packets": 0, "audio_in_bytes": 0,
+            "audio_out_packets": 0, "audio_out_bytes": 0,
+            "uplink_merges": 0, "uplink_dropped_bytes": 0,
+            "downlink_dropped": 0, "uplink_high_water": 0, "downlink_high_water": 0,
+            "mic_to_first_audio_ms": [],
+        }
+
+    # --- queues ---
+
+    def _enqueue_uplink(self, item: Any) -> None:
+        if isinstance(item, bytes) and len(self._uplink) >= self.uplink_limit:
+            # Gemini is behind: fold the queued audio into one larger message
+            # instead of losing speech, and only trim once that gets too long
+            merged = bytearray()
+            rest = deque()
+            for queued in self._uplink:
+                if isinstance(queued, bytes):
+                    merged += queued
+                else:
+                    rest.append(queued)
+            merged += item
+            if len(merged) > self.max_merged_bytes:
+                overflow = len(merged) - self.max_merged_bytes
+                overflow -= overflow % SAMPLE_WIDTH
+                self.stats["uplink_dropped_bytes"] += overflow
+                del merged[:overflow]
+            rest.appendleft(bytes(merged))
+            self._uplink = rest
+            self.stats["uplink_merges"] += 1
+        else:
+            self._uplink.append(item)
+        self.stats["uplink_high_water"] = max(self.stats["uplink_high_water"], len(self._uplink))
+        self._uplink_ready.set()
+
+    def _enqueue_downlink(self, item: Any) -> None:
+        if len(self._downlink) >= self.downlink_limit:
+            # The headset is behind: stale speech is worse than a gap, so drop
+            # the oldest audio (text is small and never dropped)
+            for i, queued in enumerate(self._downlink):
+                if isinstance(queued, bytes):
+                    del self._downlink[i]
+                    self.stats["downlink_dropped"] += 1
+                    break
+        self._downlink.append(item)
+        self.stats["downlink_high_water"] = max(self.stats["downlink_high_water"], len(self._downlink))
+        self._downlink_ready.set()
+
+    async def _next(self, queue: Deque[Any], ready: asyncio.Event) -> Any:
+        while not queue:
+            ready.clear()
+            await ready.wait()
+        return queue.popleft()
+
+    # --- pumps ---
+
+    async def _client_reader(self) -> None:
+        while True:
+            message = await self.websocket.receive()
+            if message.get("type") == "websocket.disconnect":
+                return
+
+            if message.get("bytes") is not None:
+                for packet in self.packetizer.push(message["bytes"]):
+                    self._enqueue_uplink(packet)
+
+            elif message.get("text") is not None:
+                data = json.loads(message["text"])
+                if data.get("type") == "text":
+                    self._enqueue_uplink({"text": data["content"]})
+                elif data.get("type") == "end":
+                    tail = self.packetizer.flush()
+                    if tail:
+                        self._enqueue_uplink(tail)
+                    # Let the last of the speech reach Gemini before tearing down
+                    for _ in range(100):
+                        if not self._uplink:
+                            break
+                        await asyncio.sleep(0.01)
+                    return
+
+    async def _gemini_writer(self) -> None:
+        while True:
+            item = await self._next(self._uplink, self._uplink_ready)
+            if self._turn_started is None:
+                self._turn_started = time.perf_counter()
+                self._awaiting_reply = True
+            if isinstance(item, bytes):
+                await self.live.send_audio(item)
+                self.stats["audio_in_packets"] += 1
+                self.stats["audio_in_bytes"] += len(item)
+            else:
+                await self.live.send_text(item["text"])
+
+    async def _gemini_reader(self) -> None:
+        async def on_audio(audio: bytes):
+            if self._awaiting_reply:
+                latency_ms = (time.perf_counter() - self._turn_started) * 1000.0
+                mic_to_first_audio.observe(latency_ms)
+                self.stats["mic_to_first_audio_ms"].append(round(latency_ms, 1))
+                self._awaiting_reply = False
+            self._enqueue_downlink(audio)
+
+        async def on_text(text: str):
+            self._enqueue_downlink({"type": "text", "content": text})
+
+        async def on_turn_complete():
+            self._turn_started = None
+            self._awaiting_reply = False
+            self._enqueue_downlink({"type": "turn_complete"})
+
+        await self.live.receive_stream(on_audio=on_audio, on_text=on_text, on_turn_complete=on_turn_complete)
+
+    async def _client_writer(self) -> None:
+        while True:
+            item = await self._next(self._downlink, self._downlink_ready)
+            if isinstance(item, bytes):
+                await self.websocket.send_bytes(item)
+                self.stats["audio_out_packets"] += 1
+                self.stats["audio_out_bytes"] += len(item)
+            else:
+                await self.websocket.send_json(item)
+
+    async def run(self) -> Dict[str, Any]:
+        """Relay until either side is done; returns the session stats"""
+        tasks = [
+            asyncio.create_task(self._client_reader(), name="voice-client-reader"),
+            asyncio.create_task(self._gemini_writer(), name="voice-gemini-writer"),
+            asyncio.create_task(self._gemini_reader(), name="voice-gemini-reader"),
+            asyncio.create_task(self._client_writer(), name="voice-client-writer"),
+        ]
+        _totals["sessions"] += 1
+        _totals["active"] += 1
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            _totals["active"] -= 1
+            for name, value in self.stats.items():
+                if isinstance(value, int) and not name.endswith("high_water"):
+                    _totals[name] = _totals.get(name, 0) + value
+        return self.stats